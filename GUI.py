@@ -6,8 +6,19 @@ from typing import Optional, Tuple, Union
 import customtkinter
 from customtkinter import *
 from tkinter import filedialog
-import lexer, finalparser
+import lexer, finalparser, plot
 import subprocess, sys, os
+import io, queue, threading, time
+
+# milliseconds between two updates of the output while a program runs, about one frame
+FRAME_MS = 16
+
+# rows of the symbol table shown at a time
+SYMTAB_PAGE_ROWS = 500
+
+# the program runs in a worker thread and Tk only draws from the main thread, so plots are rendered into memory
+# and shown in their own windows when the program ends
+plot.set_output('bytes')
 
 # FUNCTIONS
    # LIGHT SWITCH
@@ -22,6 +33,7 @@ def clear_butt():
     input.delete(1.0, tk.END)
     output.delete(1.0, tk.END)
     symtab.delete(1.0, tk.END)
+    update_symtab()
    # IMPORT
 def import_file():
     file_path = filedialog.askopenfilename(filetypes=[("Text files", "*.cash")])
@@ -30,21 +42,109 @@ def import_file():
             content = file.read()
             input.delete(1.0, tk.END) 
             input.insert(tk.END, content) 
+            update_symtab()
+   # LIVE SYMBOL TABLE
+   # the input is lexed again only around the changed lines, and the panel shows one page of the table
+live_lexer = lexer.IncrementalLexer()
+symtab_page = 0
+page_last_line = 0      # last line of the input with a row on the page, None when the page is not full
+
+def update_symtab(event=None):
+    first, removed, added = live_lexer.update(input.get("1.0", "end-1c"))
+    # a change after the last row of a full page does not change the page
+    if page_last_line is not None and first > page_last_line and symtab.get("1.0", "1.end") == lexer.SYMBOL_HEADER:
+        return
+    show_symtab_page(symtab_page)
+
+def show_symtab_page(page):
+    global symtab_page, page_last_line
+    pages = max(-(-live_lexer.row_count() // SYMTAB_PAGE_ROWS), 1)
+    symtab_page = min(max(page, 0), pages - 1)
+    rows, page_last_line = live_lexer.symbol_page(symtab_page * SYMTAB_PAGE_ROWS, SYMTAB_PAGE_ROWS)
+    symtab.delete(1.0, tk.END)
+    symtab.insert("1.0", lexer.SYMBOL_HEADER + '\n' + ''.join(row + '\n' for row in rows))
+    pagel.configure(text=f"{symtab_page + 1} / {pages}")
+
 # RUN
+   # program running in the worker thread: its parser, output queue and start time
+running = None
+
+def run_program(input_text, parser, output_queue):
+    try:
+        parser.parse_code(lexer.Lexer(input_text).pass_data())
+    finally:
+        # tells the window that the program ended
+        output_queue.put(None)
+
 def on_run_pressed():
+    global running
+    if running is not None:
+        return
     output.delete(1.0, tk.END)
-    symtab.delete(1.0, tk.END)
     
     # GET THE INPUT FROM TEXTBOX
     input_text = input.get("1.0", tk.END)
 
     # DISPLAY SYMBOL TABLE
-    symbols = lexer.run(input_text)
-    symtab.insert(tk.END, symbols)
+    # the panel is already up to date, the tokens of the live lexer are saved without lexing the input again
+    update_symtab()
+    lexer.run(input_text, live_lexer.tokens, save=bool(savesw.get()), show=False)
     
     # DISPLAY OUTPUT 
-    terminal = finalparser.lexer(input_text)
-    output.insert(tk.END, terminal)
+    # every write of the program goes to the queue, the window takes what arrived once per frame
+    output_queue = queue.Queue()
+    sink = finalparser.OutputSink([finalparser.QueueTarget(output_queue)], flush_threshold=1)
+    parser = finalparser.Parser(finalparser.Tables_Values(sink))
+    running = (parser, output_queue, time.perf_counter())
+    runb.configure(state="disabled")
+    stopb.configure(state="normal")
+    threading.Thread(target=run_program, args=(input_text, parser, output_queue), daemon=True).start()
+    root.after(FRAME_MS, poll_output)
+
+   # shows the output that arrived since the last frame and the time the program has been running
+def poll_output():
+    global running
+    parser, output_queue, started = running
+    chunks = []
+    finished = False
+    while True:
+        try:
+            text = output_queue.get_nowait()
+        except queue.Empty:
+            break
+        if text is None:
+            finished = True
+            break
+        chunks.append(text)
+    if chunks:
+        output.insert(tk.END, ''.join(chunks))
+        output.see(tk.END)
+    elapsed = time.perf_counter() - started
+    if not finished:
+        status.configure(text=f"Running {elapsed:.1f} s")
+        root.after(FRAME_MS, poll_output)
+        return
+    running = None
+    status.configure(text=f"Finished in {elapsed:.2f} s")
+    runb.configure(state="normal")
+    stopb.configure(state="disabled")
+    show_plots()
+
+   # STOP
+def on_stop_pressed():
+    if running is not None:
+        running[0].cancel()
+        status.configure(text="Stopping...")
+
+   # opens a window for every plot the program drew
+def show_plots():
+    for name, image in plot.take_rendered():
+        window = CTkToplevel(root)
+        window.title(name)
+        photo = ImageTk.PhotoImage(PIL.Image.open(io.BytesIO(image)))
+        label = tk.Label(window, image=photo)
+        label.image = photo
+        label.pack()
 
 # MAIN COLORS
 customtkinter.set_appearance_mode("Light")  
@@ -88,6 +188,7 @@ symtab = customtkinter.CTkTextbox(root, width=150, height=250, corner_radius=20,
 symtab.grid(row=2, column=1, padx=(0, 20), pady=(50, 20), sticky="nsew")
 #symtab.tag_config("center", justify=customtkinter.CENTER)
 #symtable = tk.Text(symtab, text="")
+input.bind("<KeyRelease>", update_symtab)
 
 # BUTTONS
    # LIGHT SWITCH
@@ -102,6 +203,23 @@ clrb.grid(row=3, column=1, padx=20, pady=10, sticky="n")
    # IMPORT
 impb = customtkinter.CTkButton(root, text="IMPORT", font=customtkinter.CTkFont(size=15, weight="bold"), command=import_file)
 impb.grid(row=3, column=0, padx=(0, 200), pady=10, sticky="ne")
+   # STOP
+stopb = customtkinter.CTkButton(root, text="STOP", font=customtkinter.CTkFont(size=15, weight="bold"), command=on_stop_pressed, state="disabled")
+stopb.grid(row=3, column=0, padx=(0, 370), pady=10, sticky="ne")
+   # SYMBOL TABLE PAGES
+prevb = customtkinter.CTkButton(root, text="<", width=30, command=lambda: show_symtab_page(symtab_page - 1))
+prevb.grid(row=3, column=1, padx=(30, 0), pady=10, sticky="nw")
+pagel = customtkinter.CTkLabel(root, text="1 / 1", font=("",13))
+pagel.grid(row=3, column=1, padx=(70, 0), pady=10, sticky="nw")
+nextb = customtkinter.CTkButton(root, text=">", width=30, command=lambda: show_symtab_page(symtab_page + 1))
+nextb.grid(row=3, column=1, padx=(140, 0), pady=10, sticky="nw")
+   # SAVE SYMBOL TABLE
+savesw = CTkSwitch(root, text = "Save Symbol Table", onvalue=1, offvalue=0)
+savesw.select()
+savesw.grid(row=0, column=1, padx=(20, 200), pady=(40, 0), sticky="e")
+   # ELAPSED TIME
+status = customtkinter.CTkLabel(root, text="", font=("",13))
+status.grid(row=3, column=1, padx=30, pady=10, sticky="ne")
 
 # EXECUTE
 root.mainloop()
\ No newline at end of file
@@ -0,0 +1,257 @@
+import argparse
+import glob
+import io
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import plot
+from lexer import Lexer
+from finalparser import Parser, ProgramCancelled, Tables_Values, OutputSink
+from compiler import ProgramCache, TEST_WHILE
+
+"""
+Batch runner for CASH scripts.
+
+Runs many .cash scripts across a process pool, each with its own Tables_Values and Parser, the same way main.py runs
+one. Every worker imports the financial and plot functions (with numpy and the Agg backend of matplotlib) once when it
+starts, so a script only pays for lexing and running itself.
+
+With --cache DIR, the compiled program of every script is kept in DIR (see compiler.ProgramCache), so the scripts
+that did not change since the last run are not lexed or compiled again.
+
+Scripts are given as directories (every .cash file in them), glob patterns, single .cash files or manifests: text
+files that list one script, directory or pattern per line, relative to the manifest, with # for comments.
+
+For every script the output directory gets, at the script's path relative to the common directory of all the scripts:
+    <script>.out            the terminal output, as main.py would print it
+    <script>.err            the errors reported by the script, and the traceback if the runner itself failed
+    <script>.<plot>_<n>.png the plots the script drew
+and summary.json lists the status, time and files of every script.
+
+A script that runs longer than its time limit is stopped at its next loop iteration; if it is still running
+HARD_LIMIT_GRACE seconds later (deep in a call, for example), it is interrupted with SIGALRM where the platform has
+it. A single call into C code, such as a huge numpy operation, still runs to its end.
+
+Usage:
+    python batch.py scripts/ -o results                     # every .cash file in scripts/
+    python batch.py 'clients/*.cash' --workers 8 --timeout 30
+    python batch.py nightly.txt -o results                  # scripts listed in a manifest
+    python batch.py nightly.txt --cache .cash_cache         # reuses the programs compiled by the last run
+
+The exit status is 1 when a script failed, timed out or had errors.
+"""
+
+
+# seconds a script may run, and the time it gets to stop after being cancelled
+DEFAULT_TIMEOUT = 60.0
+HARD_LIMIT_GRACE = 2.0
+
+SCRIPT_EXTENSION = '.cash'
+
+# ProgramCache of the worker, set by init_worker
+_program_cache = None
+
+
+# Parser that also keeps the errors of the script apart from its output
+class BatchParser(Parser):
+    def __init__(self, table_values, program_cache=None):
+        super().__init__(table_values, program_cache=program_cache)
+        self.errors = []
+
+    def add_error(self, error_message, exception=None):
+        self.errors.append(error_message)
+        super().add_error(error_message, exception)
+
+    # an error in a while condition is only shown, not added to the output
+    def runtime_error(self, instruction, e, pc, iterators):
+        op, lineno, arg, target, alt = instruction
+        if op == TEST_WHILE:
+            self.errors.append(f"Error in line {lineno}: {e}")
+        return super().runtime_error(instruction, e, pc, iterators)
+
+
+# Finds the scripts of the sources: directories, glob patterns, .cash files or manifests.
+# Returns the absolute paths in order, without duplicates.
+def collect_scripts(sources):
+    scripts = []
+    for source in sources:
+        if os.path.isdir(source):
+            found = sorted(glob.glob(os.path.join(source, '*' + SCRIPT_EXTENSION)))
+        elif glob.has_magic(source):
+            found = sorted(glob.glob(source, recursive=True))
+        elif source.endswith(SCRIPT_EXTENSION):
+            found = [source]
+        else:
+            found = collect_scripts(read_manifest(source))
+        scripts.extend(os.path.abspath(path) for path in found)
+    return list(dict.fromkeys(scripts))
+
+# the entries of a manifest, relative to the directory of the manifest
+def read_manifest(path):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        entries = [line.strip() for line in f]
+    return [os.path.join(base, entry) for entry in entries if entry and not entry.startswith('#')]
+
+
+# runs once in every worker process, the compiled programs are kept in cache_dir when it is given
+def init_worker(cache_dir=None):
+    global _program_cache
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    plot._numpy()
+    # plots are rendered into memory and saved next to the output of the script that drew them
+    plot.set_output('bytes')
+    plot._agg_figure()
+    # get() has nobody to ask, it fails instead of waiting
+    sys.stdin = io.StringIO()
+    _program_cache = ProgramCache(cache_dir) if cache_dir is not None else None
+
+def on_alarm(signum, frame):
+    raise ProgramCancelled()
+
+# Runs CASH source with a fresh Tables_Values and Parser, in a process set up by init_worker.
+# Returns the status (ok, error, timeout or failed), the time it ran, its terminal output, its errors, the traceback
+# when the runner itself failed, and the plots it drew as (name, PNG bytes).
+def run_source(code, timeout=DEFAULT_TIMEOUT):
+    terminal = io.StringIO()
+    table_values = Tables_Values(OutputSink([terminal]))
+    parser = BatchParser(table_values, _program_cache)
+    expired = threading.Event()
+
+    def expire():
+        expired.set()
+        parser.cancel()
+
+    timer = threading.Timer(timeout, expire)
+    hard_limit = hasattr(signal, 'setitimer')
+    failure = None
+    plot.take_rendered()
+    start = time.perf_counter()
+    try:
+        if hard_limit:
+            signal.signal(signal.SIGALRM, on_alarm)
+            signal.setitimer(signal.ITIMER_REAL, timeout + HARD_LIMIT_GRACE)
+        timer.start()
+        parser.parse_code(Lexer(code).pass_data())
+    except BaseException:
+        failure = traceback.format_exc()
+    finally:
+        timer.cancel()
+        if hard_limit:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    seconds = time.perf_counter() - start
+
+    if failure is not None:
+        status = 'failed'
+    elif expired.is_set():
+        status = 'timeout'
+    elif parser.errors:
+        status = 'error'
+    else:
+        status = 'ok'
+    return {
+        'status': status,
+        'seconds': seconds,
+        'terminal': terminal.getvalue(),
+        'errors': parser.errors,
+        'failure': failure,
+        'plots': plot.take_rendered(),
+    }
+
+# Runs one script in a worker and writes its files. job is (script, output path without extension, time limit).
+# Returns the summary of the script.
+def run_script(job):
+    script, base, timeout = job
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    with open(script) as f:
+        code = f.read()
+    result = run_source(code, timeout)
+
+    with open(base + '.out', 'w') as f:
+        f.write(result['terminal'])
+    with open(base + '.err', 'w') as f:
+        f.write(''.join(error + '\n' for error in result['errors']))
+        if result['status'] == 'timeout':
+            f.write(f"Time limit of {timeout:g} seconds exceeded\n")
+        if result['failure'] is not None:
+            f.write(result['failure'])
+    plots = []
+    for count, (name, image) in enumerate(result['plots'], start=1):
+        path = f"{base}.{name}_{count}.png"
+        with open(path, 'wb') as f:
+            f.write(image)
+        plots.append(path)
+
+    return {
+        'script': script,
+        'status': result['status'],
+        'seconds': round(result['seconds'], 6),
+        'errors': len(result['errors']),
+        'output': base + '.out',
+        'error_file': base + '.err',
+        'plots': plots,
+    }
+
+
+# Runs the scripts across the pool and writes summary.json to the output directory. Returns the summary.
+def run_batch(scripts, output_dir, workers=None, timeout=DEFAULT_TIMEOUT, cache_dir=None):
+    os.makedirs(output_dir, exist_ok=True)
+    root = os.path.commonpath([os.path.dirname(script) for script in scripts]) if scripts else ''
+    jobs = [(script, os.path.join(output_dir, os.path.splitext(os.path.relpath(script, root))[0]), timeout)
+            for script in scripts]
+    start = time.perf_counter()
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(cache_dir,)) as pool:
+        futures = {pool.submit(run_script, job): job for job in jobs}
+        for future in as_completed(futures):
+            script, base, _ = futures[future]
+            try:
+                results[script] = future.result()
+            except Exception:
+                # the worker itself died, e.g. killed by the system
+                results[script] = {'script': script, 'status': 'failed', 'seconds': None, 'errors': 0,
+                                   'output': None, 'error_file': None, 'plots': [], 'failure': traceback.format_exc()}
+
+    counts = {}
+    for result in results.values():
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    summary = {
+        'scripts': len(scripts),
+        'seconds': round(time.perf_counter() - start, 6),
+        'workers': workers or os.cpu_count(),
+        'timeout': timeout,
+        'counts': counts,
+        'results': [results[script] for script in scripts],
+    }
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+        f.write(json.dumps(summary, indent=2) + '\n')
+    return summary
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Runs many CASH scripts across a process pool.')
+    arg_parser.add_argument('sources', nargs='+', help='directories, glob patterns, .cash files or manifests')
+    arg_parser.add_argument('-o', '--output', default='batch_output', help='directory of the output files')
+    arg_parser.add_argument('-w', '--workers', type=int, help='worker processes, the number of CPUs by default')
+    arg_parser.add_argument('-t', '--timeout', type=float, default=DEFAULT_TIMEOUT, help='seconds each script may run')
+    arg_parser.add_argument('--cache', metavar='DIR', help='keep the compiled programs in DIR and reuse them')
+    args = arg_parser.parse_args(argv)
+
+    scripts = collect_scripts(args.sources)
+    summary = run_batch(scripts, args.output, args.workers, args.timeout, args.cache)
+    counts = ', '.join(f"{count} {status}" for status, count in sorted(summary['counts'].items()))
+    print(f"{summary['scripts']} scripts in {summary['seconds']:.2f}s: {counts or 'nothing to run'}")
+    for result in summary['results']:
+        if result['status'] != 'ok':
+            print(f"{result['status'].upper()} {result['script']}", file=sys.stderr)
+    return 0 if summary['counts'].keys() <= {'ok'} else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import compiler
+from lexer import Lexer
+from finalparser import Parser, Tables_Values, OutputSink
+import new_function
+
+"""
+Benchmark harness for the CASH interpreter.
+
+A corpus of .cash programs is generated in memory (straight-line assignments, nested if/else, long while and for
+loops, heavy display, many user functions and large comment blocks). For every program the Lexer and the Parser are
+timed separately, and the financial functions of new_function and the plot functions of plot are timed on their own.
+Each benchmark records its best wall time, throughput (lines/s, tokens/s or iterations/s) and peak memory as
+measured by tracemalloc.
+
+Usage:
+    python benchmark.py                             # runs everything and prints the JSON report
+    python benchmark.py -o bench.json               # also writes the report to a file
+    python benchmark.py --baseline bench.json       # flags benchmarks slower than the stored baseline
+
+The exit status is 1 when a regression is found, so the script can be used as a check.
+"""
+
+
+# default size of the generated programs and number of timed runs
+DEFAULT_SCALE = 1
+DEFAULT_REPEAT = 3
+# a benchmark regresses when its time grows by more than this fraction of the baseline
+DEFAULT_TOLERANCE = 0.25
+
+
+# Corpus of generated programs
+def straight_line(size):
+    return ''.join(f"x{i} = {i} * 2 + {i % 7}\n" for i in range(size))
+
+def nested_if(size):
+    depth = 20
+    # x is only known at run time, so the optimizer cannot fold the conditions away
+    lines = ["x = int('3')\n"]
+    for block in range(size // (depth * 2)):
+        for level in range(depth):
+            lines.append(' ' * 4 * level + f"if x > {level - depth}:\n")
+        lines.append(' ' * 4 * depth + f"y = {block}\n")
+        for level in reversed(range(depth)):
+            lines.append(' ' * 4 * level + "else:\n")
+            lines.append(' ' * 4 * (level + 1) + "y = -1\n")
+    return ''.join(lines)
+
+def while_loop(size):
+    return f"i = 0\ntotal = 0\nwhile i < {size * 10}:\n    total += i\n    i++\ndisplay(total)\n"
+
+def for_loop(size):
+    return f"total = 0\nfor i in range(0, {size * 10}):\n    total += i * 2\ndisplay(total)\n"
+
+def heavy_display(size):
+    return ''.join(f"display({i} * 3)\n" for i in range(size))
+
+def functions(size):
+    count = size // 4
+    lines = []
+    for i in range(count):
+        lines.append(f"func f{i}(a, b):\n    c = a + b\n    return c * {i}\n")
+    for i in range(count):
+        lines.append(f"r = f{i}({i}, 2)\n")
+    return ''.join(lines)
+
+def comments(size):
+    block = "##\n" + "this line is inside a comment block\n" * 48 + "##\n"
+    lines = [block if i % 50 == 0 else f"# comment {i}\n" for i in range(0, size, 50)]
+    lines.append("x = 1\n")
+    return ''.join(lines)
+
+CORPUS = {
+    'straight_line': straight_line,
+    'nested_if': nested_if,
+    'while_loop': while_loop,
+    'for_loop': for_loop,
+    'heavy_display': heavy_display,
+    'functions': functions,
+    'comments': comments,
+}
+
+# builds every program of the corpus, scale 1 gives programs of about 5000 lines
+def generate_corpus(scale=DEFAULT_SCALE):
+    return {name: generator(5000 * scale) for name, generator in CORPUS.items()}
+
+
+# runs the function repeat times and returns the best time, the peak memory of one run and the last result
+def measure(function, repeat=DEFAULT_REPEAT):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak, result
+
+def record(seconds, peak, unit, count):
+    return {
+        'seconds': seconds,
+        'peak_bytes': peak,
+        unit: count,
+        f'{unit}_per_s': count / seconds if seconds else None,
+    }
+
+
+def bench_lexer(source, repeat=DEFAULT_REPEAT):
+    seconds, peak, tokens = measure(lambda: Lexer(source).tokenize(), repeat)
+    result = record(seconds, peak, 'tokens', len(tokens))
+    result['lines'] = source.count('\n')
+    return result
+
+def bench_parser(source, repeat=DEFAULT_REPEAT):
+    lines = Lexer(source).pass_data()
+
+    # the output stays in memory so printing is not part of the timing, and every run compiles the code again
+    def parse():
+        compiler._program_caches.clear()
+        table_values = Tables_Values(OutputSink(targets=[]))
+        Parser(table_values).parse_code(lines)
+        return table_values
+
+    seconds, peak, _ = measure(parse, repeat)
+    return record(seconds, peak, 'lines', source.count('\n'))
+
+def bench_financial(iterations, repeat=DEFAULT_REPEAT):
+    calls = [
+        (new_function.simple_interest, (1000, 5, 2)),
+        (new_function.compound_interest, (10000, 2, 1, 4)),
+        (new_function.simple_annuity, (100, 5, 10, 12)),
+        (new_function.stock_dividend, (5000, 100)),
+        (new_function.div_pershare, (5, 100, 10)),
+        (new_function.yield_ratio, (2, 40)),
+        (new_function.coupon_payment, (1000, 5, 2)),
+        (new_function.coupon_amount, (1000, 5, 2)),
+        (new_function.loan_principal, (20000, 5, 3, 12)),
+        (new_function.loanfv_pin, (1000, 5, 12)),
+        (new_function.loanfv_rtm, (100, 3, 12)),
+    ]
+    results = {}
+    for function, args in calls:
+        def run():
+            for _ in range(iterations):
+                function(*args)
+        seconds, peak, _ = measure(run, repeat)
+        results[function.__name__] = record(seconds, peak, 'iterations', iterations)
+    return results
+
+def bench_plot(iterations, repeat=DEFAULT_REPEAT):
+    import plot
+    # renders into memory with Agg, so the timings include drawing and encoding the PNG
+    plot.set_output('bytes')
+    calls = [
+        (plot.plot_sint, ((1000, 5, 30), (2000, 3, 30))),
+        (plot.plot_cint, ((1000, 5, 30, 4), (2000, 3, 30, 12))),
+        (plot.plot_loan, ((20000, 5, 30, 12),)),
+    ]
+    results = {}
+    for function, args in calls:
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(iterations):
+                    function(*args)
+                    plot.take_rendered()
+        seconds, peak, _ = measure(run, repeat)
+        results[function.__name__] = record(seconds, peak, 'iterations', iterations)
+    plot.set_output()
+    return results
+
+
+# runs every benchmark and returns the report as a dictionary
+def run_benchmarks(scale=DEFAULT_SCALE, repeat=DEFAULT_REPEAT, plots=True):
+    benchmarks = {}
+    for name, source in generate_corpus(scale).items():
+        benchmarks[f'lexer.{name}'] = bench_lexer(source, repeat)
+        benchmarks[f'parser.{name}'] = bench_parser(source, repeat)
+    for name, result in bench_financial(10000 * scale, repeat).items():
+        benchmarks[f'financial.{name}'] = result
+    if plots:
+        for name, result in bench_plot(5 * scale, repeat).items():
+            benchmarks[f'plot.{name}'] = result
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': scale,
+        'repeat': repeat,
+        'benchmarks': benchmarks,
+    }
+
+# returns the benchmarks of the report that are slower than the baseline by more than the tolerance
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    regressions = []
+    for name, result in report['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if not previous or not previous['seconds']:
+            continue
+        change = result['seconds'] / previous['seconds'] - 1
+        if change > tolerance:
+            regressions.append((name, previous['seconds'], result['seconds'], change))
+    return regressions
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Benchmarks the CASH lexer, parser and function library.')
+    arg_parser.add_argument('-o', '--output', help='write the JSON report to this file')
+    arg_parser.add_argument('-b', '--baseline', help='compare against a JSON report written earlier')
+    arg_parser.add_argument('--scale', type=int, default=DEFAULT_SCALE, help='size multiplier of the corpus')
+    arg_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='timed runs per benchmark')
+    arg_parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                            help='allowed slowdown against the baseline, 0.25 is 25%%')
+    arg_parser.add_argument('--no-plot', action='store_true', help='skip the plot benchmarks')
+    args = arg_parser.parse_args(argv)
+
+    report = run_benchmarks(args.scale, args.repeat, not args.no_plot)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for name, before, after, change in regressions:
+            print(f"REGRESSION {name}: {before:.4f}s -> {after:.4f}s (+{change:.0%})", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
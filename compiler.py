@@ -0,0 +1,1387 @@
+import os
+import re
+import ast
+import sys
+import mmap
+import types
+import pickle
+import marshal
+import hashlib
+import math
+import operator
+import tempfile
+from collections import OrderedDict
+
+"""
+This script defines the compile phase of the CASH interpreter. The lines returned by `Lexer.pass_data()` are parsed
+once into a tree of statements and blocks, and the tree is then lowered into a flat list of instructions that the
+`Parser` executes with a single dispatch loop. Every expression is compiled to a Python code object ahead of time, so
+a loop body that runs many times is never re-parsed or re-compiled.
+
+Key components:
+- Statement classes (`Display`, `Assign`, `If`, `While`, `For`, ...) make up the syntax tree of a program.
+- `Compiler` turns the source lines into statements and lowers them into instructions.
+- `Program` holds the source lines, the syntax tree and the instruction list of a compiled script.
+- `FunctionCode` holds the parameters of a CASH function and the Program of its body, which the `Parser` runs in a
+  new frame on every call.
+- `CodeCache` keeps the code objects of a script, shared by every Parser that runs the same script.
+- `ProgramCache` keeps compiled Programs on disk between runs, keyed by the source and the interpreter version.
+- `Optimizer` rewrites the syntax tree before it is lowered: it folds constant expressions and the names declared
+  with `constant`, removes `if` arms and loops that can never run, and hoists loop-invariant financial calls out of
+  `while` and `for` bodies.
+- `iter_statements` splits a stream of lines into complete top-level statements, so a script can be compiled and run
+  piece by piece while it is still being read.
+
+To use the compiler:
+1. Create an instance of the Compiler class with the list of code lines.
+2. Call the `compile` method to obtain a Program.
+3. Pass the Program to `Parser.run_program` to execute it.
+"""
+
+
+# Instruction opcodes
+ERROR = 1
+DISPLAY = 2
+GET = 3
+ASSIGN = 4
+AUG_ASSIGN = 5
+INCREMENT = 6
+FINANCIAL = 7
+CALL = 8
+DEF_FUNC = 9
+TEST_IF = 10
+TEST_WHILE = 11
+JUMP = 12
+FOR_SETUP = 13
+FOR_ITER = 14
+RETURN = 15
+HOIST = 16
+# only in programs compiled with trace=True, for the hooks of the Parser
+LINE = 17               # a statement of the line starts
+BLOCK_ENTER = 18        # the body of a block starts, arg is its kind: func, while, for, if, elif or else
+BLOCK_EXIT = 19         # the body of a block ends
+TRACE_RETURN = 20       # RETURN from inside blocks, target lists the (kind, lineno) of the blocks it leaves
+
+OPCODE_NAMES = {
+    ERROR: 'ERROR',
+    DISPLAY: 'DISPLAY',
+    GET: 'GET',
+    ASSIGN: 'ASSIGN',
+    AUG_ASSIGN: 'AUG_ASSIGN',
+    INCREMENT: 'INCREMENT',
+    FINANCIAL: 'FINANCIAL',
+    CALL: 'CALL',
+    DEF_FUNC: 'DEF_FUNC',
+    TEST_IF: 'TEST_IF',
+    TEST_WHILE: 'TEST_WHILE',
+    JUMP: 'JUMP',
+    FOR_SETUP: 'FOR_SETUP',
+    FOR_ITER: 'FOR_ITER',
+    RETURN: 'RETURN',
+    HOIST: 'HOIST',
+    LINE: 'LINE',
+    BLOCK_ENTER: 'BLOCK_ENTER',
+    BLOCK_EXIT: 'BLOCK_EXIT',
+    TRACE_RETURN: 'TRACE_RETURN',
+}
+
+# the same statement patterns used by Parser.execute_line
+ASSIGNMENT = re.compile(r'^([a-zA-Z_][a-zA-Z0-9_]*)\s*([+\-*\/%]?=|\+\+|--)\s*(.*?)\s*$')
+FUNCTION_DEF = re.compile(r'(func|function)\s+([a-zA-Z_][a-zA-Z0-9_]*)\((.*?)\)\s*:')
+FOR_HEADER = re.compile(r'^for\s+(.*?)\s+in\s+(.*)$')
+IDENTIFIER = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*$')
+DIRECTIVE = re.compile(r'^@([a-zA-Z_]+)\s*(?:\((.*)\))?$')
+
+FINANCIAL_FUNCTIONS = (
+    "simple_interest",
+    "compound_interest",
+    "simple_annuity",
+    "stock_dividend",
+    "div_pershare",
+    "yield_ratio",
+    "coupon_payment",
+    "coupon_amount",
+    "loan_principal",
+    "loanfv_pin",
+    "loanfv_rtm",
+)
+
+# batch versions that take lists or arrays, e.g. simple_interest_batch([1000, 2000], 5, 2)
+FINANCIAL_FUNCTIONS += tuple(f"{name}_batch" for name in FINANCIAL_FUNCTIONS)
+
+DISPLAY_SYNTAX = "Invalid syntax. Check for missing operators or unterminated string literal"
+
+# operators of the compound assignments
+AUGMENTED_OPERATORS = {
+    '+=': operator.add,
+    '-=': operator.sub,
+    '*=': operator.mul,
+    '/=': operator.truediv,
+    '%=': operator.mod,
+}
+
+
+# number of code objects kept per script, and number of scripts that keep a cache
+CODE_CACHE_SIZE = 1024
+PROGRAM_CACHE_SIZE = 16
+
+# bytes the on-disk program cache may take before the least recently used programs are removed
+DISK_CACHE_SIZE = 64 << 20
+
+# number of results kept per function when @memoize is used without a size
+MEMO_SIZE = 256
+
+
+# LRU cache of the code objects compiled for one script, keyed by (line number, source text, mode)
+class CodeCache:
+    def __init__(self, maxsize=CODE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.codes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # returns the code object of the source, compiling it on the first use
+    def compile(self, lineno, source, mode='eval'):
+        key = (lineno, source, mode)
+        code = self.codes.get(key)
+        if code is not None:
+            self.hits += 1
+            self.codes.move_to_end(key)
+            return code
+        self.misses += 1
+        # eval() ignores the leading spaces of a string, compile() does not
+        text = source.lstrip(' \t') if mode == 'eval' else source
+        code = compile(text, '<string>', mode)
+        self.codes[key] = code
+        if len(self.codes) > self.maxsize:
+            self.codes.popitem(last=False)
+        return code
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.codes), 'maxsize': self.maxsize}
+
+    def __repr__(self):
+        return f"CodeCache(hits={self.hits}, misses={self.misses}, size={len(self.codes)})"
+
+
+# caches of the scripts that were run, keyed by a digest of the source text so the scripts themselves are not kept
+_program_caches = OrderedDict()
+
+
+# returns the digest that identifies a list of code lines
+def source_digest(lines):
+    digest = hashlib.blake2b(digest_size=16)
+    for line in lines:
+        digest.update(line.encode('utf-8', 'surrogatepass'))
+        digest.update(b'\n')
+    return digest.digest()
+
+
+# returns the code cache shared by every Parser running the same list of code lines
+def get_code_cache(lines):
+    key = source_digest(lines)
+    cache = _program_caches.get(key)
+    if cache is None:
+        cache = _program_caches[key] = CodeCache()
+        if len(_program_caches) > PROGRAM_CACHE_SIZE:
+            _program_caches.popitem(last=False)
+    else:
+        _program_caches.move_to_end(key)
+    return cache
+
+
+# Format of the files of a ProgramCache, bumped when the Program, Expression or TokenBuffer classes change. The
+# interpreter version also covers the Python version (code objects are stored with marshal) and the source of the
+# compiler and the lexer, so a program is never loaded by an interpreter that would compile it differently.
+CACHE_FORMAT = 1
+CACHE_MAGIC = b'CASHPRG1'
+CACHE_EXTENSION = '.cashc'
+_VERSIONED_FILES = ('compiler.py', 'lexer.py')
+_interpreter_version = None
+
+
+# returns the digest of everything a compiled program depends on besides its source
+def interpreter_version():
+    global _interpreter_version
+    if _interpreter_version is None:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{CACHE_FORMAT} {sys.implementation.cache_tag} {marshal.version}".encode())
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in _VERSIONED_FILES:
+            with open(os.path.join(directory, name), 'rb') as f:
+                digest.update(f.read())
+        _interpreter_version = digest.digest()
+    return _interpreter_version
+
+
+# removes a file of the cache, another process may have removed it already
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# pickles code objects with marshal, the rest of a Program pickles as it is
+class ProgramPickler(pickle.Pickler):
+    dispatch_table = {types.CodeType: lambda code: (marshal.loads, (marshal.dumps(code),))}
+
+
+# a program loaded from a ProgramCache, with the tokens of its source when they were stored
+class CachedProgram:
+    def __init__(self, program, tokens=None):
+        self.program = program          # compiled Program
+        self.tokens = tokens            # TokenBuffer of the source, for the symbol table
+
+    def __repr__(self):
+        return f"CachedProgram({self.program!r})"
+
+
+# Directory of compiled programs, so a script that did not change since its last run skips lexing, parsing,
+# optimization and compilation. Every file holds CACHE_MAGIC, the interpreter version and the pickled program, and is
+# read back through mmap. Files are written under a temporary name and renamed, so processes sharing the directory
+# never read half a file. Once the files take more than max_bytes, the least recently used ones are removed.
+class ProgramCache:
+    def __init__(self, directory, max_bytes=DISK_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    # file of the program compiled from the lines, with or without the optimizer and the LINE instructions
+    def path(self, lines, optimize=True, trace=False):
+        digest = hashlib.blake2b(source_digest(lines), digest_size=16, key=interpreter_version())
+        digest.update(b'O' if optimize else b'-')
+        digest.update(b'T' if trace else b'-')
+        return os.path.join(self.directory, digest.hexdigest() + CACHE_EXTENSION)
+
+    # returns the CachedProgram of the lines, or None when it is not in the cache
+    def load(self, lines, optimize=True, trace=False):
+        path = self.path(lines, optimize, trace)
+        header = CACHE_MAGIC + interpreter_version()
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:len(header)] != header:
+                    raise ValueError(f"{path} is not a program of this interpreter")
+                data.seek(len(header))
+                entry = pickle.load(data)
+            # the file was used, it is the last to be evicted
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # a damaged or foreign file is compiled again and replaced
+            self.misses += 1
+            remove_file(path)
+            return None
+        self.hits += 1
+        return entry
+
+    # stores the program compiled from the lines, returns False when it cannot be pickled
+    def store(self, lines, program, tokens=None, optimize=True, trace=False):
+        path = self.path(lines, optimize, trace)
+        fd, temporary = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(CACHE_MAGIC + interpreter_version())
+                ProgramPickler(f, pickle.HIGHEST_PROTOCOL).dump(CachedProgram(program, tokens))
+            os.replace(temporary, path)
+        except (pickle.PicklingError, TypeError, AttributeError, ValueError, RecursionError, OSError):
+            remove_file(temporary)
+            return False
+        self.evict()
+        return True
+
+    # removes the least recently used files until the cache fits in max_bytes
+    def evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as found:
+            for entry in found:
+                if entry.name.endswith(CACHE_EXTENSION):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            remove_file(path)
+            total -= size
+        return total
+
+    # removes every cached program
+    def clear(self):
+        with os.scandir(self.directory) as found:
+            for entry in found:
+                if entry.name.endswith(CACHE_EXTENSION):
+                    remove_file(entry.path)
+
+    def stats(self):
+        with os.scandir(self.directory) as found:
+            sizes = [entry.stat().st_size for entry in found if entry.name.endswith(CACHE_EXTENSION)]
+        return {'hits': self.hits, 'misses': self.misses, 'files': len(sizes), 'bytes': sum(sizes),
+                'max_bytes': self.max_bytes}
+
+    def __repr__(self):
+        return f"ProgramCache({self.directory!r}, hits={self.hits}, misses={self.misses})"
+
+
+# an expression compiled once to a Python code object
+class Expression:
+    def __init__(self, source, code):
+        self.source = source            # expression text found in the code
+        self.code = code                # code object of the expression
+
+    def __repr__(self):
+        return f"Expression({self.source!r})"
+
+
+# handles a statement that could not be compiled; the message is reported when the line is reached
+class CompileError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+# Syntax tree of a CASH program
+class Statement:
+    def __init__(self, lineno):
+        self.lineno = lineno            # line number of the statement (1-based)
+
+    def __repr__(self):
+        fields = ', '.join(f"{key}={value!r}" for key, value in vars(self).items())
+        return f"{type(self).__name__}({fields})"
+
+
+class Invalid(Statement):
+    def __init__(self, lineno, message):
+        super().__init__(lineno)
+        self.message = message          # error message shown when the line runs
+
+
+class Display(Statement):
+    def __init__(self, lineno, expression):
+        super().__init__(lineno)
+        self.expression = expression
+
+
+class Get(Statement):
+    def __init__(self, lineno, prompt):
+        super().__init__(lineno)
+        self.prompt = prompt
+
+
+class Assign(Statement):
+    def __init__(self, lineno, name, op, expression, constant=False):
+        super().__init__(lineno)
+        self.name = name
+        self.op = op                    # '=', '+=', '-=', '*=', '/=', '%=', '++' or '--'
+        self.expression = expression    # None for '++' and '--'
+        self.constant = constant        # declared with the constant reserved word
+
+
+class FinancialCall(Statement):
+    def __init__(self, lineno, expression):
+        super().__init__(lineno)
+        self.expression = expression
+
+
+class FunctionCall(Statement):
+    def __init__(self, lineno, expression):
+        super().__init__(lineno)
+        self.expression = expression
+
+
+class FunctionDef(Statement):
+    def __init__(self, lineno, name, params, defaults, body):
+        super().__init__(lineno)
+        self.name = name
+        self.params = params            # parameter names
+        self.defaults = defaults        # {parameter name: Expression} of the parameters with a default value
+        self.body = body
+        self.pure = False               # marked with @pure, its results may be memoized
+
+
+# evaluates a loop-invariant call once before the loop, see Optimizer.hoist
+class Hoist(Statement):
+    def __init__(self, lineno, name, call):
+        super().__init__(lineno)
+        self.name = name                # hidden name that holds the value of the call, outside the variables
+        self.call = call                # Expression of (function, (arguments))
+
+
+class Return(Statement):
+    def __init__(self, lineno, expression):
+        super().__init__(lineno)
+        self.expression = expression    # None for a return without a value
+
+
+class If(Statement):
+    def __init__(self, lineno, arms, orelse):
+        super().__init__(lineno)
+        self.arms = arms                # list of (lineno, condition, body) for the if and elif arms
+        self.orelse = orelse            # body of the else arm, or None
+
+
+class While(Statement):
+    def __init__(self, lineno, condition, body):
+        super().__init__(lineno)
+        self.condition = condition
+        self.body = body
+
+
+class For(Statement):
+    def __init__(self, lineno, name, iterable, body):
+        super().__init__(lineno)
+        self.name = name
+        self.iterable = iterable
+        self.body = body
+
+
+# a compiled CASH program
+class Program:
+    def __init__(self, lines, statements, instructions, directives=None):
+        self.lines = lines                      # list of the code per line
+        self.statements = statements            # syntax tree of the program
+        self.instructions = instructions        # list of (opcode, lineno, arg, target, alt)
+        self.directives = directives or {}      # script options set with directives, e.g. {'memoize': 256}
+
+    # returns a readable listing of the instructions
+    def disassemble(self):
+        listing = []
+        for pc, (op, lineno, arg, target, alt) in enumerate(self.instructions):
+            row = f"{pc:>5}  line {lineno:<5} {OPCODE_NAMES[op]:<11}"
+            if arg is not None:
+                row += f" {arg!r}"
+            if isinstance(target, int):
+                row += f" -> {target}"
+            elif target is not None:
+                row += f" {target}"
+            if alt is not None:
+                row += f" / {alt}"
+            listing.append(row.rstrip())
+            if op == DEF_FUNC:
+                listing.extend('       | ' + line for line in arg.program.disassemble().splitlines())
+        return '\n'.join(listing)
+
+    def __repr__(self):
+        return f"Program(lines={len(self.lines)}, instructions={len(self.instructions)})"
+
+
+# a compiled CASH function, its body is a Program that runs in a new frame on every call
+class FunctionCode:
+    def __init__(self, name, params, defaults, program, pure=False):
+        self.name = name
+        self.params = params            # parameter names
+        self.defaults = defaults        # {parameter name: Expression} of the parameters with a default value
+        self.program = program          # compiled body
+        self.pure = pure                # marked with @pure, its results may be memoized
+
+    def __repr__(self):
+        return f"FunctionCode({self.name}({', '.join(self.params)}))"
+
+
+class Compiler:
+
+    def __init__(self, lines, cache=None, first_lineno=1, optimizer=None, trace=False):
+        self.lines = lines                  # list of the code per line
+        self.instructions = []
+        self.cache = cache if cache is not None else CodeCache()
+        self.first_lineno = first_lineno    # line number of the first line in the script
+        self.optimizer = optimizer          # Optimizer applied to the syntax tree, None to lower it as parsed
+        self.function_depth = 0             # number of function bodies around the line being parsed
+        self.directives = {}                # script options set with directives
+        self.trace = trace                  # emit the LINE and BLOCK instructions the hooks of the Parser need
+        self.open_blocks = []               # (kind, lineno) of the traced blocks around the statement being lowered
+
+    def compile(self):
+        statements = self.parse_block(0, -1)[0]
+        if self.optimizer is not None:
+            statements = self.optimizer.optimize(statements, self.cache)
+        self.instructions = []
+        self.lower_block(statements)
+        return Program(self.lines, statements, self.instructions, self.directives)
+
+    # checks the proper indentation
+    def get_indent_level(self, line):
+        return len(line) - len(line.lstrip())
+
+    # skips empty lines and comments, returns the index of the next line of code
+    def skip_trivia(self, index):
+        while index < len(self.lines):
+            line = self.lines[index].strip()
+            if not line:
+                index += 1
+            elif line.startswith('##'):
+                # multiline comment, ends on the line that ends with ##
+                if len(line) > 2 and line.endswith('##'):
+                    index += 1
+                    continue
+                index += 1
+                while index < len(self.lines) and not self.lines[index].strip().endswith('##'):
+                    index += 1
+                index += 1
+            elif line.startswith('#'):
+                index += 1
+            else:
+                break
+        return index
+
+    # parses the statements indented deeper than the parent line
+    def parse_block(self, index, parent_indent):
+        statements = []
+        while True:
+            index = self.skip_trivia(index)
+            if index >= len(self.lines) or self.get_indent_level(self.lines[index]) <= parent_indent:
+                break
+            statement, index = self.parse_statement(index)
+            if statement is not None:
+                statements.append(statement)
+        return statements, index
+
+    # compiles an expression, a source that cannot be compiled is reported as a SyntaxError
+    def expression(self, source, lineno):
+        try:
+            return Expression(source, self.cache.compile(lineno, source))
+        except ValueError as e:
+            raise SyntaxError(str(e))
+
+    # maps the line to the statement it represents
+    def parse_statement(self, index):
+        raw = self.lines[index]
+        line = raw.strip()
+        lineno = index + self.first_lineno
+        indent = self.get_indent_level(raw)
+
+        if line.startswith("display("):
+            return self.parse_display(line, lineno), index + 1
+        elif line.startswith("get("):
+            return self.parse_get(line, lineno), index + 1
+        elif line.startswith("if "):
+            return self.parse_if(line, lineno, index, indent)
+        elif line.startswith("for "):
+            return self.parse_for(line, lineno, index, indent)
+        elif line.startswith("while "):
+            return self.parse_while(line, lineno, index, indent)
+        elif ASSIGNMENT.match(line):
+            return self.parse_assignment(line, lineno), index + 1
+        elif line.startswith("func ") or line.startswith("function "):
+            return self.parse_function(line, lineno, index, indent)
+        elif line.startswith("constant "):
+            return self.parse_constant(line, lineno), index + 1
+        elif line == "return" or line.startswith("return ") or line.startswith("return("):
+            return self.parse_return(line, lineno), index + 1
+        elif line.startswith("@"):
+            return self.parse_directive(line, lineno, index)
+        elif line.startswith("else") or line.startswith("elif "):
+            # an else without an if is ignored, like any unknown line
+            return None, index + 1
+
+        for prefix in FINANCIAL_FUNCTIONS:
+            if line.startswith(f"{prefix}("):
+                return self.parse_financial(line, lineno), index + 1
+
+        if line.endswith(")") and "(" in line:
+            try:
+                return FunctionCall(lineno, self.expression(line, lineno)), index + 1
+            except SyntaxError:
+                return Invalid(lineno, f"Error in line {lineno}: Function name does not exist"), index + 1
+
+        return None, index + 1
+
+    def parse_display(self, line, lineno):
+        if not line.endswith(")"):
+            return Invalid(lineno, f"Error in line {lineno}: {DISPLAY_SYNTAX}")
+        try:
+            return Display(lineno, self.expression(line[8:-1].strip(), lineno))
+        except SyntaxError:
+            return Invalid(lineno, f"Error in line {lineno}: {DISPLAY_SYNTAX}")
+
+    def parse_get(self, line, lineno):
+        if not line.endswith(")"):
+            return Invalid(lineno, f"Error in line {lineno}: Expected ')'")
+        return Get(lineno, line[4:-1])
+
+    def parse_assignment(self, line, lineno):
+        name, op, expression = ASSIGNMENT.match(line).groups()
+        if op in ('++', '--'):
+            if expression:
+                return Invalid(lineno, f"Error in line {lineno}: Invalid syntax '{op}{expression}'")
+            return Assign(lineno, name, op, None)
+        try:
+            return Assign(lineno, name, op, self.expression(expression, lineno))
+        except SyntaxError as se:
+            if op == '=':
+                return Invalid(lineno, f"Error in line {lineno}: Invalid syntax")
+            return Invalid(lineno, str(se))
+
+    # constant NAME = expression, the name cannot be assigned again
+    def parse_constant(self, line, lineno):
+        match = ASSIGNMENT.match(line[9:].strip())
+        if not match or match.group(2) != '=':
+            return Invalid(lineno, f"Error in line {lineno}: Invalid constant declaration")
+        statement = self.parse_assignment(match.group(0), lineno)
+        if isinstance(statement, Assign):
+            statement.constant = True
+        return statement
+
+    def parse_financial(self, line, lineno):
+        if not line.endswith(")"):
+            return Invalid(lineno, f"Error in line {lineno}: Expected ')'")
+        try:
+            return FinancialCall(lineno, self.expression(line, lineno))
+        except SyntaxError as se:
+            return Invalid(lineno, str(se))
+
+    # returns the condition of a block header such as 'if x > 5:'
+    def parse_header(self, line, lineno, keyword):
+        if not line.endswith(':'):
+            raise CompileError(f"Error in line {lineno}: Expected ':'")
+        try:
+            return self.expression(line[len(keyword):-1].strip(), lineno)
+        except SyntaxError as se:
+            raise CompileError(str(se))
+
+    def parse_if(self, line, lineno, index, indent):
+        arms = []
+        orelse = None
+        try:
+            condition = self.parse_header(line, lineno, "if")
+        except CompileError as ce:
+            return Invalid(lineno, ce.message), index + 1
+        body, index = self.parse_block(index + 1, indent)
+        arms.append((lineno, condition, body))
+
+        # collects the elif and else arms on the same indentation
+        while True:
+            next_index = self.skip_trivia(index)
+            if next_index >= len(self.lines) or self.get_indent_level(self.lines[next_index]) != indent:
+                break
+            next_line = self.lines[next_index].strip()
+            next_lineno = next_index + self.first_lineno
+            if next_line.startswith("elif "):
+                try:
+                    condition = self.parse_header(next_line, next_lineno, "elif")
+                except CompileError as ce:
+                    arms.append((next_lineno, Invalid(next_lineno, ce.message), []))
+                    index = next_index + 1
+                    continue
+                body, index = self.parse_block(next_index + 1, indent)
+                arms.append((next_lineno, condition, body))
+            elif next_line.startswith("else"):
+                if not next_line.endswith(':'):
+                    arms.append((next_lineno, Invalid(next_lineno, f"Error in line {next_lineno}: Expected ':'"), []))
+                    index = next_index + 1
+                    break
+                orelse, index = self.parse_block(next_index + 1, indent)
+                break
+            else:
+                break
+        return If(lineno, arms, orelse), index
+
+    def parse_while(self, line, lineno, index, indent):
+        try:
+            condition = self.parse_header(line, lineno, "while")
+        except CompileError as ce:
+            return Invalid(lineno, ce.message), index + 1
+        body, index = self.parse_block(index + 1, indent)
+        return While(lineno, condition, body), index
+
+    def parse_for(self, line, lineno, index, indent):
+        if not line.endswith(':'):
+            return Invalid(lineno, f"Error in line {lineno}: Expected ':'"), index + 1
+        match = FOR_HEADER.match(line[:-1].strip())
+        if not match:
+            message = f"Error in line {lineno}: for statement should have a valid identifier and range list"
+            return Invalid(lineno, message), index + 1
+        name, iterable = match.groups()
+        if not IDENTIFIER.match(name):
+            return Invalid(lineno, f"Error in line {lineno}: Invalid identifier '{name}'"), index + 1
+        try:
+            iterable = self.expression(iterable.strip(), lineno)
+        except SyntaxError as se:
+            return Invalid(lineno, str(se)), index + 1
+        body, index = self.parse_block(index + 1, indent)
+        return For(lineno, name, iterable, body), index
+
+    def parse_function(self, line, lineno, index, indent):
+        match = FUNCTION_DEF.match(line)
+        if not match:
+            return Invalid(lineno, f"Error in line {lineno}: Invalid function definition"), index + 1
+        keyword, func_name, params_str = match.groups()
+
+        # the body is every line indented deeper than the header, parsed like any other block
+        self.function_depth += 1
+        try:
+            body, end = self.parse_block(index + 1, indent)
+        finally:
+            self.function_depth -= 1
+
+        params = []
+        defaults = {}
+        for param in params_str.split(','):
+            name, equal, default = param.partition('=')
+            name = name.strip()
+            if not name and not equal:
+                continue
+            if not IDENTIFIER.match(name) or name in params:
+                return Invalid(lineno, f"Error in line {lineno}: Invalid parameter '{param.strip()}'"), end
+            if equal:
+                try:
+                    defaults[name] = self.expression(default.strip(), lineno)
+                except SyntaxError as se:
+                    return Invalid(lineno, f"Error in line {lineno}: {se}"), end
+            elif defaults:
+                return Invalid(lineno, f"Error in line {lineno}: Parameter '{name}' needs a default value"), end
+            params.append(name)
+        return FunctionDef(lineno, func_name, params, defaults, body), end
+
+    def parse_return(self, line, lineno):
+        if not self.function_depth:
+            return Invalid(lineno, f"Error in line {lineno}: 'return' outside function")
+        expression = line[6:].strip()
+        if not expression:
+            return Return(lineno, None)
+        try:
+            return Return(lineno, self.expression(expression, lineno))
+        except SyntaxError:
+            return Invalid(lineno, f"Error in line {lineno}: Invalid syntax")
+
+    # @memoize or @memoize(size) turns on the memo cache of pure functions for the script,
+    # @pure marks the function defined on the next line as pure
+    def parse_directive(self, line, lineno, index):
+        match = DIRECTIVE.match(line)
+        if not match:
+            return Invalid(lineno, f"Error in line {lineno}: Invalid directive"), index + 1
+        name, argument = match.groups()
+        if name == "memoize":
+            argument = (argument or '').strip()
+            if argument and not argument.isdigit():
+                return Invalid(lineno, f"Error in line {lineno}: @memoize expects a cache size"), index + 1
+            self.directives['memoize'] = int(argument) if argument else MEMO_SIZE
+            return None, index + 1
+        if name == "pure" and argument is None:
+            next_index = self.skip_trivia(index + 1)
+            if next_index < len(self.lines) and FUNCTION_DEF.match(self.lines[next_index].strip()):
+                statement, index = self.parse_statement(next_index)
+                if isinstance(statement, FunctionDef):
+                    statement.pure = True
+                return statement, index
+            return Invalid(lineno, f"Error in line {lineno}: @pure must be followed by a function definition"), index + 1
+        return Invalid(lineno, f"Error in line {lineno}: Unknown directive '@{name}'"), index + 1
+
+    # compiles the function defined on the line at index, returns its FunctionCode and the index after its body
+    def compile_function(self, index):
+        raw = self.lines[index]
+        statement, end = self.parse_function(raw.strip(), index + self.first_lineno, index, self.get_indent_level(raw))
+        if isinstance(statement, Invalid):
+            raise CompileError(statement.message)
+        return self.function_code(statement), end
+
+    # lowers the body of a function into its own Program
+    def function_code(self, statement):
+        instructions, open_blocks = self.instructions, self.open_blocks
+        self.instructions, self.open_blocks = [], []
+        self.lower_body('func', statement.lineno, statement.body)
+        program = Program(self.lines, statement.body, self.instructions)
+        self.instructions, self.open_blocks = instructions, open_blocks
+        return FunctionCode(statement.name, statement.params, statement.defaults, program, statement.pure)
+
+    # Lowers the syntax tree into instructions
+    def emit(self, op, lineno, arg=None, target=None, alt=None):
+        self.instructions.append((op, lineno, arg, target, alt))
+        return len(self.instructions) - 1
+
+    # sets the jump target of an instruction that was emitted earlier
+    def patch(self, pc, target=None, alt=None):
+        op, lineno, arg, old_target, old_alt = self.instructions[pc]
+        self.instructions[pc] = (op, lineno, arg,
+                                 old_target if target is None else target,
+                                 old_alt if alt is None else alt)
+
+    def lower_block(self, statements):
+        for statement in statements:
+            self.lower_statement(statement)
+
+    # lowers the body of a block, between BLOCK_ENTER and BLOCK_EXIT when the program is traced
+    def lower_body(self, kind, lineno, statements):
+        if not self.trace:
+            self.lower_block(statements)
+            return
+        self.emit(BLOCK_ENTER, lineno, kind)
+        self.open_blocks.append((kind, lineno))
+        self.lower_block(statements)
+        self.open_blocks.pop()
+        self.emit(BLOCK_EXIT, lineno, kind)
+
+    def lower_statement(self, statement):
+        lineno = statement.lineno
+        # a loop jumps back to the LINE of its header, so the header counts once per iteration
+        start = len(self.instructions)
+        if self.trace:
+            self.emit(LINE, lineno)
+        if isinstance(statement, Invalid):
+            self.emit(ERROR, lineno, statement.message)
+        elif isinstance(statement, Display):
+            self.emit(DISPLAY, lineno, statement.expression)
+        elif isinstance(statement, Get):
+            self.emit(GET, lineno, statement.prompt)
+        elif isinstance(statement, Assign):
+            if statement.op == '=':
+                self.emit(ASSIGN, lineno, statement.expression, alt=statement.name)
+            elif statement.op in ('++', '--'):
+                self.emit(INCREMENT, lineno, 1 if statement.op == '++' else -1, alt=statement.name)
+            else:
+                self.emit(AUG_ASSIGN, lineno, statement.expression, target=statement.op, alt=statement.name)
+        elif isinstance(statement, FinancialCall):
+            self.emit(FINANCIAL, lineno, statement.expression)
+        elif isinstance(statement, FunctionCall):
+            self.emit(CALL, lineno, statement.expression)
+        elif isinstance(statement, FunctionDef):
+            self.emit(DEF_FUNC, lineno, self.function_code(statement), alt=statement.name)
+        elif isinstance(statement, Return):
+            if self.open_blocks:
+                self.emit(TRACE_RETURN, lineno, statement.expression, target=self.open_blocks[::-1])
+            else:
+                self.emit(RETURN, lineno, statement.expression)
+        elif isinstance(statement, Hoist):
+            self.emit(HOIST, lineno, statement.call, alt=statement.name)
+        elif isinstance(statement, If):
+            self.lower_if(statement)
+        elif isinstance(statement, While):
+            test = self.emit(TEST_WHILE, lineno, statement.condition)
+            self.lower_body('while', lineno, statement.body)
+            self.emit(JUMP, lineno, target=start)
+            self.patch(test, target=len(self.instructions))
+        elif isinstance(statement, For):
+            setup = self.emit(FOR_SETUP, lineno, statement.iterable)
+            start = self.emit(FOR_ITER, lineno, alt=statement.name)
+            self.lower_body('for', lineno, statement.body)
+            # the header starts again before the next value is taken
+            if self.trace:
+                self.emit(LINE, lineno)
+            self.emit(JUMP, lineno, target=start)
+            end = len(self.instructions)
+            self.patch(setup, target=end)
+            self.patch(start, target=end)
+
+    def lower_if(self, statement):
+        exits = []
+        tests = []
+        for index, (lineno, condition, body) in enumerate(statement.arms):
+            if isinstance(condition, Invalid):
+                # an arm that failed to compile reports its error and ends the statement
+                self.emit(ERROR, lineno, condition.message)
+                exits.append(self.emit(JUMP, lineno))
+                continue
+            if self.trace and index:
+                self.emit(LINE, lineno)
+            test = self.emit(TEST_IF, lineno, condition)
+            tests.append(test)
+            self.lower_body('elif' if index else 'if', lineno, body)
+            exits.append(self.emit(JUMP, lineno))
+            self.patch(test, target=len(self.instructions))
+        if statement.orelse is not None:
+            self.lower_body('else', statement.lineno, statement.orelse)
+        end = len(self.instructions)
+        for pc in exits:
+            self.patch(pc, target=end)
+        for pc in tests:
+            self.patch(pc, alt=end)
+
+
+# values that can be written into the code when a constant expression is folded
+CONSTANT_TYPES = (int, float, bool, str, bytes, type(None))
+MAX_CONSTANT_SIZE = 4096
+
+# financial functions whose calls can be hoisted out of loops
+HOISTABLE_FUNCTIONS = frozenset(name for name in FINANCIAL_FUNCTIONS if not name.endswith('_batch'))
+
+# the value of an expression that is not known when the program is compiled
+UNKNOWN = object()
+
+
+# returns True if the value can be folded into the code
+def is_constant(value):
+    if type(value) not in CONSTANT_TYPES:
+        return False
+    if isinstance(value, (str, bytes)):
+        return len(value) <= MAX_CONSTANT_SIZE
+    if isinstance(value, int):
+        return value.bit_length() <= MAX_CONSTANT_SIZE
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return True
+
+
+# writes the source of a folded expression
+def unparse(node):
+    return ast.unparse(ConstantWriter().visit(node))
+
+
+# 0 and 0.0 or 0.0 and -0.0 are equal but print differently
+def same_value(first, second):
+    return type(first) is type(second) and repr(first) == repr(second)
+
+
+# names assigned with := inside an expression
+def walrus_names(expression):
+    if ':=' not in expression.source:
+        return set()
+    tree = ast.parse(expression.source.strip(), mode='eval')
+    return {node.target.id for node in ast.walk(tree) if isinstance(node, ast.NamedExpr)}
+
+
+# names a block of statements may assign, not counting the locals of the functions it defines
+def assigned_names(statements):
+    names = set()
+    for statement in statements:
+        if isinstance(statement, (Assign, For)):
+            names.add(statement.name)
+        elif isinstance(statement, Get):
+            names.add(statement.prompt)
+        elif isinstance(statement, FunctionDef):
+            names.add(statement.name)
+            continue
+        for value in vars(statement).values():
+            if isinstance(value, Expression):
+                names |= walrus_names(value)
+        if isinstance(statement, (While, For)):
+            names |= assigned_names(statement.body)
+        elif isinstance(statement, If):
+            for lineno, condition, body in statement.arms:
+                if isinstance(condition, Expression):
+                    names |= walrus_names(condition)
+                names |= assigned_names(body)
+            names |= assigned_names(statement.orelse or [])
+    return names
+
+
+# Replaces the names known to be constant by their values and evaluates the operators whose operands are all constant
+class ConstantFolder(ast.NodeTransformer):
+    def __init__(self, env):
+        self.env = env                  # {name: value} of the names known to be constant
+        self.changed = False
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load) and node.id in self.env:
+            self.changed = True
+            return ast.copy_location(ast.Constant(self.env[node.id]), node)
+        return node
+
+    # lambdas and comprehensions have variables of their own, they are left as written
+    def visit_Lambda(self, node):
+        return node
+
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = visit_Lambda
+
+    def visit_IfExp(self, node):
+        node = self.generic_visit(node)
+        if isinstance(node.test, ast.Constant):
+            self.changed = True
+            return node.body if node.test.value else node.orelse
+        return node
+
+    def visit_Constant(self, node):
+        return node
+
+    def visit_BinOp(self, node):
+        node = self.generic_visit(node)
+        if isinstance(node.left, ast.Constant) and isinstance(node.right, ast.Constant) and self.small(node):
+            return self.fold(node, BINARY_OPERATORS[type(node.op)], node.left.value, node.right.value)
+        return node
+
+    def visit_UnaryOp(self, node):
+        node = self.generic_visit(node)
+        if isinstance(node.operand, ast.Constant):
+            return self.fold(node, UNARY_OPERATORS[type(node.op)], node.operand.value)
+        return node
+
+    def visit_BoolOp(self, node):
+        node = self.generic_visit(node)
+        if all(isinstance(value, ast.Constant) for value in node.values):
+            return self.fold(node, boolean_operation, type(node.op), [value.value for value in node.values])
+        return node
+
+    def visit_Compare(self, node):
+        node = self.generic_visit(node)
+        operands = [node.left] + node.comparators
+        if all(isinstance(operand, ast.Constant) for operand in operands) and \
+                all(type(op) in COMPARE_OPERATORS for op in node.ops):
+            return self.fold(node, comparison, node.ops, [operand.value for operand in operands])
+        return node
+
+    # replaces the node by the value of the operation, an operation that raises is left for the line to report
+    def fold(self, node, function, *operands):
+        try:
+            value = function(*operands)
+        except Exception:
+            return node
+        if not is_constant(value):
+            return node
+        self.changed = True
+        return ast.copy_location(ast.Constant(value), node)
+
+    # skips operators that could build a huge value
+    def small(self, node):
+        left, right = node.left.value, node.right.value
+        if isinstance(node.op, (ast.Pow, ast.LShift)):
+            return not isinstance(right, int) or abs(right) <= 128
+        if isinstance(node.op, ast.Mult):
+            for sequence, count in ((left, right), (right, left)):
+                if isinstance(sequence, (str, bytes)) and isinstance(count, int):
+                    return len(sequence) * count <= MAX_CONSTANT_SIZE
+        return True
+
+
+# operators the ConstantFolder can evaluate, 'is' is left to the line since the identity of constants may vary
+BINARY_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.MatMult: operator.matmul,
+    ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow,
+    ast.LShift: operator.lshift, ast.RShift: operator.rshift, ast.BitOr: operator.or_, ast.BitXor: operator.xor,
+    ast.BitAnd: operator.and_,
+}
+UNARY_OPERATORS = {ast.UAdd: operator.pos, ast.USub: operator.neg, ast.Not: operator.not_, ast.Invert: operator.invert}
+COMPARE_OPERATORS = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt,
+    ast.GtE: operator.ge, ast.In: lambda item, container: item in container,
+    ast.NotIn: lambda item, container: item not in container,
+}
+
+
+# value of a chained comparison such as 1 < x <= 3
+def comparison(ops, values):
+    result = True
+    for op, left, right in zip(ops, values, values[1:]):
+        result = COMPARE_OPERATORS[type(op)](left, right)
+        if not result:
+            break
+    return result
+
+
+# value of 'and' or 'or' over the values
+def boolean_operation(op, values):
+    for value in values[:-1]:
+        if bool(value) == (op is ast.Or):
+            return value
+    return values[-1]
+
+
+# writes negative numbers as a negation, so the unparsed source keeps the precedence of its operators
+class ConstantWriter(ast.NodeTransformer):
+    def visit_Constant(self, node):
+        if type(node.value) in (int, float) and math.copysign(1, node.value) < 0:
+            return ast.copy_location(ast.UnaryOp(ast.USub(), ast.Constant(-node.value)), node)
+        return node
+
+
+# Optimization pass over the syntax tree of a program.
+# The values of the names assigned from constant expressions are followed through the program in order; a loop
+# forgets the names its body assigns, and after an if only the values every arm agrees on are kept. Function bodies
+# start from the constants declared so far, since they run later. An Optimizer keeps what it knows between calls,
+# so a script compiled statement by statement is optimized like a whole one.
+# With fold=False the tree is only checked for assignments to constants and is lowered as written.
+class Optimizer:
+    def __init__(self, fold=True):
+        self.fold = fold                # fold expressions, remove dead code and hoist loop-invariant calls
+        self.env = {}                   # {name: value} of the global names known at the current point
+        self.constants = {}             # {name: value} of the global names declared with constant
+        self.cache = None
+        self.hoist_count = 0            # number of calls hoisted out of loops
+
+    def optimize(self, statements, cache):
+        self.cache = cache
+        return self.block(statements, self.env, self.constants)
+
+    def block(self, statements, env, constants):
+        optimized = []
+        for index, statement in enumerate(statements):
+            optimized.extend(self.statement(statement, env, constants))
+            if self.fold and optimized and isinstance(optimized[-1], Return):
+                # the rest of the block never runs
+                self.dead(statements[index + 1:], env, constants)
+                break
+        return optimized
+
+    # code that is removed still declares its constants, so the names declared constant do not depend on folding
+    def dead(self, statements, env, constants):
+        self.block(statements, dict(env), constants)
+
+    # Folds an expression, returns the new Expression and its value or UNKNOWN.
+    # Python already folds the operators of an expression without names, so such an expression is only looked at
+    # when its value is needed.
+    def expression(self, expression, env, lineno, need_value=True):
+        if not self.fold:
+            return expression, UNKNOWN
+        for name in walrus_names(expression):
+            env.pop(name, None)
+        names = expression.code.co_names
+        known = not env.keys().isdisjoint(names)
+        if not known and (names or not need_value):
+            return expression, UNKNOWN
+        tree = ast.parse(expression.source.strip(), mode='eval')
+        folder = ConstantFolder(env)
+        body = folder.visit(tree.body)
+        value = body.value if isinstance(body, ast.Constant) else UNKNOWN
+        if not known or not folder.changed:
+            return expression, value
+        source = unparse(body)
+        return Expression(source, self.cache.compile(lineno, source)), value
+
+    def constant_expression(self, value, lineno):
+        source = unparse(ast.Constant(value))
+        return Expression(source, self.cache.compile(lineno, source))
+
+    # records the value of a name after an assignment
+    def bind(self, env, name, value):
+        if value is not UNKNOWN and is_constant(value):
+            env[name] = value
+        else:
+            env.pop(name, None)
+
+    # returns the list of statements that replace the statement
+    def statement(self, statement, env, constants):
+        lineno = statement.lineno
+        if isinstance(statement, Assign):
+            return self.assign(statement, env, constants)
+        if isinstance(statement, (Display, FinancialCall, FunctionCall, Return)):
+            if statement.expression is not None:
+                statement.expression = self.expression(statement.expression, env, lineno, False)[0]
+            return [statement]
+        if isinstance(statement, Get):
+            if statement.prompt in constants:
+                return [Invalid(lineno, f"Error in line {lineno}: Cannot assign to constant '{statement.prompt}'")]
+            env.pop(statement.prompt, None)
+            return [statement]
+        if isinstance(statement, FunctionDef):
+            return self.function(statement, env, constants)
+        if isinstance(statement, If):
+            return self.branch(statement, env, constants)
+        if isinstance(statement, (While, For)):
+            return self.loop(statement, env, constants)
+        return [statement]
+
+    def assign(self, statement, env, constants):
+        lineno = statement.lineno
+        name = statement.name
+        if name in constants:
+            return [Invalid(lineno, f"Error in line {lineno}: Cannot assign to constant '{name}'")]
+        if statement.op in ('++', '--'):
+            operation, value = operator.add, 1 if statement.op == '++' else -1
+        else:
+            operation = AUGMENTED_OPERATORS.get(statement.op)
+            statement.expression, value = self.expression(statement.expression, env, lineno)
+        if operation is not None and value is not UNKNOWN:
+            try:
+                value = operation(env[name], value) if name in env else UNKNOWN
+            except Exception:
+                # the error is reported when the line runs
+                value = UNKNOWN
+        if statement.constant:
+            constants[name] = value
+        self.bind(env, name, value)
+        if statement.op != '=' and name in env:
+            # x++ or x += 1 on a known value becomes a plain assignment
+            return [Assign(lineno, name, '=', self.constant_expression(value, lineno))]
+        return [statement]
+
+    def function(self, statement, env, constants):
+        lineno = statement.lineno
+        if statement.name in constants:
+            return [Invalid(lineno, f"Error in line {lineno}: Cannot assign to constant '{statement.name}'")]
+        for name, default in statement.defaults.items():
+            statement.defaults[name] = self.expression(default, env, lineno, False)[0]
+        env.pop(statement.name, None)
+        # the body sees the global constants assigned on every path to the definition, its parameters hide them
+        local_env = {name: value for name, value in env.items()
+                     if name in self.constants and same_value(self.constants[name], value)}
+        for param in statement.params:
+            local_env.pop(param, None)
+        statement.body = self.block(statement.body, local_env, {})
+        return [statement]
+
+    def branch(self, statement, env, constants):
+        arms = []
+        orelse = statement.orelse
+        branches = []                   # the names known at the end of each arm that may run
+        for position, (lineno, condition, body) in enumerate(statement.arms):
+            if isinstance(condition, Invalid):
+                # the error ends the statement, later arms never run
+                arms.append((lineno, condition, body))
+                orelse = None
+                break
+            condition, value = self.expression(condition, env, lineno)
+            if value is not UNKNOWN and not value:
+                self.dead(body, env, constants)
+                continue
+            body_env = dict(env)
+            body = self.block(body, body_env, constants)
+            if value is UNKNOWN:
+                arms.append((lineno, condition, body))
+                branches.append(body_env)
+                continue
+            # a condition that is always true ends the statement, its body becomes the else arm
+            for lineno, condition, dead_body in statement.arms[position + 1:]:
+                self.dead(dead_body, env, constants)
+            self.dead(orelse or [], env, constants)
+            if not arms:
+                env.clear()
+                env.update(body_env)
+                return body
+            orelse = body
+            branches.append(body_env)
+            break
+        else:
+            if not arms:
+                # every condition is false
+                return self.block(orelse, env, constants) if orelse is not None else []
+            if orelse is not None:
+                else_env = dict(env)
+                orelse = self.block(orelse, else_env, constants)
+                branches.append(else_env)
+        # a condition that fails when the line runs skips the whole statement
+        branches.append(dict(env))
+        merged = {name: value for name, value in branches[0].items()
+                  if all(name in branch and same_value(branch[name], value) for branch in branches[1:])}
+        env.clear()
+        env.update(merged)
+        statement.arms = arms
+        statement.orelse = orelse
+        return [statement]
+
+    def loop(self, statement, env, constants):
+        lineno = statement.lineno
+        if isinstance(statement, For):
+            statement.iterable = self.expression(statement.iterable, env, lineno, False)[0]
+            if statement.name in constants:
+                return [Invalid(lineno, f"Error in line {lineno}: Cannot assign to constant '{statement.name}'")]
+        assigned = assigned_names(statement.body)
+        if isinstance(statement, For):
+            assigned.add(statement.name)
+        else:
+            assigned |= walrus_names(statement.condition)
+        for name in assigned:
+            env.pop(name, None)
+        if isinstance(statement, While):
+            statement.condition, value = self.expression(statement.condition, env, lineno)
+            if value is not UNKNOWN and not value:
+                # the loop never runs
+                self.dead(statement.body, env, constants)
+                return []
+        statement.body = self.block(statement.body, dict(env), constants)
+        if not self.fold:
+            return [statement]
+        return self.hoist(statement, assigned) + [statement]
+
+    # Hoists the financial calls of a loop body whose arguments the loop does not change. The call is evaluated once
+    # before the loop into a hidden name, and the body uses that value when it is not None:
+    #     compound_interest(p, r, 2)   becomes   (h if h is not None else compound_interest(p, r, 2))
+    # The HOIST instruction only keeps the value of a pure function called with numbers, so when the name is
+    # shadowed or the call fails, the body still calls it as written and reports its errors in the loop.
+    def hoist(self, loop, assigned):
+        hoists = []
+        for statement in self.loop_statements(loop.body):
+            if isinstance(statement, Hoist):
+                continue
+            for attribute, value in list(vars(statement).items()):
+                if isinstance(value, Expression) and '(' in value.source:
+                    setattr(statement, attribute, self.hoist_calls(value, statement.lineno, assigned, hoists))
+        # hoists of inner loops move further out when they do not depend on this loop either
+        for statement in list(loop.body):
+            if isinstance(statement, Hoist) and not (self.names(statement.call) & assigned):
+                loop.body.remove(statement)
+                hoists.append(statement)
+        return hoists
+
+    # statements of a loop body, including the bodies of its ifs, inner loops already hoisted their calls
+    def loop_statements(self, statements):
+        for statement in statements:
+            yield statement
+            if isinstance(statement, If):
+                for lineno, condition, body in statement.arms:
+                    yield from self.loop_statements(body)
+                yield from self.loop_statements(statement.orelse or [])
+
+    def names(self, expression):
+        tree = ast.parse(expression.source.strip(), mode='eval')
+        return {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+
+    def hoist_calls(self, expression, lineno, assigned, hoists):
+        tree = ast.parse(expression.source.strip(), mode='eval')
+        changed = False
+        for node in ast.walk(tree):
+            for field, child in ast.iter_fields(node):
+                if isinstance(child, ast.Call) and self.invariant_call(child, assigned):
+                    setattr(node, field, self.hoisted(child, lineno, hoists))
+                    changed = True
+                elif isinstance(child, list):
+                    for position, item in enumerate(child):
+                        if isinstance(item, ast.Call) and self.invariant_call(item, assigned):
+                            child[position] = self.hoisted(item, lineno, hoists)
+                            changed = True
+        if not changed:
+            return expression
+        source = unparse(tree.body)
+        return Expression(source, self.cache.compile(lineno, source))
+
+    # a call of a financial function with positional arguments made of numbers and names the loop does not assign
+    def invariant_call(self, node, assigned):
+        if not isinstance(node.func, ast.Name) or node.func.id not in HOISTABLE_FUNCTIONS or node.keywords:
+            return False
+        if node.func.id in assigned:
+            return False
+        for argument in node.args:
+            for child in ast.walk(argument):
+                if isinstance(child, ast.Name):
+                    if child.id in assigned:
+                        return False
+                elif not isinstance(child, (ast.Constant, ast.BinOp, ast.UnaryOp, ast.operator, ast.unaryop, ast.Load)):
+                    return False
+        return True
+
+    def hoisted(self, node, lineno, hoists):
+        self.hoist_count += 1
+        name = f"__hoisted_{self.hoist_count}"
+        call = f"({node.func.id}, ({''.join(ast.unparse(argument) + ', ' for argument in node.args)}))"
+        hoists.append(Hoist(lineno, name, Expression(call, self.cache.compile(lineno, call))))
+        test = ast.Compare(ast.Name(name, ast.Load()), [ast.IsNot()], [ast.Constant(None)])
+        return ast.IfExp(test, ast.Name(name, ast.Load()), node)
+
+
+# compiles the list of code lines into a Program
+def compile_program(lines, cache=None, first_lineno=1, optimizer=None, trace=False):
+    return Compiler(lines, cache, first_lineno, optimizer, trace).compile()
+
+
+# Splits a stream of code lines into complete top-level statements.
+# Yields (first_lineno, lines) as soon as the next top-level statement starts, comments and
+# empty lines stay with the statement before them.
+def iter_statements(lines):
+    chunk = []
+    first_lineno = 1
+    has_code = False
+    in_comment = False
+    decorated = False           # the last line of code was @pure, the function after it belongs to the same statement
+    for lineno, line in enumerate(lines, start=1):
+        text = line.strip()
+        if in_comment:
+            in_comment = not text.endswith('##')
+        elif text.startswith('##'):
+            in_comment = not (len(text) > 2 and text.endswith('##'))
+        elif text and not text.startswith('#'):
+            top_level = not line[0].isspace() and not text.startswith('elif ') and not text.startswith('else')
+            if top_level and has_code and not decorated:
+                yield first_lineno, chunk
+                chunk = []
+                first_lineno = lineno
+            has_code = True
+            decorated = text == '@pure'
+        chunk.append(line)
+    if chunk:
+        yield first_lineno, chunk
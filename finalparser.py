@@ -1,7 +1,19 @@
 import re
+import io
+import sys
+import contextlib
+import builtins
+from collections import OrderedDict
+from types import MappingProxyType
+import new_function
+import plot
 from new_function import *
 from plot import *
-from lexer import Lexer
+from lexer import Lexer, TokenBuffer
+from compiler import (compile_program, get_code_cache, iter_statements, CodeCache, Compiler, CompileError, FunctionDef, Invalid,
+                      Optimizer, AUGMENTED_OPERATORS, MEMO_SIZE, ASSIGN, AUG_ASSIGN, CALL, DEF_FUNC, DISPLAY, ERROR,
+                      FINANCIAL, FOR_ITER, FOR_SETUP, GET, HOIST, INCREMENT, JUMP, LINE, RETURN, TEST_IF, TEST_WHILE,
+                      BLOCK_ENTER, BLOCK_EXIT, TRACE_RETURN)
 
 """
 The code represents a simple programming language with a focus on financial calculations.
@@ -10,27 +22,185 @@ loops (for, while), function definitions, and function calls. Additionally, it s
 operations for user interaction and displays the results.
 
 Key components:
-- `Tables_Values` class maintains variables, functions, and output storage.
+- `Tables_Values` class maintains variables, functions, and output storage. Variables live in layers: a frozen layer
+  with the Python builtins and the financial and plot functions shared by every program, and a global layer per program.
 - `Parser` class processes the input code, executes statements, and handles errors.
 - Financial functions are defined and mapped to execute based on keywords.
 - Display, input, and control flow statements are implemented.
 - Lexer converts the input script into tokens.
+- Compiler turns the lines of the script into instructions once; `Parser.run_program` executes them in a dispatch loop.
+- Functions defined with `func` become `CashFunction` objects; a call binds the arguments into a new frame and runs
+  the compiled body of the function with `Parser.run_program`, so functions can return values and call themselves.
+- `@memoize` in a script (or `Parser(..., memoize=True)`) caches the results of the pure financial functions and of
+  the functions marked with `@pure` in a `MemoCache`.
+- `Parser(..., program_cache=ProgramCache(directory))` loads the compiled program of a script that ran before from
+  disk instead of compiling it again, and keeps the tokens of the source for the symbol table in `Parser.tokens`.
+- `Parser(..., profiler=Profiler())` records the hits and time of every line and of the calls into the financial,
+  plot and CASH functions (see profiler.py).
+- `Parser.add_hook` registers callbacks for the statements, blocks, errors and output of a script (see HOOK_EVENTS and
+  metrics.py). The program is only compiled with the LINE and BLOCK instructions the hooks need when a statement or
+  block hook, or a profiler, is registered.
+  The line-by-line `execute_line` path is kept and used when the Parser is created with `compiled=False`.
 
 Example usage is provided at the end of the code, where a sample input code is tokenized and displayed.
 
 Note: Before running this code, make sure to download the required modules such as matplotlib, prettytable, and numpy
 """
 
+# number of characters kept in memory before the output is sent to its targets
+FLUSH_THRESHOLD = 8192
+
+
+# sends text to whatever sys.stdout is when the output is flushed
+class StdoutTarget:
+    def write(self, text):
+        self.stream().write(text)
+
+    def flush(self):
+        self.stream().flush()
+
+    # the stream behind the EchoStream of a running program
+    def stream(self):
+        stream = sys.stdout
+        while isinstance(stream, EchoStream):
+            stream = stream.stdout
+        return stream
+
+
+# passes the text sent to the targets to an on_output hook of a Parser
+class HookTarget:
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, text):
+        self.callback(text)
+
+    def flush(self):
+        pass
+
+
+# puts the text in a queue, e.g. for a GUI that shows the output of a program running in another thread
+class QueueTarget:
+    def __init__(self, queue):
+        self.queue = queue
+
+    def write(self, text):
+        self.queue.put(text)
+
+    def flush(self):
+        pass
+
+
+# Stands in for sys.stdout while a program runs. Text printed by the financial and plot functions is queued behind
+# the program output that is still buffered, so everything reaches the targets in the order it was produced.
+class EchoStream(io.TextIOBase):
+    def __init__(self, sink, stdout):
+        self.sink = sink
+        self.stdout = stdout            # sys.stdout before the program started
+
+    def write(self, text):
+        self.sink.echo(text)
+        return len(text)
+
+    # input() flushes its prompt before it waits
+    def flush(self):
+        self.sink.flush()
+
+
+# Buffered output of a program. Everything written is kept in memory for get_terminal(), and sent to the
+# targets (stdout, a file, a GUI widget...) in batches once FLUSH_THRESHOLD characters are waiting.
+class OutputSink:
+    def __init__(self, targets=None, flush_threshold=FLUSH_THRESHOLD):
+        self.targets = [StdoutTarget()] if targets is None else list(targets)
+        self.flush_threshold = flush_threshold
+        self.buffer = io.StringIO()     # all the text recorded as terminal output
+        self.pending = []               # text waiting to be sent to the targets
+        self.pending_size = 0
+
+    # records the text as terminal output and sends it to the targets unless echo is False
+    def write(self, text, echo=True):
+        self.buffer.write(text)
+        if echo:
+            self.echo(text)
+
+    # sends the text to the targets without recording it
+    def echo(self, text):
+        if not self.targets:
+            return
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= self.flush_threshold:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        text = ''.join(self.pending)
+        self.pending = []
+        self.pending_size = 0
+        for target in self.targets:
+            target.write(text)
+            target.flush()
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+    def clear(self):
+        self.buffer = io.StringIO()
+
+
 class Tables_Values:
-    def __init__(self):
-        self.variables = {}     # List of variables
+    def __init__(self, sink=None):
+        self.variables = {}     # List of variables (global layer of the program)
         self.function = {}      # List of function names
-        self.terminal = ""      # stores all the output
+        self.sink = sink if sink is not None else OutputSink()      # stores all the output
         self.output = ""        # stores all the value from functions
+        self.reset()
+
+    # all the output as one string
+    @property
+    def terminal(self):
+        return self.sink.getvalue()
+
+    @terminal.setter
+    def terminal(self, text):
+        self.sink.clear()
+        self.sink.write(text, echo=False)
+
+    # adds text to the output
+    def write(self, text, echo=True):
+        self.sink.write(text, echo)
+
+    # shows text on the targets without adding it to the output
+    def echo(self, text):
+        self.sink.echo(text)
+
+    def flush(self):
+        self.sink.flush()
+
+    # routes sys.stdout through the output while the block runs
+    def capture_stdout(self):
+        return contextlib.redirect_stdout(EchoStream(self.sink, sys.stdout))
+
+    # read-only view of the builtins and financial functions behind the variables
+    @property
+    def builtins(self):
+        return BUILTIN_LAYER
+
+    # starts a new program: empty global layer with the builtin layer behind it
+    def reset(self):
+        self.variables.clear()
+        self.variables['__builtins__'] = _builtin_layer
 
     # to access the value of a variable
     def get_variable(self, var_name):
-        return self.variables.get(var_name, None)
+        if var_name in self.variables:
+            return self.variables[var_name]
+        return self.variables['__builtins__'].get(var_name, None)
+
+    # replaces the builtin layer of the running program, e.g. with one whose pure functions are memoized
+    def use_builtins(self, layer):
+        self.variables['__builtins__'] = layer
 
     # assigns value to the variable
     def set_variable(self, var_name, value):
@@ -38,11 +208,17 @@ class Tables_Values:
         
     # return all the output of functions    
     def get_terminal(self):
-        return self.terminal
+        return self.sink.getvalue()
     def __repr__(self):
         return self.terminal
 
 
+# Raised in a running program once Parser.cancel has been called. Like KeyboardInterrupt it is not an Exception,
+# so the program cannot report it as an error of the line and carry on.
+class ProgramCancelled(BaseException):
+    pass
+
+
 # handles error in the syntax
 class Error:
     def __init__(self, message, lineno):
@@ -56,38 +232,524 @@ def get(prompt):
     return input(prompt)
 
 
+# names every CASH program can use: the Python builtins, the financial and plot functions and get
+def build_builtin_layer():
+    layer = dict(vars(builtins))
+    for module in (new_function, plot):
+        layer.update((name, value) for name, value in vars(module).items() if not name.startswith('_') and callable(value))
+    layer['get'] = get
+    return layer
+
+
+# eval looks up names missing from the variables in this dict, programs only see it through BUILTIN_LAYER
+_builtin_layer = build_builtin_layer()
+BUILTIN_LAYER = MappingProxyType(_builtin_layer)
+
+
+# Events a Parser can call hooks for, with the arguments of the hooks:
+#   on_statement(lineno)            a statement starts; a loop header starts again every time its loop goes on
+#   on_block_enter(kind, lineno)    a body starts: the script, a call of a func, an iteration of a while or for loop,
+#                                   or the if, elif or else arm that was taken
+#   on_block_exit(kind, lineno)     that body ends, also when a return leaves it
+#   on_error(message, exception)    an error is reported, exception is None when the line did not compile
+#   on_output(text)                 output is sent to the targets of the Tables_Values, in batches
+# The line by line interpreter reports its statements, loop iterations, errors and output, but not its if arms.
+HOOK_EVENTS = ('on_statement', 'on_block_enter', 'on_block_exit', 'on_error', 'on_output')
+
+
 # to catch invalid format for string and identifier
 IDENTIFIER = r'\b(_*[a-zA-Z][a-zA-Z0-9]*(_[a-zA-Z0-9]+)*)+\b'
 STRING = r'(\"([^"\n]*)\")|(\'([^"\n]*)\')'    
+
+# marks the end of a for loop, or a result missing from a memo cache
+_EXHAUSTED = object()
+
+
+# Local layer of a running CashFunction. Expressions of the body are evaluated with the frame as their namespace, so
+# nested scopes such as list comprehensions see the locals too; names the frame does not hold come from the global
+# layer and then from the builtin layer.
+class Frame(dict):
+    __slots__ = ('variables',)
+
+    def __init__(self, variables, bindings=()):
+        super().__init__(bindings)
+        self.variables = variables      # global layer of the program
+        self['__builtins__'] = variables['__builtins__']
+
+    def __missing__(self, name):
+        return self.variables[name]
+
+
+# A pure function with a bounded LRU of its results, keyed by the arguments of the call.
+# Calls with unhashable arguments are not cached, and neither are None results: the financial functions print an
+# error and return None when their input is invalid, and that message should show up on every call.
+class Memoized:
+    def __init__(self, function, maxsize=MEMO_SIZE, name=None):
+        self.function = function
+        self.maxsize = maxsize
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.pure = True
+        self.__name__ = name or function.__name__
+
+    def __call__(self, *args, **kwargs):
+        results = self.results
+        try:
+            key = (args, frozenset(kwargs.items())) if kwargs else args
+            result = results.get(key, _EXHAUSTED)
+        except TypeError:
+            return self.function(*args, **kwargs)
+        if result is not _EXHAUSTED:
+            self.hits += 1
+            results.move_to_end(key)
+            return result
+        self.misses += 1
+        result = self.function(*args, **kwargs)
+        if result is not None:
+            results[key] = result
+            if len(results) > self.maxsize:
+                results.popitem(last=False)
+        return result
+
+    def __repr__(self):
+        return f"<memoized {self.__name__} hits={self.hits} misses={self.misses}>"
+
+
+# memo caches of the pure functions of one script
+class MemoCache:
+    def __init__(self, maxsize=MEMO_SIZE):
+        self.maxsize = maxsize          # number of results kept per function
+        self.functions = {}             # Memoized functions by name
+
+    # returns the memoized version of the function
+    def wrap(self, function, name=None):
+        memoized = Memoized(function, self.maxsize, name)
+        self.functions[memoized.__name__] = memoized
+        return memoized
+
+    # returns a copy of the builtin layer where the functions marked as pure are memoized
+    def wrap_layer(self, layer):
+        layer = dict(layer)
+        for name, value in layer.items():
+            if getattr(value, 'pure', False):
+                layer[name] = self.wrap(value, name)
+        return layer
+
+    # hits, misses and size of every function that was called
+    def stats(self):
+        return {name: {'hits': memoized.hits, 'misses': memoized.misses, 'size': len(memoized.results)}
+                for name, memoized in self.functions.items() if memoized.hits or memoized.misses}
+
+    def __repr__(self):
+        return f"MemoCache(maxsize={self.maxsize}, functions={len(self.functions)})"
+
+
+# A function defined in a CASH program. Calling it binds the arguments to the parameters in a new frame and runs the
+# compiled body.
+class CashFunction:
+    def __init__(self, code, parser, defaults):
+        self.code = code                # FunctionCode with the parameters and the compiled body
+        self.parser = parser            # Parser that runs the body
+        self.defaults = defaults        # values of the default parameters, evaluated when the function is defined
+        self.__name__ = code.name
+
+    def __call__(self, *args, **kwargs):
+        params = self.code.params
+        variables = self.parser.table_values.variables
+        if len(args) == len(params) and not kwargs:
+            frame = Frame(variables, zip(params, args))
+        else:
+            frame = Frame(variables, self.bind(args, kwargs))
+        return self.parser.run_program(self.code.program, frame)
+
+    # binds the arguments of a call that does not pass every parameter by position
+    def bind(self, args, kwargs):
+        name = self.code.name
+        params = self.code.params
+        if len(args) > len(params):
+            raise TypeError(f"{name}() takes {len(params)} arguments but {len(args)} were given")
+        bindings = dict(zip(params, args))
+        for key, value in kwargs.items():
+            if key not in params:
+                raise TypeError(f"{name}() got an unexpected keyword argument '{key}'")
+            if key in bindings:
+                raise TypeError(f"{name}() got multiple values for argument '{key}'")
+            bindings[key] = value
+        for key, value in self.defaults.items():
+            bindings.setdefault(key, value)
+        for param in params:
+            if param not in bindings:
+                raise TypeError(f"{name}() missing argument '{param}'")
+        return bindings
+
+    def __repr__(self):
+        return f"<CASH function {self.code.name}({', '.join(self.code.params)})>"
+
+
+# Block index of the line by line interpreter, built once per program so control flow jumps instead of rescanning.
+# A block header compares the indentation of the following lines against its own stripped line, so the body of a
+# header ends at the first line whose indentation is at most that level (0 for if/else/while, 1 for for).
+class BlockTable:
+    def __init__(self, code):
+        self.stripped = [line.strip() for line in code]                     # code lines without indentation
+        self.indent = [len(line) - len(line.lstrip()) for line in code]     # indentation of every line
+        self.ends = {}                                                      # block ends by indentation level
+        self.ends[0] = self.build_ends(0)
+        self.ends[1] = self.build_ends(1)
+
+    # for every line, the first line at or after it whose indentation is at most level
+    def build_ends(self, level):
+        ends = [0] * (len(self.indent) + 1)
+        ends[-1] = len(self.indent)
+        for index in range(len(self.indent) - 1, -1, -1):
+            ends[index] = index if self.indent[index] <= level else ends[index + 1]
+        return ends
+
+    # returns the line after the block that starts at start
+    def end(self, start, level):
+        if level not in self.ends:
+            self.ends[level] = self.build_ends(level)
+        return self.ends[level][min(start, len(self.indent))]
+
+    # True if the line is an else of the line before
+    def is_else(self, index):
+        return index < len(self.stripped) and self.stripped[index].startswith("else")
         
         
 class Parser:
-    def __init__(self, table_values):
+    def __init__(self, table_values, compiled=True, memoize=False, optimize=True, program_cache=None, profiler=None):
         self.table_values = table_values        
         self.code = []                      # list of the code per line
         self.line_number = 0                # tracks line number
         self.output = []                    # stores the output of the function
         self.result = []
+        self.compiled = compiled            # compile the code once instead of interpreting it line by line
+        self.program = None                 # compiled form of the code
+        self.code_cache = None              # code objects of the script, shared with other Parsers
+        self.blocks = None                  # block index of the code for the line by line interpreter
+        self.memoize = memoize              # memoize pure functions in every script, True or the cache size
+        self.memo = None                    # MemoCache of the running script, when memoization is on
+        self.optimize = optimize            # fold constants, remove dead code and hoist loop-invariant calls
+        self.optimizer = None               # Optimizer of the running script
+        self.constants = set()              # names declared with constant, for the line by line interpreter
+        self.cancelled = False              # set by cancel, the program stops at its next loop iteration or line
+        self.program_cache = program_cache  # ProgramCache of compiled programs on disk, None to always compile
+        self.tokens = None                  # TokenBuffer of the script, kept with its program in the program cache
+        self.profiler = profiler            # Profiler told about every line and call, None to run without one
+        self.hooks = {event: [] for event in HOOK_EVENTS}      # callbacks by event
+        if profiler is not None:
+            self.add_hook('on_statement', profiler.line)
+
+    # Stops the running program, e.g. from another thread. The program checks the flag when a loop goes back to its
+    # start (every line without compilation), so a long call into a library function finishes first.
+    def cancel(self):
+        self.cancelled = True
+
+    # registers a callback for one of HOOK_EVENTS
+    def add_hook(self, event, callback):
+        if event not in self.hooks:
+            raise ValueError(f"Unknown hook {event!r}, expected one of {', '.join(HOOK_EVENTS)}")
+        self.hooks[event].append(callback)
+        if event == 'on_output':
+            self.table_values.sink.targets.append(HookTarget(callback))
+
+    # registers the methods of the listener named after HOOK_EVENTS
+    def add_hooks(self, listener):
+        for event in HOOK_EVENTS:
+            callback = getattr(listener, event, None)
+            if callback is not None:
+                self.add_hook(event, callback)
+
+    def run_hooks(self, event, *args):
+        for hook in self.hooks[event]:
+            hook(*args)
+
+    # True if the program has to be compiled with the LINE and BLOCK instructions
+    @property
+    def traced(self):
+        hooks = self.hooks
+        return bool(hooks['on_statement'] or hooks['on_block_enter'] or hooks['on_block_exit'])
         
     def parse_code(self, code):
-        self.table_values.variables.clear()
-        self.table_values.variables.update(globals())
+        self.reset()
+        self.code = code
+        self.code_cache = get_code_cache(code)
+        if self.profiler is not None:
+            self.profiler.start(code)
+        self.run_hooks('on_block_enter', 'script', 1)
+        try:
+            with self.table_values.capture_stdout():
+                if self.compiled:
+                    try:
+                        program = self.compile_code(code)
+                        self.apply_directives(program)
+                        self.run_program(program)
+                    except Exception as e:
+                        error_message = f"Error: {str(e)}"
+                        self.add_error(error_message, e)
+                else:
+                    self.run_code()
+        except ProgramCancelled as e:
+            self.add_error("Program stopped", e)
+        finally:
+            self.cancelled = False
+            self.table_values.flush()
+            self.run_hooks('on_block_exit', 'script', 1)
+            if self.profiler is not None:
+                self.profiler.stop()
+
+    # runs code lines read from a stream, each top-level statement is compiled and run as soon as it is complete
+    def parse_stream(self, lines):
+        self.reset()
+        self.code = []
+        self.code_cache = CodeCache()
+        if self.profiler is not None:
+            self.profiler.start()
+        self.run_hooks('on_block_enter', 'script', 1)
+        try:
+            with self.table_values.capture_stdout():
+                for first_lineno, chunk in iter_statements(lines):
+                    try:
+                        self.program = compile_program(chunk, self.code_cache, first_lineno, self.optimizer,
+                                                       self.traced)
+                        self.apply_directives(self.program)
+                        self.run_program(self.program)
+                    except Exception as e:
+                        error_message = f"Error: {str(e)}"
+                        self.add_error(error_message, e)
+        except ProgramCancelled as e:
+            self.add_error("Program stopped", e)
+        finally:
+            self.cancelled = False
+            self.table_values.flush()
+            self.run_hooks('on_block_exit', 'script', 1)
+            if self.profiler is not None:
+                self.profiler.stop()
+
+    # starts a new script
+    def reset(self):
+        self.table_values.reset()
+        self.tokens = None
+        self.memo = None
+        self.optimizer = Optimizer(self.optimize)
+        self.constants = set()
+        if self.memoize:
+            self.enable_memo(None if self.memoize is True else self.memoize)
+        elif self.profiler is not None:
+            self.install_builtins()
+
+    # memoizes the pure builtins and the @pure functions of the running script
+    def enable_memo(self, size=None):
+        if self.memo is None:
+            self.memo = MemoCache(size or MEMO_SIZE)
+            self.install_builtins()
+
+    # gives the script the builtin layer with the memoized and the profiled functions
+    def install_builtins(self):
+        layer = _builtin_layer
+        if self.memo is not None:
+            layer = self.memo.wrap_layer(layer)
+        if self.profiler is not None:
+            layer = self.profiler.wrap_layer(layer)
+        self.table_values.use_builtins(layer)
+
+    # applies the options the script sets with directives
+    def apply_directives(self, program):
+        if 'memoize' in program.directives:
+            self.enable_memo(program.directives['memoize'])
+
+    # compiles the list of code lines into instructions
+    def compile_code(self, code):
         self.code = code
-        self.run_code()
+        if self.code_cache is None:
+            self.code_cache = get_code_cache(code)
+        trace = self.traced
+        if self.program_cache is not None:
+            cached = self.program_cache.load(code, self.optimize, trace)
+            if cached is not None:
+                self.program = cached.program
+                self.tokens = cached.tokens
+                return self.program
+        self.program = compile_program(code, self.code_cache, optimizer=self.optimizer, trace=trace)
+        if self.program_cache is not None:
+            self.tokens = TokenBuffer.from_code('\n'.join(code))
+            self.program_cache.store(code, self.program, self.tokens, self.optimize, trace)
+        return self.program
+
+    # returns the cached code object of a source found on the current line
+    def compile_source(self, source, mode='eval', lineno=None):
+        if lineno is None:
+            lineno = self.line_number + 1
+        return self.code_cache.compile(lineno, source, mode)
+
+    # Executes the instructions of a compiled program.
+    # Assignment targets are resolved when the program is compiled, so the loop stores them straight into the
+    # global layer, or into the Frame when a function body runs; expressions look names up there first and then in
+    # the builtin layer. Returns the value of a return instruction.
+    def run_program(self, program, frame=None):
+        instructions = program.instructions
+        count = len(instructions)
+        table_values = self.table_values
+        variables = table_values.variables
+        scope = variables if frame is None else frame
+        iterators = []
+        builtins = scope['__builtins__']
+        pc = 0
+        try:
+            while pc < count:
+                op, lineno, arg, target, alt = instructions[pc]
+                pc += 1
+                try:
+                    if op == ASSIGN:
+                        scope[alt] = eval(arg.code, scope)
+                    elif op == TEST_WHILE or op == TEST_IF:
+                        if not eval(arg.code, scope):
+                            pc = target
+                    elif op == JUMP:
+                        # loops jump back to their start, where a cancelled program stops
+                        if self.cancelled:
+                            raise ProgramCancelled()
+                        pc = target
+                    elif op == DISPLAY:
+                        result = eval(arg.code, scope)
+                        self.output.append(result)
+                        table_values.write(str(result) + '\n')
+                    elif op == INCREMENT:
+                        scope[alt] = (scope[alt] if alt in scope else variables.get(alt)) + arg
+                    elif op == AUG_ASSIGN:
+                        current_value = scope[alt] if alt in scope else variables.get(alt)
+                        new_value = eval(arg.code, scope)
+                        scope[alt] = AUGMENTED_OPERATORS[target](current_value, new_value)
+                    elif op == FOR_ITER:
+                        value = next(iterators[-1], _EXHAUSTED)
+                        if value is _EXHAUSTED:
+                            iterators.pop()
+                            pc = target
+                        else:
+                            scope[alt] = value
+                    elif op == FOR_SETUP:
+                        # the iterable is consumed lazily, range(0, 50000000) takes no more memory than range(3)
+                        iterators.append(iter(eval(arg.code, scope)))
+                    elif op == RETURN:
+                        return None if arg is None else eval(arg.code, scope)
+                    elif op == FINANCIAL:
+                        result = eval(arg.code, scope)
+                        self.output.append(result)
+                        table_values.write(str(result) + '\n')
+                    elif op == CALL:
+                        # user and plot functions may print directly, so earlier output goes first
+                        table_values.flush()
+                        result = eval(arg.code, scope)
+                        self.output.append(result)
+                    elif op == GET:
+                        table_values.flush()
+                        user_input = get(arg)
+                        scope[arg] = user_input
+                        self.output.append(user_input)
+                        table_values.write(str(user_input) + '\n', echo=False)
+                    elif op == DEF_FUNC:
+                        scope[alt] = self.make_function(arg, frame)
+                    elif op == HOIST:
+                        # hoisted values go to a copy of the builtin layer, the variables only hold the program's names
+                        if scope['__builtins__'] is builtins:
+                            scope['__builtins__'] = dict(builtins)
+                        scope['__builtins__'][alt] = self.hoisted_call(arg, scope)
+                    elif op == ERROR:
+                        self.add_error(arg)
+                    # only in programs compiled for hooks
+                    elif op == LINE:
+                        for hook in self.hooks['on_statement']:
+                            hook(lineno)
+                    elif op == BLOCK_ENTER:
+                        for hook in self.hooks['on_block_enter']:
+                            hook(arg, lineno)
+                    elif op == BLOCK_EXIT:
+                        for hook in self.hooks['on_block_exit']:
+                            hook(arg, lineno)
+                    elif op == TRACE_RETURN:
+                        result = None if arg is None else eval(arg.code, scope)
+                        for kind, block_lineno in target:
+                            for hook in self.hooks['on_block_exit']:
+                                hook(kind, block_lineno)
+                        return result
+                except Exception as e:
+                    # runaway recursion is reported once, by the outermost program
+                    if frame is not None and isinstance(e, RecursionError):
+                        raise
+                    pc = self.runtime_error(instructions[pc - 1], e, pc, iterators)
+        finally:
+            scope['__builtins__'] = builtins
+
+    # creates the CashFunction of a compiled function definition, its default values are evaluated now
+    def make_function(self, code, frame=None):
+        variables = self.table_values.variables
+        scope = variables if frame is None else frame
+        defaults = {name: eval(expression.code, scope) for name, expression in code.defaults.items()}
+        function = CashFunction(code, self, defaults)
+        if code.pure and self.memo is not None:
+            function = self.memo.wrap(function, code.name)
+        if self.profiler is not None:
+            function = self.profiler.wrap(function, code.name)
+        return function
+
+    # Evaluates a call hoisted out of a loop, arg evaluates to (function, arguments).
+    # Only a pure function called with numbers is run ahead of the loop; None tells the loop to make the call itself,
+    # as it does when the name no longer refers to a pure function or the call fails or prints an error.
+    def hoisted_call(self, arg, scope):
+        try:
+            function, args = eval(arg.code, scope)
+            if not getattr(function, 'pure', False) or not all(type(value) in (int, float) for value in args):
+                return None
+            with contextlib.redirect_stdout(io.StringIO()) as printed:
+                result = function(*args)
+        except Exception:
+            return None
+        return None if printed.getvalue() else result
+
+    # reports an error raised by an instruction, returns where execution continues
+    def runtime_error(self, instruction, e, pc, iterators):
+        op, lineno, arg, target, alt = instruction
+        if op == TEST_WHILE:
+            self.table_values.echo(f"Error in line {lineno}: {e}\n")
+            self.run_hooks('on_error', f"Error in line {lineno}: {e}", e)
+            return target
+        if op == ASSIGN:
+            error_message = f"Error in line {lineno}: Invalid syntax"
+        elif op in (AUG_ASSIGN, INCREMENT):
+            error_message = f"{e}"
+        elif op == CALL:
+            error_message = f"Error in line {lineno}: Function name does not exist"
+        elif op in (FOR_SETUP, FOR_ITER):
+            error_message = f"Error in line {lineno}: for statement should have a valid identifier and range list"
+            if op == FOR_ITER:
+                iterators.pop()
+            pc = target
+        else:
+            error_message = f"Error in line {lineno}: {e}"
+            if op == TEST_IF:
+                pc = alt
+        if isinstance(e, RecursionError):
+            error_message = f"Error in line {lineno}: maximum recursion depth exceeded"
+
+        self.add_error(error_message, e)
+        return pc
 
     def run_code(self):
+        self.blocks = BlockTable(self.code)
         try:
             while self.line_number < len(self.code):
                 self.execute_line()
             #return(self.table_values.terminal)
         except Exception as e:
-            print(f"Error in line {self.line_number + 1}: {str(e)}")
+            self.table_values.echo(f"Error in line {self.line_number + 1}: {str(e)}\n")
         
     # adds error to the result       
-    def add_error(self, error_message):
+    def add_error(self, error_message, exception=None):
+        self.run_hooks('on_error', error_message, exception)
         error_message += '\n'
         self.output += error_message 
-        self.table_values.terminal += str(error_message) 
+        self.table_values.write(str(error_message))
 
 
 
@@ -105,12 +767,17 @@ class Parser:
         "loanfv_pin": "execute_lfv_pin",
         "loanfv_rtm": "execute_lfv_rtm",
     }
+    financial_function_mapping.update({f"{name}_batch": "execute_financial_function" for name in list(financial_function_mapping)})
     
 
 
     # maps the code to identify which function to perform
     def execute_line(self):
-        line = self.code[self.line_number].strip()
+        if self.cancelled:
+            raise ProgramCancelled()
+        line = self.blocks.stripped[self.line_number]
+        if line and not line.startswith('#'):
+            self.run_hooks('on_statement', self.line_number + 1)
     
         # skips empty line      
         if not line:
@@ -127,7 +794,7 @@ class Parser:
                     self.line_number += 1
                     continue
             else:
-                print(f"Error in line {self.line_number + 1}") 
+                self.table_values.echo(f"Error in line {self.line_number + 1}\n")
         elif line.startswith('#'):
             self.line_number += 1
             return
@@ -144,9 +811,17 @@ class Parser:
         elif line.startswith("while "):
             self.execute_while(line)
         elif re.match(r'^([a-zA-Z_][a-zA-Z0-9_]*)\s*([+\-*\/%]?=|\+\+|--)\s*(.*?)\s*$', line):
-            self.execute_assignment(line)   
+            name = re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*', line).group(0)
+            if name in self.constants:
+                self.add_error(f"Error in line {self.line_number + 1}: Cannot assign to constant '{name}'")
+            else:
+                self.execute_assignment(line)
         elif line.startswith("func ") or line.startswith("function "):
             self.create_function(line)
+        elif line.startswith("@"):
+            self.execute_directive(line)
+        elif line.startswith("constant "):
+            self.execute_constant(line)
         else:
             # maps the functions called
             for prefix, method in self.financial_function_mapping.items():
@@ -158,7 +833,7 @@ class Parser:
                     try:
                         self.execute_function_call(line)
                     except Exception as e:
-                        print(f"Error in line {self.line_number + 1}: {str(e)}")
+                        self.table_values.echo(f"Error in line {self.line_number + 1}: {str(e)}\n")
             
         # incr to move to the new line    
         self.line_number += 1
@@ -171,11 +846,10 @@ class Parser:
         try:
             if not line.endswith(")"):
                 raise SyntaxError(Error("Expected ')'", self.line_number + 1))
-            result = eval(line, self.table_values.variables)
-            print(result)
+            result = eval(self.compile_source(line), self.table_values.variables)
             y = str(result) + '\n'
             #self.table_values.add_data(y)
-            self.table_values.terminal += y
+            self.table_values.write(y)
             self.output += y
         
         except SyntaxError as se:
@@ -184,7 +858,6 @@ class Parser:
            error_message = (f"Error in line {self.line_number + 1}: {e}")
             
         if error_message:
-            print(f"{error_message}")
             self.add_error(error_message)    
     
     def execute_sint(self, line):
@@ -228,18 +901,16 @@ class Parser:
             if not line.endswith(")"):
                 raise SyntaxError(Error("Expected ')'", self.line_number + 1))
             expression = line[8:-1].strip()
-            result = eval(expression, self.table_values.variables)
-            print(result)
+            result = eval(self.compile_source(expression), self.table_values.variables)
             self.output.append(result)
             y = str(result) + '\n'
-            self.table_values.terminal += y 
+            self.table_values.write(y)
         except SyntaxError as se:
             error_message = str(Error("Invalid syntax. Check for missing operators or unterminated string literal", self.line_number + 1))
         except Exception as e:
            error_message = (f"Error in line {self.line_number + 1}: {e}")
             
         if error_message:
-            print(f"{error_message}")
             self.add_error(error_message)
 
 
@@ -250,11 +921,12 @@ class Parser:
             if not line.endswith(")"):
                 raise SyntaxError(Error("Expected ')'", self.line_number + 1))
             prompt = line[4:-1]
+            self.table_values.flush()
             user_input = get(prompt)
             self.table_values.set_variable(prompt, user_input)
             self.output.append(user_input)
             y = str(user_input) + '\n'
-            self.table_values.terminal += y 
+            self.table_values.write(y, echo=False)
             
         except SyntaxError as se:
             error_message = str(se)
@@ -262,7 +934,6 @@ class Parser:
            error_message = (f"Error in line {self.line_number + 1}: {e}")
             
         if error_message:
-            print(f"{error_message}")
             self.add_error(error_message)
 
     
@@ -289,7 +960,7 @@ class Parser:
                        
             if op == '=':
                     try:
-                        value = eval(expression, self.table_values.variables)
+                        value = eval(self.compile_source(expression), self.table_values.variables)
                         self.table_values.set_variable(var_name, value)
                         
                     except Exception:
@@ -297,7 +968,7 @@ class Parser:
             else: 
                 current_value = self.table_values.get_variable(var_name)
                 if expression:
-                    new_value = eval(expression, self.table_values.variables)
+                    new_value = eval(self.compile_source(expression), self.table_values.variables)
 
                 if op == '':
                     self.table_values.set_variable(var_name, new_value)
@@ -328,7 +999,6 @@ class Parser:
             error_message = (f"{e}")
             
         if error_message:
-            print(f"{error_message}")
             self.add_error(error_message)
      
      
@@ -342,21 +1012,22 @@ class Parser:
             saved_row = self.line_number
             identifier = r'^[a-zA-Z_][a-zA-Z0-9_]*'
             value = self.table_values.get_variable(identifier)
-            cond = eval(condition, self.table_values.variables)
+            cond = eval(self.compile_source(condition), self.table_values.variables)
             if cond == False:
                 self.skip_block(line)
         
+            level = self.get_indent_level(line)
+            indent = self.blocks.indent
             while cond:
+                self.run_hooks('on_block_enter', 'while', saved_row + 1)
                 self.line_number += 1
-                while (
-                    self.line_number < len(self.code)
-                    and self.get_indent_level(self.code[self.line_number]) > self.get_indent_level(line)
-                ):
+                while self.line_number < len(self.code) and indent[self.line_number] > level:
                     self.execute_line()
                 self.line_number -= 1
+                self.run_hooks('on_block_exit', 'while', saved_row + 1)
                 
                 # Update the condition for the next iteration
-                cond = eval(condition, self.table_values.variables)
+                cond = eval(self.compile_source(condition, lineno=saved_row + 1), self.table_values.variables)
                 if cond:  
                     self.line_number = saved_row
                     
@@ -364,25 +1035,22 @@ class Parser:
             error_message = str(se)
             
         except Exception as e:
-            print(f"Error in line {self.line_number + 1}: {e}")
-                
+            self.table_values.echo(f"Error in line {self.line_number + 1}: {e}\n")
+            self.run_hooks('on_error', f"Error in line {self.line_number + 1}: {e}", e)
+
         if error_message:
-            print(f"{error_message}")
             self.add_error(error_message)      
         
     def skip_block(self, line):
         error_message = ''
         try:
-            level = 1
-            inside_else = False  # Flag to track if currently inside an 'else' block
-            # while level > 0:
-            while self.line_number + 1 < len(self.code) and self.get_indent_level(self.code[self.line_number + 1]) > self.get_indent_level(line):
-                self.skip_line()
+            # jumps to the last line of the block
+            end = self.blocks.end(self.line_number + 1, self.get_indent_level(line))
+            self.line_number = max(self.line_number, end - 1)
         except Exception as e:
             error_message = (f"Error in line {self.line_number + 1}: {str(e)}")
             
         if error_message:
-            print(f"{error_message}")
             self.add_error(error_message)
 
     
@@ -393,7 +1061,7 @@ class Parser:
             if not line.endswith(':'):
                 raise SyntaxError(Error("Expected ':'", self.line_number+ 1))
             condition = line[3:-1].strip()
-            if eval(condition, self.table_values.variables):
+            if eval(self.compile_source(condition), self.table_values.variables):
                 self.execute_block(line)
             else:
                 self.execute_else(line)
@@ -404,36 +1072,40 @@ class Parser:
             error_message = (f"Error in line {self.line_number + 1}: {str(e)}")
             
         if error_message:
-            print(f"{error_message}")
             self.add_error(error_message)
 
     def execute_block(self, line):
         error_message = ''
         try:   
+            level = self.get_indent_level(line)
+            indent = self.blocks.indent
             self.line_number += 1
-            while self.get_indent_level(self.code[self.line_number]) > self.get_indent_level(line) and not self.code[self.line_number].strip().startswith("else"):
+            while indent[self.line_number] > level and not self.blocks.is_else(self.line_number):
                 self.execute_line()
 
-            if self.line_number < len(self.code) and self.code[self.line_number].strip().startswith("else:"):
-                while self.get_indent_level(self.code[self.line_number + 1]) > self.get_indent_level(line):
-                    self.skip_line()
+            if self.line_number < len(self.code) and self.blocks.stripped[self.line_number].startswith("else:"):
+                # jumps over the else block, an else block at the end of the code has no line after it
+                end = self.blocks.end(self.line_number + 1, level)
+                self.line_number = max(self.line_number, end - 1)
+                if end == len(self.code):
+                    raise IndexError("list index out of range")
         except Exception as e:
             error_message = (f"Error in line {self.line_number + 1}: {str(e)}")
 
         if error_message:
-            print(f"{error_message}")
             self.add_error(error_message)
             
     def execute_else(self, line):
         error_message = ''
         try:
-            level = 1
-            inside_else = False
-            while self.line_number + 1 < len(self.code) and self.get_indent_level(self.code[self.line_number + 1]) > self.get_indent_level(line):
-                self.skip_line()
+            level = self.get_indent_level(line)
+            indent = self.blocks.indent
+            # jumps over the if block
+            end = self.blocks.end(self.line_number + 1, level)
+            self.line_number = max(self.line_number, end - 1)
             self.line_number += 1
-            if self.line_number < len(self.code) and self.code[self.line_number].strip().startswith("else:"):
-                while self.get_indent_level(self.code[self.line_number + 1]) > self.get_indent_level(line) and not self.code[self.line_number].strip().startswith("else"):
+            if self.line_number < len(self.code) and self.blocks.stripped[self.line_number].startswith("else:"):
+                while indent[self.line_number + 1] > level and not self.blocks.is_else(self.line_number):
                     self.execute_line()
             else:
                 self.execute_line()
@@ -442,61 +1114,59 @@ class Parser:
             error_message = (f"Error in line {self.line_number + 1}: {str(e)}")
 
         if error_message:
-            print(f"{error_message}")
             self.add_error(error_message)
     
     
     # handles creation and calling of function
     def create_function(self, line):
         error_message = ''
-        # Parse the function definition
         try:
-            match = re.match(r'(func|function)\s+([a-zA-Z_][a-zA-Z0-9_]*)\((.*?)\)\s*:', line)
-
-            keyword, func_name, params_str = match.groups()
-            params = [param.strip() for param in params_str.split(',')]
-
-            # Parse the function body
-            function_body = []
-            self.line_number += 1
-            while self.line_number < len(self.code) and not self.code[self.line_number].strip().endswith(':'):
-                function_body.append(self.code[self.line_number])
-                self.line_number += 1
-                
+            # the header and the indented body are compiled like in the compiled path
+            compiler = Compiler(self.code, self.code_cache, trace=self.traced)
+            function_code, end = compiler.compile_function(self.line_number)
+            self.table_values.set_variable(function_code.name, self.make_function(function_code))
+            self.line_number = end - 1
+        except CompileError as ce:
+            error_message = ce.message
         except Exception as e:
             error_message = (f"Error in line {self.line_number + 1}: {str(e)}")
 
         if error_message:
-            print(f"{error_message}")
             self.add_error(error_message)
 
-        # Create the function
-        function_code = '\n'.join(function_body)
-        function_code = function_code.replace('\t', ' ' * 4)  # Replace tabs with spaces for consistent indentation
-        function_code = f"def {func_name}({', '.join(params)}):\n    {function_code}"
-        
-        error_message = ''
-        # Execute the function code
-        try:
-            exec(function_code, self.table_values.variables)
-        except Exception as e:
-            error_message = (f"Error in line {self.line_number + 1}: {str(e)}")
+    # handles @memoize and @pure
+    def execute_directive(self, line):
+        compiler = Compiler(self.code, self.code_cache, trace=self.traced)
+        statement, end = compiler.parse_directive(line, self.line_number + 1, self.line_number)
+        if 'memoize' in compiler.directives:
+            self.enable_memo(compiler.directives['memoize'])
+        elif isinstance(statement, FunctionDef):
+            self.table_values.set_variable(statement.name, self.make_function(compiler.function_code(statement)))
+        elif isinstance(statement, Invalid):
+            self.add_error(statement.message)
+        self.line_number = end - 1
 
-        if error_message:
-            print(f"{error_message}")
-            self.add_error(error_message)
+    # constant NAME = expression, assigns the name once
+    def execute_constant(self, line):
+        statement = Compiler(self.code, self.code_cache).parse_constant(line, self.line_number + 1)
+        if isinstance(statement, Invalid):
+            self.add_error(statement.message)
+        elif statement.name in self.constants:
+            self.add_error(f"Error in line {self.line_number + 1}: Cannot assign to constant '{statement.name}'")
+        else:
+            self.constants.add(statement.name)
+            self.execute_assignment(line[9:].strip())
 
     def execute_function_call(self, line):
         error_message = ''
         try:
-            result = eval(line, self.table_values.variables)
+            result = eval(self.compile_source(line), self.table_values.variables)
             self.output.append(result)
             y = str(result) + '\n'
         except Exception as e:
             error_message = (f"Error in line {self.line_number + 1}: Function name does not exist")
         
         if error_message:
-            print(f"{error_message}")
             self.add_error(error_message)
              
     
@@ -511,7 +1181,7 @@ class Parser:
             line = line.rstrip(':')
             identifier, range_part = line.split("in")
             identifier = identifier.replace(" ", "")
-            rangelist = list(eval(range_part))
+            iterator = iter(eval(self.compile_source(range_part), self.table_values.variables))
             saved_row = self.line_number
             
             if re.search(IDENTIFIER, identifier):
@@ -519,13 +1189,16 @@ class Parser:
             else:
                 raise SyntaxError(Error(f"Invalid identifier '{identifier}'", self.line_number + 1))
 
-            for value in rangelist:
+            level = self.get_indent_level(line)
+            indent = self.blocks.indent
+            for value in iterator:
                 self.table_values.set_variable(identifier, value)
-                
-                while self.line_number + 1 < len(self.code) and self.get_indent_level(self.code[self.line_number + 1]) > self.get_indent_level(line):
+                self.run_hooks('on_block_enter', 'for', saved_row + 1)
+                while self.line_number + 1 < len(self.code) and indent[self.line_number + 1] > level:
                     self.line_number += 1
                     self.execute_line()
                 self.line_number = saved_row
+                self.run_hooks('on_block_exit', 'for', saved_row + 1)
             
             self.line_number += 1
 
@@ -536,7 +1209,6 @@ class Parser:
             error_message = f"Error in line {self.line_number + 1}: for statement should have a valid identifier and range list"
         
         if error_message:
-            print(f"{error_message}")
             self.add_error(error_message)
 
     def skip_line(self):
@@ -548,9 +1220,9 @@ class Parser:
     
 
 # calls the lexer functions    
-def lexer(data):
+def lexer(data, compiled=True):
     table_values = Tables_Values()
-    parser = Parser(table_values)
+    parser = Parser(table_values, compiled)
     lexer = Lexer(data)
     
     #lexeme = lexer.run(data)
@@ -560,6 +1232,14 @@ def lexer(data):
     result = table_values.get_terminal()
     return result
 
+
+# runs a script from a file object without reading it all first
+def lexer_stream(file):
+    table_values = Tables_Values()
+    parser = Parser(table_values)
+    parser.parse_stream(Lexer(file).iter_lines())
+    return table_values.get_terminal()
+
   
 
     
@@ -1,6 +1,11 @@
+from array import array
 from datetime import datetime
+import codecs
+import csv
+import json
 import re
-from prettytable import *
+import struct
+import sys
 
 """
 This script defines a lexer for CASH programming language. It tokenizes input code into a list of tokens, where each token 
@@ -11,10 +16,16 @@ literals, strings, and comments (both single-line and multi-line).
 
 To use the lexer:
 1. Create an instance of the Lexer class with the input code.
-2. Call the `tokenize` method to obtain a list of Token objects.
-3. Optionally, you can run the `run` function to display the tokenized information in a pretty table and save it to a file.
+2. Call the `tokenize` method to obtain a list of Token objects. The table-driven scanner is used by default,
+   pass `scanner='classic'` to the Lexer to use the original character by character scanner.
+3. Optionally, you can run the `run` function to display the tokenized information as a symbol table and save it to a
+   file. The rows are written as the tokens are scanned, as a fixed width table, CSV, JSON lines or a binary file.
+4. In an editor, an IncrementalLexer keeps the tokens of the code as it changes; `edit` or `update` re-scans only
+   the lines around a change.
 
-Example usage is provided at the end of the code, where a sample input code is tokenized and displayed.
+Example usage is provided at the end of the code; it runs when lexer.py is executed directly, where a sample input code is tokenized and displayed.
+
+Importing the module does no I/O; prettytable is only imported when `run` builds a symbol table.
 
 Note: Before running this code, make sure to download the required modules.
 """
@@ -99,21 +110,100 @@ reserved_words = {
     'loanfv_pin': 'LFV_PIN_RW',
     'loanfv_rtm': 'LFV_RTM_RW',
     'loan_principal': 'LPRINCIPAL_RW',
+    'simple_interest_batch': 'SINT_BATCH_RW',
+    'compound_interest_batch': 'CINT_BATCH_RW',
+    'simple_annuity_batch': 'SANN_BATCH_RW',
+    'stock_dividend_batch': 'STOCKDIV_BATCH_RW',
+    'div_pershare_batch': 'DPS_BATCH_RW',
+    'yield_ratio_batch': 'YRATIO_BATCH_RW',
+    'coupon_payment_batch': 'COUP_PAYMENT_BATCH_RW',
+    'coupon_amount_batch': 'COUP_AMOUNT_BATCH_RW',
+    'loanfv_pin_batch': 'LFV_PIN_BATCH_RW',
+    'loanfv_rtm_batch': 'LFV_RTM_BATCH_RW',
+    'loan_principal_batch': 'LPRINCIPAL_BATCH_RW',
     'range': 'RANGE_RW'
 }
 
 INVALID = 'INVALID_TOKEN'
 
+# Interned token types, a token stores the id of its type instead of the name
+TOKEN_TYPES = []        # type name by id
+TOKEN_IDS = {}          # id by type name
+
+
+# returns the id of a token type, registering it on first use
+def token_type_id(name):
+    type_id = TOKEN_IDS.get(name)
+    if type_id is None:
+        type_id = TOKEN_IDS[name] = len(TOKEN_TYPES)
+        TOKEN_TYPES.append(name)
+    return type_id
+
+
+for _name in ['ID', 'INT', 'FLOAT', 'STRING', 'SINGLE_COM', 'MULT_COM', 'MULT_COM_START', 'MULT_COM_END', INVALID]:
+    token_type_id(_name)
+for _table in (operator_deli, keywords, reserved_words):
+    for _name in _table.values():
+        token_type_id(_name)
+
+# Tables used by the table-driven scanner
+SPACE, ALPHA, DIGIT, QUOTE, OPERATOR, HASH, OTHER = range(7)
+
+# class of every ASCII character, other characters are classified when first seen
+CHAR_CLASSES = {}
+for _code in range(128):
+    _char = chr(_code)
+    if _char in ' \t':
+        CHAR_CLASSES[_char] = SPACE
+    elif _char.isalpha() or _char == '_':
+        CHAR_CLASSES[_char] = ALPHA
+    elif _char.isdigit():
+        CHAR_CLASSES[_char] = DIGIT
+    elif _char in '"\'':
+        CHAR_CLASSES[_char] = QUOTE
+    elif _char in operator_deli:
+        CHAR_CLASSES[_char] = OPERATOR
+    elif _char == '#':
+        CHAR_CLASSES[_char] = HASH
+    else:
+        CHAR_CLASSES[_char] = OTHER
+
+# operators grouped by their first character, longest first
+OPERATOR_TABLE = {}
+for _op in sorted(operator_deli.keys(), key=len, reverse=True):
+    OPERATOR_TABLE.setdefault(_op[0], []).append(_op)
+
+# characters that continue an identifier or a number
+IDENT_CHARS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_')
+NUMBER_CHARS = frozenset('0123456789.')
+
+# scanner used by Lexer.tokenize when none is given
+DEFAULT_SCANNER = 'table'
+
+# number of characters (or bytes) read at a time from a file
+CHUNK_SIZE = 1 << 16
+
 
 class Token:
-    def __init__(self, type, lexeme, lineno, index, end, error):
-        self.type = type                # represents the token
+    __slots__ = ('type_id', 'lexeme', 'lineno', 'index', 'end', 'error')
+
+    def __init__(self, type, lexeme, lineno, index, end, error=''):
+        self.type_id = type if type.__class__ is int else token_type_id(type)   # id of the token type
         self.lexeme = lexeme            # lexeme found in the code
         self.lineno = lineno            # represents the line number
         self.index = index              # starting index of the lexeme
         self.end = end                  # position of the last character of lexeme
         self.error = error              # any error message associated with the token
 
+    # represents the token
+    @property
+    def type(self):
+        return TOKEN_TYPES[self.type_id]
+
+    @type.setter
+    def type(self, name):
+        self.type_id = token_type_id(name)
+
     def __repr__(self):
         if self.error:
             return f"Token(type='{self.type}', lexeme='{self.lexeme}', lineno={self.lineno}, index={self.index}, end={self.end}, error={self.error})"
@@ -121,17 +211,309 @@ class Token:
             return f"Token(type='{self.type}', lexeme='{self.lexeme}', lineno={self.lineno}, index={self.index}, end={self.end})"
 
 
+# Columnar storage of the tokens of a source: the type ids, line numbers and offsets are kept in arrays and
+# the lexemes as slices of the source, so a large file needs a few bytes per token instead of one object each.
+class TokenBuffer:
+    def __init__(self, source):
+        self.source = source                # the code the lexemes are sliced from
+        self.line_starts = array('L')       # offset of every line in the source
+        self.type_ids = array('H')
+        self.linenos = array('L')
+        self.indexes = array('L')
+        self.ends = array('L')
+        self.lexeme_starts = array('L')     # offset of the lexeme in the source
+        self.lexeme_lengths = array('L')
+        self.errors = {}                    # error message by token position, most tokens have none
+        self.lexemes = {}                   # lexemes that are not a slice of the source, by token position
+
+    @classmethod
+    def from_code(cls, code):
+        buffer = cls(code)
+        buffer.extend(Lexer(code).iter_tokens())
+        return buffer
+
+    def extend(self, tokens):
+        source = self.source
+        line_starts = self.line_starts
+        if not line_starts:
+            line_starts.append(0)
+        for token in tokens:
+            while len(line_starts) < token.lineno:
+                line_starts.append(source.index('\n', line_starts[-1]) + 1)
+            self.append(token)
+
+    def append(self, token):
+        position = len(self.type_ids)
+        lexeme = token.lexeme
+        line_start = self.line_starts[token.lineno - 1]
+        start = line_start + token.index
+        if not self.source.startswith(lexeme, start):
+            # the closing ## of a multiline comment is taken from the end of the line
+            line_end = self.source.find('\n', line_start)
+            if line_end == -1:
+                line_end = len(self.source)
+            start = self.source.rfind(lexeme, line_start, line_end)
+            if start == -1:
+                start = line_start
+                self.lexemes[position] = lexeme
+        self.type_ids.append(token.type_id)
+        self.linenos.append(token.lineno)
+        self.indexes.append(token.index)
+        self.ends.append(token.end)
+        self.lexeme_starts.append(start)
+        self.lexeme_lengths.append(len(lexeme))
+        if token.error:
+            self.errors[position] = token.error
+
+    def lexeme(self, position):
+        if position in self.lexemes:
+            return self.lexemes[position]
+        start = self.lexeme_starts[position]
+        return self.source[start:start + self.lexeme_lengths[position]]
+
+    def type(self, position):
+        return TOKEN_TYPES[self.type_ids[position]]
+
+    def __len__(self):
+        return len(self.type_ids)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError('token index out of range')
+        return Token(self.type_ids[position], self.lexeme(position), self.linenos[position],
+                     self.indexes[position], self.ends[position], self.errors.get(position, ''))
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+# classifies a character outside of ASCII
+def char_class(char):
+    if char.isalpha():
+        kind = ALPHA
+    elif char.isdigit():
+        kind = DIGIT
+    else:
+        kind = OTHER
+    CHAR_CLASSES[char] = kind
+    return kind
+
+
+# same as matching the IDENTIFIER pattern against a whole word
+def is_identifier(lexeme):
+    name = lexeme.lstrip('_')
+    if not name or not name[0].isascii() or not name[0].isalpha():
+        return False
+    for part in name.split('_'):
+        if not part or not part.isascii() or not part.isalnum():
+            return False
+    return True
+
+
+# same as matching the FLOAT pattern against a number made of digits and dots
+def is_float(lexeme):
+    dot = lexeme.find('.')
+    return lexeme[:dot].isdecimal() and dot + 1 < len(lexeme) and lexeme[dot + 1].isdecimal()
+
+
 class Lexer:
     
-    def __init__(self, code):
-        self.code = code                # stores the input file
+    def __init__(self, code, scanner=DEFAULT_SCANNER):
+        self.code = code                # stores the input file: a string, a file object or a memory-mapped file
+        self.scanner = scanner          # 'table' for the table-driven scanner, 'classic' for the original one
         
     # Returns the list of code by line
     def pass_data(self):
-        lines = self.code.split('\n') 
-        return lines
+        if isinstance(self.code, str):
+            return self.code.split('\n')
+        return list(self.iter_lines())
+
+    # Yields the code line by line without reading the whole input first.
+    # Gives the same lines as pass_data; bytes (e.g. from a memory-mapped file) are decoded as UTF-8.
+    def iter_lines(self, chunk_size=CHUNK_SIZE):
+        code = self.code
+        if isinstance(code, str):
+            start = 0
+            newline = code.find('\n')
+            while newline != -1:
+                yield code[start:newline]
+                start = newline + 1
+                newline = code.find('\n', start)
+            yield code[start:]
+            return
+
+        decoder = None
+        pending = ''
+        while True:
+            chunk = code.read(chunk_size)
+            if not chunk:
+                break
+            if isinstance(chunk, bytes):
+                if decoder is None:
+                    decoder = codecs.getincrementaldecoder('utf-8')()
+                chunk = decoder.decode(chunk)
+            lines = (pending + chunk).split('\n')
+            pending = lines.pop()
+            yield from lines
+        if decoder is not None:
+            pending += decoder.decode(b'', final=True)
+        yield pending
+
+    # Yields the tokens of the code one at a time with the table-driven scanner
+    def iter_tokens(self):
+        return self.scan(self.iter_lines())
     
     def tokenize(self):
+        if self.scanner == 'classic':
+            return self.tokenize_classic()
+        return self.tokenize_table()
+
+    def tokenize_table(self):
+        return list(self.iter_tokens())
+
+    # Returns the tokens in a columnar TokenBuffer instead of a list
+    def tokenize_buffer(self):
+        code = self.code if isinstance(self.code, str) else '\n'.join(self.iter_lines())
+        return TokenBuffer.from_code(code)
+
+    # Single pass over each line driven by the character class and operator tables.
+    # Produces the same tokens as tokenize_classic without building lexemes character by character.
+    # The scan can start at any line from the state left by the line before it; when states is a list,
+    # the state after every line, (inside a ## comment, end of the last token), is appended to it.
+    def scan(self, lines, lineno=1, in_multiline_comment=False, end=0, states=None):
+        for lineno, line in enumerate(lines, start=lineno):
+            index = 0
+            length = len(line)
+
+            while index < length:
+                char = line[index]
+                kind = CHAR_CLASSES.get(char)
+                if kind is None:
+                    kind = char_class(char)
+                start = index
+                error = ''
+
+                # Ignore whitespace
+                if kind == SPACE:
+                    index += 1
+                    continue
+
+                # Handles identifiers, keywords, reserved words and multiline comment text
+                if kind == ALPHA:
+                    if in_multiline_comment:
+                        if line.endswith('##'):
+                            yield Token('MULT_COM', line[index:-2], lineno, start, end, error)
+                            lexeme = line[-2:]
+                            token_type = 'MULT_COM_END'
+                            index += 2 * length
+                            in_multiline_comment = False
+                        else:
+                            lexeme = line[index:]
+                            token_type = 'MULT_COM'
+                            index += length
+                    else:
+                        index += 1
+                        while index < length and (line[index] in IDENT_CHARS or line[index].isalnum()):
+                            index += 1
+                        lexeme = line[start:index]
+                        index -= 1
+                        if lexeme in reserved_words:
+                            token_type = reserved_words[lexeme]
+                        elif lexeme in keywords:
+                            token_type = keywords[lexeme]
+                        elif is_identifier(lexeme):
+                            token_type = 'ID'
+                        else:
+                            token_type = INVALID
+                            error = 'Invalid syntax for identifier'
+
+                # Handles integers and floats
+                elif kind == DIGIT:
+                    index += 1
+                    while index < length and (line[index] in NUMBER_CHARS or line[index].isdigit()):
+                        index += 1
+                    lexeme = line[start:index]
+                    index -= 1
+                    if '.' in lexeme:
+                        if is_float(lexeme):
+                            token_type = 'FLOAT'
+                        else:
+                            token_type = INVALID
+                            error = "Invalid float literal"
+                    else:
+                        token_type = 'INT'
+
+                # Handles string literals
+                elif kind == QUOTE:
+                    close = line.find(char, index + 1)
+                    if close == -1:
+                        lexeme = line[start:]
+                        index = length
+                        token_type = INVALID
+                        error = 'Unterminated string literal'
+                    else:
+                        lexeme = line[start:close + 1]
+                        index = close + 1
+                        if char == '"' or '"' not in lexeme:
+                            token_type = 'STRING'
+                        else:
+                            token_type = INVALID
+                            error = 'Unterminated string literal'
+
+                # Handles operators, longest match first
+                elif kind == OPERATOR:
+                    for op in OPERATOR_TABLE[char]:
+                        if line.startswith(op, index):
+                            lexeme = op
+                            index += len(op) - 1
+                            token_type = operator_deli[op]
+                            break
+
+                # Handles comments
+                elif kind == HASH:
+                    if not in_multiline_comment and line.startswith('##', index):
+                        in_multiline_comment = True
+                        yield Token('MULT_COM_START', '##', lineno, start, end, error)
+                        index = length
+                        if line[-2:].endswith('##'):
+                            in_multiline_comment = False
+                        continue
+                    elif in_multiline_comment and line.startswith('##', index):
+                        lexeme = '##'
+                        token_type = 'MULT_COM_END'
+                        in_multiline_comment = False
+                        index += 2
+                    else:
+                        lexeme = line[index:]
+                        token_type = 'SINGLE_COM'
+                        index = length
+
+                # Handle other characters as invalid tokens
+                else:
+                    token_type = INVALID
+                    lexeme = char
+                    error = f"Unexpected token '{lexeme}'"
+
+                if token_type == INVALID and not error:
+                    error = 'Invalid Syntax'
+
+                end = index
+                yield Token(token_type, lexeme, lineno, start, end, error)
+                index += 1
+
+            if states is not None:
+                states.append((in_multiline_comment, end))
+
+    # Original character by character scanner
+    def tokenize_classic(self):
         IDENTIFIER = r'\b(_*[a-zA-Z][a-zA-Z0-9]*(_[a-zA-Z0-9]+)*)\b'
         INT = r'[1-9]\d*'
         FLOAT = r'\d*\.\d+'
@@ -143,7 +525,7 @@ class Lexer:
         end = 0
         in_multiline_comment = False
         
-        lines = self.code.split('\n')
+        lines = self.pass_data()
 
         for lineno, line in enumerate(lines, start=1):
             index = 0           # Reset index for the next line
@@ -300,44 +682,278 @@ class Lexer:
         return tokens
 
 
+# Keeps the tokens of a source that is being edited, line by line, so an edit re-scans only the lines it touches.
+# The state of the scanner after every line is kept too; the scan after an edit stops at the first line that
+# starts in the same state as before the edit, e.g. an edit inside a ## comment re-scans the rest of the comment
+# only when it opens or closes the comment.
+class IncrementalLexer(Lexer):
 
-def run(cash_code):
-    
-    lexer = Lexer(cash_code)
-    tokens = lexer.tokenize()
-    # sets the name of the file generated for the symbol table
-    timestamp = datetime.now().strftime("%Y-%m-%d-%H%M")
-    output_file_path = f"symboltables/Symbol Table_{timestamp}.cash"
-    
-    
-    # style of the symbol table
-    table = PrettyTable(['Line Number', 'Lexeme', 'Token', 'Index', 'Error'])
-    table.title = "S Y M B O L   T A B L E"
-    table._max_width = {"Lexeme" : 20, "Error": 20}
-    table._min_width = {"Token": 20, "Index": 10}
-    table.set_style(ORGMODE)
-
-    for token in tokens:
-        table.add_row([token.lineno, token.lexeme, token.type, token.index+1, token.error], divider=True)
-    
-    
-    # If you don't want to generate a file for the symbol table, you can comment out the following lines or the return code.
-    # This will prevent the creation of a file and only display the symbol table as output in the console.
-    with open(output_file_path, 'w') as output_file:
-        output_file.write(table.get_string())
-    
-    
-    print(table)
-    return f"{table}"
+    def __init__(self, code=''):
+        super().__init__(code)
+
+    # the source is kept as its lines, setting it scans it again
+    @property
+    def code(self):
+        return '\n'.join(self.lines)
+
+    @code.setter
+    def code(self, code):
+        self.lines = code.split('\n')
+        self.line_tokens = []           # tokens of every line
+        self.states = []                # state of the scanner after every line
+        self.relex(0, 0, len(self.lines))
+
+    @property
+    def tokens(self):
+        return [token for tokens in self.line_tokens for token in tokens]
+
+    def tokenize(self):
+        return self.tokens
+
+    # Replaces the text between start and end, both (line number, column) like the index of a Tk text widget.
+    # Returns the change of lines as (first line number, lines removed, lines added), see relex.
+    def edit(self, start, end, text):
+        (first, column), (last, last_column) = start, end
+        lines = (self.lines[first - 1][:column] + text + self.lines[last - 1][last_column:]).split('\n')
+        self.lines[first - 1:last] = lines
+        return self.relex(first - 1, last - first + 1, len(lines))
+
+    # Takes the whole new source, e.g. the content of the editor after a key press, and re-scans the lines
+    # between the unchanged start and end of the source
+    def update(self, code):
+        lines = code.split('\n')
+        old = self.lines
+        limit = min(len(lines), len(old))
+        first = 0
+        while first < limit and lines[first] == old[first]:
+            first += 1
+        last = 0
+        while last < limit - first and lines[-1 - last] == old[-1 - last]:
+            last += 1
+        self.lines = lines
+        return self.relex(first, len(old) - first - last, len(lines) - first - last)
+
+    # Scans the added lines that replaced the removed lines at index first, and the lines after them up to the
+    # first one that starts in the same state as before. The tokens of the following lines are kept and renumbered.
+    # Returns (first line number, lines removed, lines added) of the tokens that changed, the lines after them
+    # only moved when removed and added differ.
+    def relex(self, first, removed, added):
+        state = self.states[first - 1] if first else (False, 0)
+        shift = added - removed
+        tokens = []
+        states = []
+        index = first
+        while index < len(self.lines):
+            old = index - shift
+            if index >= first + added and state == (self.states[old - 1] if old else (False, 0)):
+                break
+            tokens.append(list(self.scan((self.lines[index],), index + 1, *state, states)))
+            state = states[-1]
+            index += 1
+        old = index - shift
+        self.line_tokens[first:old] = tokens
+        self.states[first:old] = states
+        if shift:
+            for lineno in range(index + 1, len(self.lines) + 1):
+                for token in self.line_tokens[lineno - 1]:
+                    token.lineno = lineno
+        return first + 1, old - first, index - first
+
+    # number of rows of the symbol table
+    def row_count(self):
+        return sum(len(tokens) for tokens in self.line_tokens)
+
+    # Rows of the symbol table from the row start, at most count of them, for a page of the GUI panel.
+    # Returns the rows and the last line number on the page, None when the page is not full and a change to any
+    # later line can add rows to it.
+    def symbol_page(self, start, count):
+        rows = []
+        seen = 0
+        for lineno, tokens in enumerate(self.line_tokens, start=1):
+            if seen + len(tokens) > start:
+                for token in tokens[max(start - seen, 0):]:
+                    rows.append(symbol_row(token))
+                    if len(rows) == count:
+                        return rows, lineno
+            seen += len(tokens)
+        return rows, None
+
+
+# Fixed width rows of the symbol table, one line per token, so a changed line replaces only its own rows
+SYMBOL_TITLE = "S Y M B O L   T A B L E"
+SYMBOL_HEADER = f"| {'Line Number':<11} | {'Lexeme':<20} | {'Token':<20} | {'Index':<10} | Error"
+SYMBOL_COLUMNS = ['Line Number', 'Lexeme', 'Token', 'Index', 'Error']
+
+def symbol_row(token):
+    lexeme = token.lexeme if len(token.lexeme) <= 20 else token.lexeme[:17] + '...'
+    return f"| {token.lineno:<11} | {lexeme:<20} | {token.type:<20} | {token.index + 1:<10} | {token.error}"
+
+
+# Symbol table writers. Each one writes a token as soon as it gets it, except PrettySymbolWriter, which builds
+# the original PrettyTable and writes it when it is closed.
+
+# fixed width table, the rows the GUI panel shows
+class TableSymbolWriter:
+    binary = False
+
+    def __init__(self, file):
+        self.file = file
+        file.write(f"{SYMBOL_TITLE}\n{SYMBOL_HEADER}\n")
+
+    def write(self, token):
+        self.file.write(symbol_row(token) + '\n')
+
+    def close(self):
+        pass
+
+
+class CsvSymbolWriter:
+    binary = False
+
+    def __init__(self, file):
+        self.writer = csv.writer(file, lineterminator='\n')
+        self.writer.writerow(SYMBOL_COLUMNS)
+
+    def write(self, token):
+        self.writer.writerow((token.lineno, token.lexeme, token.type, token.index + 1, token.error))
+
+    def close(self):
+        pass
+
+
+# one JSON object per line
+class JsonSymbolWriter:
+    binary = False
+
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, token):
+        row = {'lineno': token.lineno, 'lexeme': token.lexeme, 'token': token.type, 'index': token.index + 1}
+        if token.error:
+            row['error'] = token.error
+        self.file.write(json.dumps(row) + '\n')
+
+    def close(self):
+        pass
+
+
+# Binary symbol table: the magic bytes, the token type names (their ids are the order of the names), then a record
+# of BINARY_RECORD per token followed by its lexeme and error in UTF-8. read_symbols reads it back.
+SYMBOL_MAGIC = b'CASHSYM1'
+BINARY_RECORD = struct.Struct('<IHIIII')     # line number, type id, index, end, lexeme size, error size
+
+class BinarySymbolWriter:
+    binary = True
+
+    def __init__(self, file):
+        self.file = file
+        names = '\n'.join(TOKEN_TYPES).encode()
+        file.write(SYMBOL_MAGIC + struct.pack('<I', len(names)) + names)
+        self.types = len(TOKEN_TYPES)
+
+    def write(self, token):
+        if token.type_id >= self.types:
+            raise ValueError(f"Token type '{token.type}' was registered after the symbol table was started")
+        lexeme = token.lexeme.encode()
+        error = token.error.encode()
+        self.file.write(BINARY_RECORD.pack(token.lineno, token.type_id, token.index, token.end, len(lexeme), len(error))
+                        + lexeme + error)
+
+    def close(self):
+        pass
+
+
+# the original ORGMODE table of prettytable, the whole table is built in memory first
+class PrettySymbolWriter:
+    binary = False
+
+    def __init__(self, file):
+        from prettytable import PrettyTable, ORGMODE
+        self.file = file
+        # style of the symbol table
+        self.table = PrettyTable(SYMBOL_COLUMNS)
+        self.table.title = SYMBOL_TITLE
+        self.table._max_width = {"Lexeme" : 20, "Error": 20}
+        self.table._min_width = {"Token": 20, "Index": 10}
+        self.table.set_style(ORGMODE)
+
+    def write(self, token):
+        self.table.add_row([token.lineno, token.lexeme, token.type, token.index+1, token.error], divider=True)
+
+    def close(self):
+        self.file.write(self.table.get_string() + '\n')
+
+
+# writer and file extension of every symbol table format
+SYMBOL_FORMATS = {
+    'table': (TableSymbolWriter, 'cash'),
+    'csv': (CsvSymbolWriter, 'csv'),
+    'jsonl': (JsonSymbolWriter, 'jsonl'),
+    'binary': (BinarySymbolWriter, 'bin'),
+    'pretty': (PrettySymbolWriter, 'cash'),
+}
+
+
+# reads the tokens of a binary symbol table file
+def read_symbols(file):
+    if file.read(len(SYMBOL_MAGIC)) != SYMBOL_MAGIC:
+        raise ValueError("Not a binary symbol table")
+    size, = struct.unpack('<I', file.read(4))
+    type_ids = [token_type_id(name) for name in file.read(size).decode().split('\n')]
+    while True:
+        record = file.read(BINARY_RECORD.size)
+        if not record:
+            return
+        lineno, type_id, index, end, lexeme_size, error_size = BINARY_RECORD.unpack(record)
+        lexeme = file.read(lexeme_size).decode()
+        error = file.read(error_size).decode()
+        yield Token(type_ids[type_id], lexeme, lineno, index, end, error)
+
+
+# Writes the symbol table of the code to a timestamped file in symboltables/ and prints it, row by row as the tokens
+# are scanned. format is one of SYMBOL_FORMATS; save=False or show=False skips the file or the printing.
+# Returns the path of the file, or None when nothing was saved.
+def run(cash_code, tokens=None, format='table', save=True, show=True):
+    writer_class, extension = SYMBOL_FORMATS[format]
+    # tokens already scanned, e.g. by an IncrementalLexer, are used as they are
+    if tokens is None:
+        lexer = Lexer(cash_code)
+        tokens = lexer.iter_tokens()
+
+    writers = []
+    output_file = None
+    output_file_path = None
+    if save:
+        # sets the name of the file generated for the symbol table
+        timestamp = datetime.now().strftime("%Y-%m-%d-%H%M")
+        output_file_path = f"symboltables/Symbol Table_{timestamp}.{extension}"
+        output_file = open(output_file_path, 'wb' if writer_class.binary else 'w', newline=None if writer_class.binary else '')
+        writers.append(writer_class(output_file))
+    if show:
+        # a binary table is shown as the fixed width one
+        writers.append((TableSymbolWriter if writer_class.binary else writer_class)(sys.stdout))
+
+    try:
+        for token in tokens:
+            for writer in writers:
+                writer.write(token)
+        for writer in writers:
+            writer.close()
+    finally:
+        if output_file is not None:
+            output_file.close()
+    return output_file_path
 
 
 # Example usage
-file = r'sample.cash'
-f = open(file, 'r')
-cash_code = f.read()
-print(cash_code)
+if __name__ == '__main__':
+    file = r'sample.cash'
+    f = open(file, 'r')
+    cash_code = f.read()
+    print(cash_code)
 
 
-run(cash_code)
+    run(cash_code)
 
 
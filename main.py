@@ -1,21 +1,70 @@
 import re
+import sys
+import argparse
 import traceback
 from finalparser import *
 from new_function import *
 from plot import *
-from lexer import Token, Lexer
+from lexer import Token, Lexer, SYMBOL_FORMATS, run as write_symbol_table
+from compiler import ProgramCache
+from profiler import Profiler, PROFILE_FORMATS
+from metrics import MetricsCollector
 
 
-file = r'sample.cash'
-f = open(file,  'r')
-data = f.read()   
+def main(file=r'sample.cash', dump=False, optimize=True, plots=None, plot_format='png', cache=None, symbols=None,
+         profile=None, profile_output=None, metrics=None):
+    # saves the plots of the program as files instead of opening a window
+    if plots is not None:
+        set_output('file', plots, plot_format)
+    f = open(file,  'r')
+    data = f.read()   
 
-table_values = Tables_Values()
-parser = Parser(table_values)
-lexer = Lexer(data)
-try:
-    tokens = lexer.pass_data()
-    res = parser.parse_code(tokens)
-    result = table_values.get_terminal() 
-except:
-    traceback.print_exc()
+    table_values = Tables_Values()
+    # a script that ran before with the same interpreter is loaded compiled from the cache directory
+    program_cache = ProgramCache(cache) if cache is not None else None
+    # the profile report goes to stderr, or to profile_output, after the program ran
+    profiler = Profiler() if profile is not None else None
+    parser = Parser(table_values, optimize=optimize, program_cache=program_cache, profiler=profiler)
+    # counters of the run, written in the Prometheus text format once the program ends
+    collector = MetricsCollector({'script': file}).attach(parser) if metrics is not None else None
+    lexer = Lexer(data)
+    try:
+        tokens = lexer.pass_data()
+        res = parser.parse_code(tokens)
+        result = table_values.get_terminal() 
+        # prints the instructions the program ran, after the optimization pass
+        if dump and parser.program is not None:
+            print(parser.program.disassemble())
+        # writes the symbol table of the program, from the tokens kept in the cache when there is one
+        if symbols is not None:
+            write_symbol_table(data, parser.tokens, symbols, show=False)
+        if profiler is not None:
+            if profile_output is not None:
+                with open(profile_output, 'w') as f:
+                    profiler.write(f, profile)
+            else:
+                profiler.write(sys.stderr, profile)
+        if collector is not None:
+            collector.write_prometheus(metrics)
+    except:
+        traceback.print_exc()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Runs a CASH program.')
+    arg_parser.add_argument('file', nargs='?', default='sample.cash', help='CASH program to run')
+    arg_parser.add_argument('--dump', action='store_true', help='print the compiled instructions after running')
+    arg_parser.add_argument('--no-optimize', action='store_true',
+                            help='run the program as written, without constant folding or hoisting')
+    arg_parser.add_argument('--plots', metavar='DIR', help='save the plots to DIR instead of showing them')
+    arg_parser.add_argument('--plot-format', choices=PLOT_FORMATS, default='png', help='image format of the saved plots')
+    arg_parser.add_argument('--cache', metavar='DIR', help='keep the compiled program in DIR and reuse it on the next run')
+    arg_parser.add_argument('--symbols', choices=SYMBOL_FORMATS,
+                            help='save the symbol table of the program to symboltables/ in this format')
+    arg_parser.add_argument('--profile', choices=PROFILE_FORMATS,
+                            help='report the hits and time of every line in this format after running')
+    arg_parser.add_argument('--profile-output', metavar='FILE', help='write the profile report to FILE instead of stderr')
+    arg_parser.add_argument('--metrics', metavar='FILE', help='write the runtime counters to FILE in the Prometheus text format')
+    args = arg_parser.parse_args()
+    main(args.file, args.dump, not args.no_optimize, args.plots, args.plot_format, args.cache, args.symbols,
+         args.profile, args.profile_output, args.metrics)
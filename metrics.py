@@ -0,0 +1,146 @@
+import os
+import time
+
+"""
+Runtime metrics of CASH scripts, exported in the Prometheus text format.
+
+A MetricsCollector attached to a Parser registers its hooks (see finalparser.HOOK_EVENTS) and counts, over every
+script the Parser runs:
+    cash_scripts_total              scripts run
+    cash_run_seconds_total          time spent running them
+    cash_statements_total           statements executed, a loop header once more on every iteration
+    cash_loop_iterations_total      iterations of every while and for loop, by kind and line
+    cash_blocks_total               bodies run by kind: func calls, loop iterations, if/elif/else arms
+    cash_eval_cache_hits_total      expressions found compiled in the code cache of the script, and the misses
+    cash_output_bytes_total         bytes of output sent to the targets
+    cash_errors_total               errors reported, by exception type (CompileError for code that did not compile)
+    cash_peak_variables             largest number of global variables a script had at once
+
+The statement and block hooks make the Parser compile the program with LINE and BLOCK instructions; a Parser without
+hooks runs the program exactly as before.
+
+Usage:
+    collector = MetricsCollector({'job': 'nightly'}).attach(parser)
+    parser.parse_code(code)
+    collector.write_prometheus('metrics/cash.prom')
+
+    python main.py sample.cash --metrics cash.prom
+"""
+
+
+# the exception type of an error reported without an exception, for code that did not compile
+COMPILE_ERROR = 'CompileError'
+
+
+# escapes a label value of the Prometheus text format
+def label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# the {name="value",...} part of a sample, '' without labels
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{label_value(value)}"' for name, value in labels.items()) + '}'
+
+
+class MetricsCollector:
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})    # labels added to every sample, e.g. {'job': 'nightly'}
+        self.parser = None
+        self.scripts = 0
+        self.seconds = 0.0
+        self.statements = 0
+        self.loop_iterations = {}           # iterations by (kind, lineno) of the loop
+        self.blocks = {}                    # bodies run by kind
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.output_bytes = 0
+        self.errors = {}                    # errors by exception type
+        self.peak_variables = 0
+        self.started = None                 # time the running script started
+        self.cache_start = (0, 0)           # hits and misses of the code cache when the script started
+
+    # registers the hooks of the collector on the Parser, returns the collector
+    def attach(self, parser):
+        self.parser = parser
+        parser.add_hooks(self)
+        return self
+
+    def on_statement(self, lineno):
+        self.statements += 1
+        # the global layer also holds __builtins__
+        count = len(self.parser.table_values.variables) - 1
+        if count > self.peak_variables:
+            self.peak_variables = count
+
+    def on_block_enter(self, kind, lineno):
+        if kind == 'script':
+            self.scripts += 1
+            self.started = time.perf_counter()
+            cache = self.parser.code_cache
+            self.cache_start = (cache.hits, cache.misses) if cache is not None else (0, 0)
+            return
+        self.blocks[kind] = self.blocks.get(kind, 0) + 1
+        if kind == 'while' or kind == 'for':
+            loop = (kind, lineno)
+            self.loop_iterations[loop] = self.loop_iterations.get(loop, 0) + 1
+
+    def on_block_exit(self, kind, lineno):
+        if kind != 'script' or self.started is None:
+            return
+        self.seconds += time.perf_counter() - self.started
+        self.started = None
+        cache = self.parser.code_cache
+        if cache is not None:
+            self.cache_hits += cache.hits - self.cache_start[0]
+            self.cache_misses += cache.misses - self.cache_start[1]
+
+    def on_error(self, message, exception):
+        error_type = COMPILE_ERROR if exception is None else type(exception).__name__
+        self.errors[error_type] = self.errors.get(error_type, 0) + 1
+
+    def on_output(self, text):
+        self.output_bytes += len(text.encode('utf-8', 'surrogatepass'))
+
+    # returns the metrics as (name, type, help, [(labels, value)])
+    def families(self):
+        return [
+            ('cash_scripts_total', 'counter', 'Scripts run.', [({}, self.scripts)]),
+            ('cash_run_seconds_total', 'counter', 'Seconds spent running scripts.', [({}, self.seconds)]),
+            ('cash_statements_total', 'counter', 'Statements executed.', [({}, self.statements)]),
+            ('cash_loop_iterations_total', 'counter', 'Iterations of each while and for loop.',
+             [({'kind': kind, 'line': lineno}, count)
+              for (kind, lineno), count in sorted(self.loop_iterations.items(), key=lambda item: item[0][1])]),
+            ('cash_blocks_total', 'counter', 'Block bodies run, by kind.',
+             [({'kind': kind}, count) for kind, count in sorted(self.blocks.items())]),
+            ('cash_eval_cache_hits_total', 'counter', 'Expressions found compiled in the code cache.',
+             [({}, self.cache_hits)]),
+            ('cash_eval_cache_misses_total', 'counter', 'Expressions compiled because the code cache missed.',
+             [({}, self.cache_misses)]),
+            ('cash_output_bytes_total', 'counter', 'Bytes of output produced.', [({}, self.output_bytes)]),
+            ('cash_errors_total', 'counter', 'Errors reported, by exception type.',
+             [({'type': error_type}, count) for error_type, count in sorted(self.errors.items())]),
+            ('cash_peak_variables', 'gauge', 'Largest number of global variables of a script.',
+             [({}, self.peak_variables)]),
+        ]
+
+    # the metrics in the Prometheus text exposition format
+    def prometheus(self):
+        rows = []
+        for name, metric_type, help_text, samples in self.families():
+            rows.append(f"# HELP {name} {help_text}")
+            rows.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                rows.append(f"{name}{format_labels({**self.labels, **labels})} {value}")
+        return '\n'.join(rows) + '\n'
+
+    # Writes the metrics to a file, e.g. for the textfile collector of the node exporter. The file is written under
+    # another name and renamed, so a scrape never reads half of it.
+    def write_prometheus(self, path):
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(temporary, path)
+
+    def __repr__(self):
+        return f"MetricsCollector(scripts={self.scripts}, statements={self.statements})"
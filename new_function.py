@@ -1,8 +1,12 @@
-import matplotlib as m
-
 def _round(expression):
     return round(expression, 2)
 
+# marks a function whose result only depends on its arguments, a script run with @memoize caches its results
+def pure(function):
+    function.pure = True
+    return function
+
+@pure
 def simple_interest(principal, rate, time):
     try:
         rate /= 100
@@ -15,6 +19,7 @@ def simple_interest(principal, rate, time):
         print(f"{e}")
 
 
+@pure
 def compound_interest(principal, rate, time, compounding_periods = 1):
     try:
         rate/=100
@@ -27,6 +32,7 @@ def compound_interest(principal, rate, time, compounding_periods = 1):
         print(f"{e}")
      
         
+@pure
 def simple_annuity(payment, rate, time, frequency):
     try:
         rate = rate/100
@@ -39,6 +45,7 @@ def simple_annuity(payment, rate, time, frequency):
         print(f"Error calculating simple annuity: {e}")
      
         
+@pure
 def stock_dividend(total_div, total_share):
     try:
         return total_div / total_share
@@ -52,6 +59,7 @@ def stock_dividend(total_div, total_share):
         return None
 
 
+@pure
 def div_pershare(div_percentage, par_value, share_num):
     try:
         return _round(div_percentage * par_value * share_num)
@@ -62,6 +70,7 @@ def div_pershare(div_percentage, par_value, share_num):
         return None
 
 
+@pure
 def yield_ratio(div_per_share, market_val):
     try:
         return _round(div_per_share / market_val)
@@ -75,6 +84,7 @@ def yield_ratio(div_per_share, market_val):
         return None
 
 
+@pure
 def coupon_payment(principal, rate, frequency):
     try:
         rate /= 100
@@ -86,6 +96,7 @@ def coupon_payment(principal, rate, frequency):
         return None
 
 
+@pure
 def coupon_amount(face_value, rate, frequency):
     try:
         rate /= 100
@@ -97,6 +108,7 @@ def coupon_amount(face_value, rate, frequency):
         return None
 
 
+@pure
 def loan_principal(future_value, rate, time, frequency):
     try:
         rate /= 100
@@ -108,6 +120,7 @@ def loan_principal(future_value, rate, time, frequency):
         return None
 
 
+@pure
 def loanfv_pin(principal, rate, frequency):
     try:
         rate /= 100
@@ -119,6 +132,7 @@ def loanfv_pin(principal, rate, frequency):
         return None
 
 
+@pure
 def loanfv_rtm(regular_payment, time, frequency):
     try:
         return _round(regular_payment * time * frequency)
@@ -127,6 +141,121 @@ def loanfv_rtm(regular_payment, time, frequency):
     except (TypeError, ValueError):
         print("Error: Invalid input. Make sure regular_payment, time, and frequency are numeric.")
         return None
+
+
+# Batch versions of the financial functions.
+# Every argument can be a number, a list or a NumPy array; the arguments are broadcast against each other and the
+# result is a NumPy masked array rounded like _round. Rows that cannot be computed (non-numeric input, division by
+# zero, overflow) are masked instead of printing an error for each of them.
+
+def _numpy():
+    import numpy
+    return numpy
+
+
+# converts one argument to an array of floats, values that are not numbers become NaN
+def _as_array(np, value):
+    try:
+        return np.asarray(value, dtype=float)
+    except (TypeError, ValueError):
+        def to_float(item):
+            try:
+                return float(item)
+            except (TypeError, ValueError):
+                return float('nan')
+        return np.frompyfunc(to_float, 1, 1)(np.asarray(value, dtype=object)).astype(float)
+
+
+# Operations of a batch formula. Each one records the rows where the scalar function would fail, a division by zero
+# or a value that is not finite, since later steps can hide them: inf ** 0 is 1 and 1 / inf is 0.
+class _Rows:
+    def __init__(self, np, shape):
+        self.np = np
+        self.invalid = np.zeros(shape, dtype=bool)
+
+    def check(self, values):
+        self.invalid |= ~self.np.isfinite(values)
+        return values
+
+    def div(self, numerator, denominator):
+        self.invalid |= denominator == 0
+        return self.check(numerator / denominator)
+
+    def pow(self, base, exponent):
+        return self.check(base ** exponent)
+
+    # rounds like round(), np.round scales by 10 ** digits first and can land on the other side of a half
+    def round(self, values, digits=2):
+        np = self.np
+        values = self.check(values)
+        rounded = np.array(np.round(values, digits))
+        scaled = values * 10.0 ** digits
+        near_half = np.abs(np.abs(scaled - np.floor(scaled)) - 0.5) <= 1e-6 * np.maximum(1.0, np.abs(scaled))
+        if near_half.any():
+            rounded[near_half] = [round(float(value), digits) for value in np.asarray(values)[near_half]]
+        return rounded
+
+
+def _batch(formula, *args):
+    np = _numpy()
+    arrays = np.broadcast_arrays(*[_as_array(np, arg) for arg in args])
+    rows = _Rows(np, arrays[0].shape)
+    with np.errstate(all='ignore'):
+        values = rows.check(formula(rows, *arrays))
+    return np.ma.masked_array(values, mask=rows.invalid)
+
+
+def simple_interest_batch(principal, rate, time):
+    return _batch(lambda rows, p, r, t: rows.round(p * (r / 100) * t), principal, rate, time)
+
+
+def compound_interest_batch(principal, rate, time, compounding_periods=1):
+    def formula(rows, p, r, t, c):
+        return rows.round(p * rows.pow(1 + rows.div(r / 100, c), c * t) - p)
+    return _batch(formula, principal, rate, time, compounding_periods)
+
+
+def simple_annuity_batch(payment, rate, time, frequency):
+    def formula(rows, pay, r, t, f):
+        r = r / 100
+        n = rows.round(rows.round(t) * f)
+        j = rows.round(rows.div(r, f), 4)
+        return rows.round(rows.div(pay * (1 - rows.pow(1 + r, -n)), j))
+    return _batch(formula, payment, rate, time, frequency)
+
+
+def stock_dividend_batch(total_div, total_share):
+    return _batch(lambda rows, d, s: rows.div(d, s), total_div, total_share)
+
+
+def div_pershare_batch(div_percentage, par_value, share_num):
+    return _batch(lambda rows, d, p, n: rows.round(d * p * n), div_percentage, par_value, share_num)
+
+
+def yield_ratio_batch(div_per_share, market_val):
+    return _batch(lambda rows, d, m: rows.round(rows.div(d, m)), div_per_share, market_val)
+
+
+def coupon_payment_batch(principal, rate, frequency):
+    return _batch(lambda rows, p, r, f: rows.round(rows.div(p * (r / 100), f)), principal, rate, frequency)
+
+
+def coupon_amount_batch(face_value, rate, frequency):
+    return _batch(lambda rows, v, r, f: rows.round(rows.div(v * (r / 100), f)), face_value, rate, frequency)
+
+
+def loan_principal_batch(future_value, rate, time, frequency):
+    def formula(rows, v, r, t, f):
+        return rows.round(rows.div(v, rows.pow(1 + rows.div(r / 100, f), t * f)))
+    return _batch(formula, future_value, rate, time, frequency)
+
+
+def loanfv_pin_batch(principal, rate, frequency):
+    return _batch(lambda rows, p, r, f: rows.round(p * (1 + rows.div(r / 100, f))), principal, rate, frequency)
+
+
+def loanfv_rtm_batch(regular_payment, time, frequency):
+    return _batch(lambda rows, p, t, f: rows.round(p * t * f), regular_payment, time, frequency)
     
 def get(prompt=""):
     try:
@@ -1,33 +1,206 @@
-import matplotlib.pyplot as plt
-import numpy as np
+import io
+import os
+import contextlib
+import importlib
+
+
+# matplotlib and numpy are imported on the first plot, not when the module is imported
+def _pyplot():
+    return importlib.import_module('matplotlib.pyplot')
+
+def _numpy():
+    return importlib.import_module('numpy')
+
+
+# Output modes of the plot functions:
+#   'show'   draws on a pyplot figure and shows it, the default for the GUI and the command line
+#   'file'   renders the plot with Agg into a PNG or SVG file in the output directory
+#   'bytes'  renders the plot with Agg into memory, take_rendered() returns the images
+PLOT_MODES = ('show', 'file', 'bytes')
+PLOT_FORMATS = ('png', 'svg')
+
+# pixels given to each bar label, more bars than fit share one label
+BAR_LABEL_WIDTH = 40
+
+
+# where the plot functions send their figures, see set_output
+class _PlotOutput:
+    def __init__(self):
+        self.mode = 'show'
+        self.directory = None
+        self.format = 'png'
+        self.dpi = 100
+        self.count = 0                  # number of plots rendered, numbers the file names
+        self.rendered = []              # paths written in 'file' mode, (name, bytes) in 'bytes' mode
+        self.figure = None              # Agg figure reused by every render of this process
+
+_output = _PlotOutput()
+
+
+# chooses where the next plots go, e.g. set_output('file', 'reports', 'svg') on a server without a display
+def set_output(mode='show', directory=None, format='png', dpi=100):
+    if mode not in PLOT_MODES:
+        raise ValueError(f"Unknown plot output '{mode}', expected one of {', '.join(PLOT_MODES)}")
+    if format not in PLOT_FORMATS:
+        raise ValueError(f"Unknown plot format '{format}', expected one of {', '.join(PLOT_FORMATS)}")
+    if mode == 'file':
+        directory = directory or '.'
+        os.makedirs(directory, exist_ok=True)
+    _output.mode = mode
+    _output.directory = directory
+    _output.format = format
+    _output.dpi = dpi
+    _output.rendered = []
+
+# returns the files or images rendered since the last call
+def take_rendered():
+    rendered = _output.rendered
+    _output.rendered = []
+    return rendered
+
+# the Agg figure of this process, created on the first render and cleared between plots
+def _agg_figure():
+    if _output.figure is None:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        _output.figure = Figure()
+        FigureCanvasAgg(_output.figure)
+    return _output.figure
+
+# draws a plot with draw(axes) and sends it to the output
+def _render(name, draw):
+    if _output.mode == 'show':
+        plt = _pyplot()
+        figure = plt.figure()
+        try:
+            draw(figure.add_subplot())
+            plt.show()
+        finally:
+            # a new figure per plot, so artists do not pile up across calls
+            plt.close(figure)
+        return
+
+    figure = _agg_figure()
+    figure.clear()
+    figure.set_dpi(_output.dpi)
+    try:
+        draw(figure.add_subplot())
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format=_output.format, dpi=_output.dpi)
+    finally:
+        figure.clear()
+    _output.count += 1
+    if _output.mode == 'bytes':
+        _output.rendered.append((name, buffer.getvalue()))
+        return
+    path = os.path.join(_output.directory, f"{name}_{_output.count}.{_output.format}")
+    with open(path, 'wb') as f:
+        f.write(buffer.getvalue())
+    _output.rendered.append(path)
+
+
+# runs one job of render_batch in a worker process, returns the rendered files and the printed text
+def _render_job(job):
+    index, name, args, directory, format, dpi = job
+    set_output('file', directory, format, dpi)
+    _output.count = index
+    printed = io.StringIO()
+    with contextlib.redirect_stdout(printed):
+        globals()[name](*args)
+    return take_rendered(), printed.getvalue()
+
+# Renders many plots across a process pool. jobs is a list of (function name, arguments), e.g.
+#     render_batch([('plot_sint', ((1000, 5, 10),)), ('plot_loan', ((20000, 5, 3, 12),))], 'reports')
+# Each worker imports matplotlib once and reuses its Agg figure. Returns a (files, printed text) pair per job,
+# in the order of the jobs.
+def render_batch(jobs, directory, format='png', dpi=100, workers=None):
+    from concurrent.futures import ProcessPoolExecutor
+    os.makedirs(directory, exist_ok=True)
+    tasks = [(index, name, tuple(args), directory, format, dpi) for index, (name, args) in enumerate(jobs)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_render_job, tasks))
+
+# the input sets of a plot as one float array per parameter, a missing value (None) becomes nan
+def _columns(args, count):
+    np = _numpy()
+    for params in args:
+        if len(params) != count:
+            raise ValueError(f"Expected {count} values in each input set, got {len(params)}")
+    return np.array(args, dtype=float).reshape(len(args), count).T
+
+# Periods 1..time of every input set as one column per set, computed once for all the sets.
+# Periods past the time of a set are nan, so every formula leaves them out of the curve of that set.
+# Returns the x values, the periods and the number of periods of each set.
+def _periods(time):
+    np = _numpy()
+    counts = np.ceil(time).astype(int)
+    if counts.size == 0 or counts.min() < 1:
+        raise ValueError("Time must be at least 1")
+    x = np.arange(1, counts.max() + 1, dtype=float)
+    periods = np.where(x[:, None] <= counts, x[:, None], np.nan)
+    return x, periods, counts
+
+# the last value of every column
+def _last(values, counts):
+    np = _numpy()
+    return values[counts - 1, np.arange(values.shape[1])]
+
+# Reduces a series longer than width to the minimum and maximum of width / 2 buckets, so the drawn curve
+# keeps its envelope with about one point per pixel. values has one column per series, nan is skipped.
+def _decimate(x, values, width):
+    np = _numpy()
+    if len(x) <= width:
+        return x, values
+    edges = np.linspace(0, len(x), max(width // 2, 1) + 1).astype(int)
+    starts, ends = edges[:-1], edges[1:] - 1
+    low = np.fmin.reduceat(values, starts, axis=0)
+    high = np.fmax.reduceat(values, starts, axis=0)
+    # a falling bucket puts its maximum first, so the order of the points follows the curve
+    rising = ~(values[ends] < values[starts])
+    first = np.where(rising, low, high)
+    second = np.where(rising, high, low)
+    return np.column_stack([x[starts], x[ends]]).ravel(), np.stack([first, second], axis=1).reshape(-1, values.shape[1])
+
+# draws every column of values as a line with one plot call, decimated to the pixel width of the axes
+def _draw_lines(ax, x, values, labels):
+    drawn_x, drawn = _decimate(x, values, int(ax.bbox.width))
+    # markers only while every point is drawn
+    ax.plot(drawn_x, drawn, label=labels, marker='o' if len(drawn_x) == len(x) else None)
+
+# labels the bars at positions, leaving out labels once there are more than fit along the axes
+def _bar_ticks(ax, positions, labels):
+    step = -(-len(labels) // max(int(ax.bbox.width) // BAR_LABEL_WIDTH, 1))
+    ax.set_xticks(positions[::step], labels[::step])
 
 def __round(value):
     return round(value, 3)
 
 def plot_sint(*args):
     try:
-        # Plotting simple interest over time for each set of inputs
-        for i, input_set in enumerate(args, start=0):
-            principal, rate, time = input_set
-            rate /= 100
-            time_periods = np.arange(1, time + 1)
-            simple_interest_values = (principal * rate * time_periods + principal)
-
-            # Plotting simple interest over time with custom label ('a', 'b', 'c', etc.)
-            label = f'Interest {chr(ord("A") + i)}'  # Converts integer index to corresponding ASCII character
-            plt.plot(time_periods, simple_interest_values, label=label, marker='o')
-            print(f'Interest {chr(ord("A") + i)}: {simple_interest_values[-1]:.3f}')
+        principal, rate, time = _columns(args, 3)
+        rate /= 100
+        # Simple interest over time for every set of inputs at once
+        x, time_periods, counts = _periods(time)
+        simple_interest_values = (principal * rate * time_periods + principal)
 
-        # Adding labels and title
-        plt.xlabel('Time (Years)')
-        plt.ylabel('Interest Amount')
-        plt.title('Simple Interest Over Time')
+        # Plotting simple interest over time with custom label ('a', 'b', 'c', etc.)
+        labels = [f'Interest {chr(ord("A") + i)}' for i in range(len(args))]  # Converts integer index to corresponding ASCII character
+        for label, value in zip(labels, _last(simple_interest_values, counts)):
+            print(f'{label}: {value:.3f}')
 
-        # Adding a legend
-        plt.legend()
+        def draw(ax):
+            _draw_lines(ax, x, simple_interest_values, labels)
+
+            # Adding labels and title
+            ax.set_xlabel('Time (Years)')
+            ax.set_ylabel('Interest Amount')
+            ax.set_title('Simple Interest Over Time')
+
+            # Adding a legend
+            ax.legend()
 
         # Display the graph
-        plt.show()
+        _render('plot_sint', draw)
 
     except SyntaxError as se:
         error_message = str("Invalid Syntax")
@@ -40,29 +213,31 @@ def plot_sint(*args):
 
 def plot_cint(*args):
     try:
-        # Plotting compound interest over time for each set of inputs
-        for i, input_set in enumerate(args, start=1):
-            principal, rate, time, compounding_periods = input_set
-            rate /= 100
-            time_values = np.arange(1, time + 1)
-            compound_interest_values = ((principal * (1 + rate / compounding_periods) ** (compounding_periods * time_values)) - principal) 
+        principal, rate, time, compounding_periods = _columns(args, 4)
+        rate /= 100
+        # Compound interest over time for every set of inputs at once
+        x, time_values, counts = _periods(time)
+        compound_interest_values = ((principal * (1 + rate / compounding_periods) ** (compounding_periods * time_values)) - principal) 
     
 
-            # Using a character based on the index for the legend label
-            label = f'Interest {chr(ord("A") + i - 1)}'
-            plt.plot(time_values, compound_interest_values, label=label, marker='o')
-            print(f'Interest {chr(ord("A") + i - 1)}: {compound_interest_values[-1]:.3f}')
+        # Using a character based on the index for the legend label
+        labels = [f'Interest {chr(ord("A") + i)}' for i in range(len(args))]
+        for label, value in zip(labels, _last(compound_interest_values, counts)):
+            print(f'{label}: {value:.3f}')
 
-        # Adding labels and title
-        plt.xlabel('Time (Years)')
-        plt.ylabel('Interest Amount')
-        plt.title('Compound Interest Over Time')
+        def draw(ax):
+            _draw_lines(ax, x, compound_interest_values, labels)
 
-        # Adding a legend
-        plt.legend()
+            # Adding labels and title
+            ax.set_xlabel('Time (Years)')
+            ax.set_ylabel('Interest Amount')
+            ax.set_title('Compound Interest Over Time')
+
+            # Adding a legend
+            ax.legend()
 
         # Display the graph
-        plt.show()
+        _render('plot_cint', draw)
 
     except SyntaxError as se:
         error_message = str("Invalid Syntax")
@@ -73,44 +248,44 @@ def plot_cint(*args):
 
 
 def plot_sc(simple_interest_list, compound_interest_list):
+    np = _numpy()
     # Ensure both lists have the same length
     if len(simple_interest_list) != len(compound_interest_list):
         raise ValueError("Both input lists must have the same length.")
 
-    # Plotting simple interest and compound interest over time for each set of inputs
-    for i, (simple_params, compound_params) in enumerate(zip(simple_interest_list, compound_interest_list), start=1):
-        # Extracting parameters for simple interest
-        simple_principal, simple_rate, simple_time = simple_params
-        simple_rate/=100
-        simple_time_periods = np.arange(1, simple_time + 1)
-        simple_interest_values = (simple_principal * simple_rate * simple_time_periods + simple_principal)
-
-        # Extracting parameters for compound interest
-        compound_principal, compound_rate, compound_time, compound_periods = compound_params
-        compound_rate/=100
-        compound_time_values = np.arange(1, compound_time + 1)
-        compound_interest_values = ((compound_principal * (1 + compound_rate / compound_periods) ** (compound_periods * compound_time_values)))
-
-        # Using a character based on the index for the legend label
-        # Plotting simple interest
-        plt.plot(simple_time_periods, simple_interest_values, label=f'Simple Interest', marker='o')
-
-        # Plotting compound interest
-        plt.plot(compound_time_values, compound_interest_values, label=f'Compound Interest', marker='o')
-        
-        print(f'Simple Interest {chr(ord("A") + i - 1)}: {simple_interest_values[-1]:.3f}')
-        print(f'Compound Interest {chr(ord("A") + i - 1)}: {compound_interest_values[-1]:.3f}')
+    # Extracting parameters for simple interest
+    simple_principal, simple_rate, simple_time = _columns(simple_interest_list, 3)
+    simple_rate/=100
+    # Extracting parameters for compound interest
+    compound_principal, compound_rate, compound_time, compound_periods = _columns(compound_interest_list, 4)
+    compound_rate/=100
+
+    # Simple and compound interest over time for every pair of inputs, interleaved one column each
+    x, time_periods, counts = _periods(np.concatenate([simple_time, compound_time]))
+    pairs = len(simple_interest_list)
+    simple_interest_values = (simple_principal * simple_rate * time_periods[:, :pairs] + simple_principal)
+    compound_interest_values = ((compound_principal * (1 + compound_rate / compound_periods) ** (compound_periods * time_periods[:, pairs:])))
+    values = np.stack([simple_interest_values, compound_interest_values], axis=2).reshape(len(x), 2 * pairs)
+
+    simple_last = _last(simple_interest_values, counts[:pairs])
+    compound_last = _last(compound_interest_values, counts[pairs:])
+    for i in range(pairs):
+        print(f'Simple Interest {chr(ord("A") + i)}: {simple_last[i]:.3f}')
+        print(f'Compound Interest {chr(ord("A") + i)}: {compound_last[i]:.3f}')
+
+    def draw(ax):
+        _draw_lines(ax, x, values, ['Simple Interest', 'Compound Interest'] * pairs)
 
-    # Adding labels and title
-    plt.xlabel('Time (Years)')
-    plt.ylabel('Interest Amount')
-    plt.title('Simple Interest vs Compound Interest')
+        # Adding labels and title
+        ax.set_xlabel('Time (Years)')
+        ax.set_ylabel('Interest Amount')
+        ax.set_title('Simple Interest vs Compound Interest')
 
-    # Adding a legend
-    plt.legend()
+        # Adding a legend
+        ax.legend()
 
     # Display the graph
-    plt.show()
+    _render('plot_sc', draw)
     
 
 def plot_loan(*args):
@@ -121,40 +296,41 @@ def plot_loan(*args):
     - *args: Variable number of arguments representing sets of parameters for each loan.
       Each set includes principal, rate, time, and an optional monthly payment.
     """
+    np = _numpy()
     bar_width = 0.50
     index = np.arange(len(args))
-    
-    # Plotting the future value for each loan as a bar
-    for i, params in enumerate(args, start=1):
-        principal, rate, time, monthly_payment = params
-        rate /= 100
+    principal, rate, time, monthly_payment = _columns(args, 4)
+    rate /= 100
+
+    # Calculate future value of every loan at once, a loan without monthly payment (None) compounds yearly
+    with_payment = ~np.isnan(monthly_payment)
+    interest_rate_per_period = rate / 12
+    if (with_payment & (interest_rate_per_period == 0)).any():
+        raise ZeroDivisionError("float division by zero")
+    num_payments = time * 12
+    growth = (1 + interest_rate_per_period)**num_payments
+    with np.errstate(divide='ignore', invalid='ignore'):
+        paid = principal * growth + monthly_payment * (growth - 1) / interest_rate_per_period
+    future_value = np.where(with_payment, paid, principal * (1 + rate)**time)
+
+    labels = [f'Loan {chr(ord("A") + i)}' for i in range(len(args))]
+    for label, value in zip(labels, future_value):
+        print(f'{label}: {value:.3f}')
+
+    def draw(ax):
+        # Plotting the future value of all the loans as bars
+        ax.bar(index + 1, future_value, bar_width, color = 'tab:blue')
 
-        # Calculate future value of the loan
-        if monthly_payment is not None:
-            interest_rate_per_period = rate / 12
-            num_payments = time * 12
-            future_value = principal * ((1 + interest_rate_per_period)**num_payments) + monthly_payment * (((1 + interest_rate_per_period)**num_payments) - 1) / interest_rate_per_period
-        else:
-            future_value = principal * (1 + rate)**time
-            
-        (future_value)
-
-        # Plotting the future value for each loan as a bar
-        label = f'Loan {chr(ord("A") + i -1)}'
-        plt.bar(i, future_value, bar_width, label=label, color = 'tab:blue')
-        
-        print(f'Loan {chr(ord("A") + i -1)}: {future_value:.3f}')
-
-    # Adding labels and title
-    plt.xlabel('Loans')
-    plt.ylabel('Future Value')
-    plt.title('Future Value of Loan')
-    
-    plt.xticks(index + 1, [f'Loan {chr(ord("A") + i -1)}' for i in range(1, len(args) + 1)])
+        # Adding labels and title
+        ax.set_xlabel('Loans')
+        ax.set_ylabel('Future Value')
+        ax.set_title('Future Value of Loan')
+
+        _bar_ticks(ax, index + 1, labels)
 
 
     # Display the graph
-    plt.show()
+    _render('plot_loan', draw)
     
     
 def plot_yr(*args):
@@ -165,35 +341,35 @@ def plot_yr(*args):
     - *args: Variable number of arguments representing sets of parameters for each investment.
       Each set includes initial investment, total return, and an optional label.
     """
+    np = _numpy()
     bar_width = 0.50
     index = np.arange(len(args))
-    
-    # Plotting the yield ratio for each investment as a bar
-    for i, params in enumerate(args, start=1):
-        initial_investment, total_return = params
+    initial_investment, total_return = _columns([params[:2] for params in args], 2)
+
+    # Calculate yield ratio of every investment at once
+    if (total_return == 0).any():
+        raise ZeroDivisionError("float division by zero")
+    yield_ratio = (initial_investment / total_return * 100)
 
-        # Calculate yield ratio
-        yield_ratio = (initial_investment / total_return * 100)
-        
-        (yield_ratio)
+    for i, ratio in enumerate(yield_ratio):
+        print(f'Investment {chr(ord("A") + i)}: {ratio:.3f}')
 
-        # Plotting the yield ratio for each investment as a bar
-        label = f'Investment {chr(ord("A") + i - 1)}'
-        plt.bar(i, yield_ratio, bar_width, label = label, color = 'tab:blue')
-        print(f'Investment {chr(ord("A") + i - 1)}: {yield_ratio:.3f}')
+    def draw(ax):
+        # Plotting the yield ratio of all the investments as bars
+        ax.bar(index + 1, yield_ratio, bar_width, color = 'tab:blue')
 
-    # Adding labels and title
-    plt.xlabel('Investments')
-    plt.ylabel('Yield Ratio (in %)')
-    plt.title('Yield Ratio of Investment')
+        # Adding labels and title
+        ax.set_xlabel('Investments')
+        ax.set_ylabel('Yield Ratio (in %)')
+        ax.set_title('Yield Ratio of Investment')
 
-    # Adding x-axis ticks
-    plt.xticks(index + 1, [params[2] if len(params) > 2 else f'Investment {chr(ord("A") + i - 1)}' for i, params in enumerate(args, start=1)])
+        # Adding x-axis ticks
+        _bar_ticks(ax, index + 1, [params[2] if len(params) > 2 else f'Investment {chr(ord("A") + i - 1)}' for i, params in enumerate(args, start=1)])
 
 
 
     # Display the graph
-    plt.show()
+    _render('plot_yr', draw)
     
     
 
@@ -205,23 +381,25 @@ def plot_coup(*args):
     - *args: Variable number of arguments, each representing a set of parameters for a bond.
       Each set includes face value, coupon rate.
     """
-    # Calculate the total coupon amount for each set of parameters
-    total_coupon_amounts = [(arg[0] * arg[1]) for arg in args]
+    # Calculate the total coupon amount for every bond at once
+    face_value, coupon_rate = _columns(args, 2)
+    total_coupon_amounts = face_value * coupon_rate
 
-    # Plotting the total coupon amounts for each bond
-    plt.bar(range(1, len(args) + 1), total_coupon_amounts, width=0.4, tick_label=[f'Bond {chr(ord("A") + i -1)}' for i in range(1, len(args) + 1)])
-    
     for i, amount in enumerate(total_coupon_amounts, start=1):
         print(f'Bond {chr(ord("A") + i - 1)}: {amount:.3f}')
 
-    # Adding labels and title
-    plt.xlabel('Bonds')
-    plt.ylabel('Total Coupon Amount')
-    plt.title('Total Coupon Amount for Bond')
+    def draw(ax):
+        # Plotting the total coupon amounts for each bond
+        ax.bar(range(1, len(args) + 1), total_coupon_amounts, width=0.4)
+        _bar_ticks(ax, range(1, len(args) + 1), [f'Bond {chr(ord("A") + i -1)}' for i in range(1, len(args) + 1)])
+
+        # Adding labels and title
+        ax.set_xlabel('Bonds')
+        ax.set_ylabel('Total Coupon Amount')
+        ax.set_title('Total Coupon Amount for Bond')
 
     # Display the graph
-    plt.show()
-    
+    _render('plot_coup', draw)
     
 
 
@@ -0,0 +1,263 @@
+import sys
+import json
+import time
+
+import new_function
+import plot
+from compiler import FINANCIAL_FUNCTIONS
+
+"""
+Per-line profiler for CASH programs.
+
+A Parser created with `profiler=Profiler()` compiles the program with a LINE instruction at the start of every
+statement (`execute_line` reports its lines the same way without compilation) and wraps the financial functions, the
+plot functions and the functions defined with `func`, so the Profiler sees every line that starts and every call that
+begins and ends. Without a profiler the program is compiled and run exactly as before.
+
+For every source line the Profiler records:
+    hits            how many times the line started
+    self time       time spent on the line itself
+    cumulative      time from the start of the line to the start of the next one, including the calls it made
+and for every kind of call (financial, func, plot) the number of calls and the time spent inside them.
+
+The report is a text table, JSON, or collapsed stacks ("<script>:12;grow:3;simple_interest 1500", in microseconds)
+for flamegraph.pl or speedscope.
+
+Usage:
+    profiler = Profiler()
+    parser = Parser(table_values, profiler=profiler)
+    parser.parse_code(code)
+    profiler.write(sys.stderr, 'text')
+
+    python main.py sample.cash --profile text
+    python main.py sample.cash --profile collapsed --profile-output sample.folded
+"""
+
+
+PROFILE_FORMATS = ('text', 'json', 'collapsed')
+
+# kinds of the calls the profiler times, and the name of the frame the script runs in
+KINDS = ('financial', 'func', 'plot')
+SCRIPT = '<script>'
+
+# number of functions listed in the text report
+TOP_FUNCTIONS = 20
+
+
+# returns the kind of a builtin the profiler times, or None for the Python builtins
+def builtin_kind(name, value):
+    if name in FINANCIAL_FUNCTIONS and value is getattr(new_function, name, None):
+        return 'financial'
+    if name.startswith('plot_') and value is getattr(plot, name, None):
+        return 'plot'
+    return None
+
+
+# a function that tells the Profiler when it is called and when it returns
+class Profiled:
+    def __init__(self, function, profiler, name, kind):
+        self.function = function
+        self.profiler = profiler
+        self.kind = kind
+        self.pure = getattr(function, 'pure', False)    # hoisting and memoization still see a pure function
+        self.__name__ = name
+
+    def __call__(self, *args, **kwargs):
+        profiler = self.profiler
+        profiler.enter(self.__name__, self.kind)
+        try:
+            return self.function(*args, **kwargs)
+        finally:
+            profiler.exit()
+
+    def __repr__(self):
+        return f"<profiled {self.kind} {self.__name__}>"
+
+
+# the script or a call being run
+class ProfileFrame:
+    __slots__ = ('name', 'kind', 'lineno', 'line_start', 'call_start', 'prefix', 'key')
+
+    def __init__(self, name, kind, now, prefix):
+        self.name = name
+        self.kind = kind
+        self.lineno = None              # line being run in the frame, None before the first one
+        self.line_start = now           # time the line started
+        self.call_start = now
+        self.prefix = prefix            # collapsed stack of the caller, with the line that made the call
+        self.key = prefix + name        # collapsed stack of the line being run
+
+
+class Profiler:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.lines = {}                 # [hits, self seconds, cumulative seconds] by line number
+        self.kinds = {kind: [0, 0.0] for kind in KINDS}     # [calls, seconds] by kind of call
+        self.functions = {}             # [calls, cumulative seconds, self seconds] by (kind, name)
+        self.stacks = {}                # self seconds by collapsed stack
+        self.stack = []                 # ProfileFrame of the script and of every call in progress
+        self.active = {}                # number of frames on the stack by line number, kind and (kind, name)
+        self.source = []                # code lines of the script, shown in the text report
+        self.total = 0.0                # seconds the scripts ran
+        self.last = 0.0                 # time the previous event was charged up to
+
+    # starts timing a script, the results of earlier scripts are kept
+    def start(self, lines=None):
+        if lines is not None:
+            self.source = lines
+        self.stack = []
+        self.active = {}
+        self.enter(SCRIPT, 'script')
+
+    def stop(self):
+        while self.stack:
+            self.exit()
+
+    # returns a copy of the builtin layer where the financial and plot functions are profiled
+    def wrap_layer(self, layer):
+        layer = dict(layer)
+        for name, value in layer.items():
+            kind = builtin_kind(name, getattr(value, 'function', value))
+            if kind is not None:
+                layer[name] = Profiled(value, self, name, kind)
+        return layer
+
+    # returns the profiled version of a function defined in the script
+    def wrap(self, function, name):
+        return Profiled(function, self, name, 'func')
+
+    # a statement of the line starts in the running frame
+    def line(self, lineno):
+        now = self.clock()
+        frame = self.stack[-1]
+        self.charge(frame, now)
+        if frame.lineno != lineno:
+            self.close_line(frame, now)
+            stats = self.lines.get(lineno)
+            if stats is None:
+                stats = self.lines[lineno] = [0, 0.0, 0.0]
+            stats[0] += 1
+            self.active[lineno] = self.active.get(lineno, 0) + 1
+            frame.lineno = lineno
+            frame.line_start = now
+            frame.key = f"{frame.prefix}{frame.name}:{lineno}"
+
+    def enter(self, name, kind):
+        now = self.clock()
+        if self.stack:
+            caller = self.stack[-1]
+            self.charge(caller, now)
+            prefix = caller.key + ';'
+        else:
+            self.last = now
+            prefix = ''
+        self.stack.append(ProfileFrame(name, kind, now, prefix))
+        function = (kind, name)
+        if function not in self.functions:
+            self.functions[function] = [0, 0.0, 0.0]
+        self.functions[function][0] += 1
+        if kind in self.kinds:
+            self.kinds[kind][0] += 1
+        self.active[kind] = self.active.get(kind, 0) + 1
+        self.active[function] = self.active.get(function, 0) + 1
+
+    def exit(self):
+        now = self.clock()
+        frame = self.stack[-1]
+        self.charge(frame, now)
+        self.close_line(frame, now)
+        self.stack.pop()
+        elapsed = now - frame.call_start
+        function = (frame.kind, frame.name)
+        # a recursive call is already inside the time of the outer one
+        if self.release(frame.kind):
+            if frame.kind in self.kinds:
+                self.kinds[frame.kind][1] += elapsed
+            elif frame.kind == 'script':
+                self.total += elapsed
+        if self.release(function):
+            self.functions[function][1] += elapsed
+
+    # adds the time since the last event to the line and the stack being run
+    def charge(self, frame, now):
+        elapsed = now - self.last
+        self.last = now
+        if frame.lineno is not None:
+            self.lines[frame.lineno][1] += elapsed
+        self.stacks[frame.key] = self.stacks.get(frame.key, 0.0) + elapsed
+        self.functions[(frame.kind, frame.name)][2] += elapsed
+
+    # the line of the frame ends, its cumulative time counts once while it is on the stack more than once
+    def close_line(self, frame, now):
+        if frame.lineno is not None and self.release(frame.lineno):
+            self.lines[frame.lineno][2] += now - frame.line_start
+
+    # removes one frame of the key from the stack, returns True if it was the outermost one
+    def release(self, key):
+        count = self.active[key] - 1
+        self.active[key] = count
+        return count == 0
+
+    # the code of a line, as far as the profiler knows it
+    def code(self, lineno):
+        if 0 < lineno <= len(self.source):
+            return self.source[lineno - 1].rstrip()
+        return ''
+
+    def to_dict(self):
+        return {
+            'total': self.total,
+            'lines': [{'line': lineno, 'hits': hits, 'self': self_time, 'cumulative': cumulative,
+                       'code': self.code(lineno)}
+                      for lineno, (hits, self_time, cumulative) in sorted(self.lines.items())],
+            'kinds': {kind: {'calls': calls, 'seconds': seconds,
+                             'self': sum(stats[2] for (function_kind, _), stats in self.functions.items()
+                                         if function_kind == kind)}
+                      for kind, (calls, seconds) in self.kinds.items()},
+            'functions': [{'name': name, 'kind': kind, 'calls': calls, 'cumulative': cumulative, 'self': self_time}
+                          for (kind, name), (calls, cumulative, self_time) in self.functions.items()
+                          if kind != 'script'],
+        }
+
+    # collapsed stacks with their self time in whole microseconds, the input of flamegraph.pl
+    def collapsed(self):
+        rows = []
+        for stack, seconds in sorted(self.stacks.items()):
+            microseconds = round(seconds * 1e6)
+            if microseconds:
+                rows.append(f"{stack} {microseconds}")
+        return '\n'.join(rows) + '\n' if rows else ''
+
+    def text(self):
+        report = self.to_dict()
+        rows = [f"Total time: {report['total'] * 1000:.3f} ms", '',
+                f"{'Line':>6} {'Hits':>10} {'Self ms':>11} {'Cumul ms':>11}  Code"]
+        for line in report['lines']:
+            rows.append(f"{line['line']:>6} {line['hits']:>10} {line['self'] * 1000:>11.3f} "
+                        f"{line['cumulative'] * 1000:>11.3f}  {line['code']}")
+        rows += ['', f"{'Kind':<10} {'Calls':>10} {'Inside ms':>11} {'Self ms':>11}"]
+        for kind, stats in report['kinds'].items():
+            rows.append(f"{kind:<10} {stats['calls']:>10} {stats['seconds'] * 1000:>11.3f} {stats['self'] * 1000:>11.3f}")
+        functions = sorted(report['functions'], key=lambda function: function['cumulative'], reverse=True)
+        if functions:
+            rows += ['', f"{'Function':<26} {'Kind':<10} {'Calls':>10} {'Cumul ms':>11} {'Self ms':>11}"]
+            for function in functions[:TOP_FUNCTIONS]:
+                rows.append(f"{function['name']:<26} {function['kind']:<10} {function['calls']:>10} "
+                            f"{function['cumulative'] * 1000:>11.3f} {function['self'] * 1000:>11.3f}")
+        return '\n'.join(rows) + '\n'
+
+    # returns the report in one of PROFILE_FORMATS
+    def report(self, format='text'):
+        if format == 'json':
+            return json.dumps(self.to_dict(), indent=2) + '\n'
+        if format == 'collapsed':
+            return self.collapsed()
+        if format == 'text':
+            return self.text()
+        raise ValueError(f"Unknown profile format {format!r}, expected one of {', '.join(PROFILE_FORMATS)}")
+
+    def write(self, file=None, format='text'):
+        (file or sys.stderr).write(self.report(format))
+
+    def __repr__(self):
+        return f"Profiler(lines={len(self.lines)}, total={self.total:.6f})"
@@ -0,0 +1,270 @@
+import argparse
+import base64
+import json
+import os
+import re
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import batch
+
+"""
+Interpreter server for CASH scripts.
+
+Keeps a pool of warm worker processes, each with the financial and plot functions, numpy and the Agg backend of
+matplotlib already imported (see batch.init_worker), and runs the scripts it receives there. Every script gets a fresh
+Tables_Values and Parser, so nothing one script defines is seen by the next.
+
+The server listens on localhost over HTTP, or on a Unix socket:
+    POST /run           the CASH source as the body, or JSON {"source": ..., "timeout": seconds}
+                        returns JSON with the status (ok, error, timeout or failed), the terminal output, the errors as
+                        {"line", "message"}, the plots as base64 PNG, and the time spent queued and running
+    GET  /metrics       requests by status, latency percentiles, queue depth and pool size
+    GET  /health        200 while the pool is running
+
+Requests wait in a queue while every worker is busy; once max_queue requests are waiting or running, new ones are
+answered with 503 right away.
+
+Usage:
+    python server.py --port 8765 --workers 4
+    python server.py --socket /tmp/cash.sock
+    curl --data-binary @sample.cash http://127.0.0.1:8765/run
+"""
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# requests waiting or running at most, the ones after it are turned away
+DEFAULT_MAX_QUEUE = 64
+# number of recent requests the latency percentiles are computed from
+LATENCY_WINDOW = 1000
+
+ERROR_LINE = re.compile(r'Error in line (\d+): (.*)', re.S)
+
+
+# splits the error messages of a script into their line number and message
+def structured_errors(errors):
+    structured = []
+    for error in errors:
+        match = ERROR_LINE.match(error)
+        if match:
+            structured.append({'line': int(match.group(1)), 'message': match.group(2)})
+        else:
+            structured.append({'line': None, 'message': error})
+    return structured
+
+# runs one request in a worker, job is (source, time limit)
+def run_request(job):
+    source, timeout = job
+    result = batch.run_source(source, timeout)
+    return {
+        'status': result['status'],
+        'output': result['terminal'],
+        'errors': structured_errors(result['errors']),
+        'failure': result['failure'],
+        'plots': [{'name': name, 'png': base64.b64encode(image).decode()} for name, image in result['plots']],
+        'run_seconds': result['seconds'],
+    }
+
+# started once per worker while the server starts, so the first requests find the workers ready
+def warm_up(hold):
+    batch.run_source('x = simple_interest(1000, 5, 2)\n')
+    # keeps this worker busy for a moment, so the other warm-up jobs start the other workers
+    time.sleep(hold)
+    return os.getpid()
+
+
+# value at the fraction q of the sorted values
+def percentile(values, q):
+    if not values:
+        return None
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+# counts of the requests by status and their latencies, shared by the threads of the server
+class Metrics:
+    def __init__(self, window=LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.statuses = {}              # number of requests by status
+        self.latencies = deque(maxlen=window)       # seconds from arrival to answer of the recent requests
+        self.run_times = deque(maxlen=window)       # seconds the recent scripts ran
+
+    # a request turned away or lost with its worker has no latency
+    def record(self, status, latency=None, run_seconds=None):
+        with self.lock:
+            self.requests += 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if latency is not None:
+                self.latencies.append(latency)
+            if run_seconds is not None:
+                self.run_times.append(run_seconds)
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            run_times = sorted(self.run_times)
+            return {
+                'uptime': round(time.time() - self.started, 3),
+                'requests': self.requests,
+                'statuses': dict(self.statuses),
+                'latency': {f'p{int(q * 100)}': percentile(latencies, q) for q in (0.5, 0.9, 0.99)},
+                'run_time': {f'p{int(q * 100)}': percentile(run_times, q) for q in (0.5, 0.9, 0.99)},
+                'latency_max': latencies[-1] if latencies else None,
+            }
+
+
+# the pool of warm workers and the queue in front of it
+class InterpreterService:
+    def __init__(self, workers=None, max_queue=DEFAULT_MAX_QUEUE, timeout=batch.DEFAULT_TIMEOUT, warm=True):
+        self.workers = workers or os.cpu_count()
+        self.max_queue = max_queue
+        self.timeout = timeout          # time limit of a script that does not ask for one
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=batch.init_worker)
+        self.slots = threading.BoundedSemaphore(max_queue)
+        self.lock = threading.Lock()
+        self.active = 0                 # requests waiting or running
+        self.metrics = Metrics()
+        if warm:
+            list(self.pool.map(warm_up, [0.2] * self.workers))
+
+    # Runs the source in a worker, a request can only lower the time limit. Returns the HTTP status and the answer.
+    def run(self, source, timeout=None):
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        start = time.perf_counter()
+        if not self.slots.acquire(blocking=False):
+            self.metrics.record('busy')
+            return 503, {'status': 'busy', 'error': f"{self.max_queue} requests are already waiting"}
+        with self.lock:
+            self.active += 1
+        try:
+            result = self.pool.submit(run_request, (source, timeout)).result()
+        except BrokenProcessPool as e:
+            self.metrics.record('failed')
+            return 500, {'status': 'failed', 'error': f"Worker pool stopped: {e}"}
+        finally:
+            with self.lock:
+                self.active -= 1
+            self.slots.release()
+        latency = time.perf_counter() - start
+        result['seconds'] = latency
+        result['queued_seconds'] = max(latency - result['run_seconds'], 0.0)
+        self.metrics.record(result['status'], latency, result['run_seconds'])
+        return 200, result
+
+    def stats(self):
+        stats = self.metrics.snapshot()
+        with self.lock:
+            stats['active'] = self.active
+        stats['queued'] = max(stats['active'] - self.workers, 0)
+        stats['workers'] = self.workers
+        stats['max_queue'] = self.max_queue
+        return stats
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = 'CASH'
+
+    def do_POST(self):
+        if self.path != '/run':
+            return self.send_json(404, {'error': f"Unknown path {self.path}"})
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8', 'replace')
+        timeout = None
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                request = json.loads(body)
+                source = request['source']
+                timeout = request.get('timeout')
+                if not isinstance(source, str) or not (timeout is None or (isinstance(timeout, (int, float)) and timeout > 0)):
+                    raise TypeError(source)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return self.send_json(400, {'error': 'Expected a JSON object with the source and an optional timeout in seconds'})
+        else:
+            source = body
+        status, answer = self.server.service.run(source, timeout)
+        self.send_json(status, answer)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.send_json(200, self.server.service.stats())
+        elif self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # requests are counted in the metrics instead of logged
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    # a Unix socket has no client address, the handler expects a (host, port) pair
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+# creates the HTTP server of the service, on the Unix socket when one is given
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, verbose=False):
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, RequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), RequestHandler)
+        server.daemon_threads = True
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Runs CASH scripts sent over HTTP in warm worker processes.')
+    arg_parser.add_argument('--host', default=DEFAULT_HOST, help='address to listen on')
+    arg_parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on')
+    arg_parser.add_argument('--socket', help='listen on this Unix socket instead of a port')
+    arg_parser.add_argument('-w', '--workers', type=int, help='worker processes, the number of CPUs by default')
+    arg_parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE,
+                            help='requests waiting or running before new ones are turned away')
+    arg_parser.add_argument('-t', '--timeout', type=float, default=batch.DEFAULT_TIMEOUT,
+                            help='seconds a script may run unless the request asks for less')
+    arg_parser.add_argument('-v', '--verbose', action='store_true', help='log every request')
+    args = arg_parser.parse_args(argv)
+
+    service = InterpreterService(args.workers, args.max_queue, args.timeout)
+    server = make_server(service, args.host, args.port, args.socket, args.verbose)
+    where = args.socket or f"http://{args.host}:{server.server_address[1]}"
+    print(f"CASH server on {where} with {service.workers} workers", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
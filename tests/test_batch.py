@@ -0,0 +1,42 @@
+import json
+import os
+
+import batch
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_collect_scripts_from_directories_globs_and_manifests(tmp_path):
+    for name in ('a.cash', 'b.cash', 'sub/c.cash', 'notes.txt'):
+        write(str(tmp_path / name), '')
+    write(str(tmp_path / 'nightly.txt'), '# every script\nsub/c.cash\n\na.cash\n')
+    assert batch.collect_scripts([str(tmp_path)]) == [str(tmp_path / 'a.cash'), str(tmp_path / 'b.cash')]
+    assert batch.collect_scripts([str(tmp_path / '**' / 'c.cash')]) == [str(tmp_path / 'sub' / 'c.cash')]
+    # duplicates are run once
+    assert batch.collect_scripts([str(tmp_path / 'nightly.txt'), str(tmp_path / 'a.cash')]) == [
+        str(tmp_path / 'sub' / 'c.cash'), str(tmp_path / 'a.cash')]
+
+
+def test_run_batch_writes_output_errors_and_summary(tmp_path):
+    scripts = tmp_path / 'scripts'
+    write(str(scripts / 'ok.cash'), 'x = simple_interest(1000, 5, 2)\ndisplay(x)\n')
+    write(str(scripts / 'clients' / 'broken.cash'), 'display(1)\ndisplay(1/0)\nget("name")\n')
+    write(str(scripts / 'forever.cash'), 'x = 0\nwhile x >= 0:\n    x = x + 1\n')
+    output = tmp_path / 'results'
+    summary = batch.run_batch(batch.collect_scripts([str(scripts / '**' / '*.cash')]), str(output), workers=2, timeout=0.5)
+
+    statuses = {os.path.basename(result['script']): result['status'] for result in summary['results']}
+    assert statuses == {'broken.cash': 'error', 'forever.cash': 'timeout', 'ok.cash': 'ok'}
+    assert summary['counts'] == {'ok': 1, 'error': 1, 'timeout': 1}
+    assert (output / 'ok.out').read_text() == '100.0\n'
+    assert (output / 'ok.err').read_text() == ''
+    assert (output / 'clients' / 'broken.out').read_text().startswith('1\nError in line 2: division by zero\n')
+    assert (output / 'clients' / 'broken.err').read_text() == (
+        'Error in line 2: division by zero\nError in line 3: EOF when reading a line\n')
+    assert 'Time limit of 0.5 seconds exceeded' in (output / 'forever.err').read_text()
+    with open(output / 'summary.json') as f:
+        assert json.load(f)['scripts'] == 3
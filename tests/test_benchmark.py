@@ -0,0 +1,41 @@
+import benchmark
+import compiler
+import finalparser
+
+
+def test_corpus_programs_run_without_errors():
+    for name, generator in benchmark.CORPUS.items():
+        terminal = finalparser.lexer(generator(200))
+        assert "Error" not in terminal, name
+
+
+def test_bench_parser_reports_throughput():
+    result = benchmark.bench_parser(benchmark.straight_line(100), repeat=1)
+    assert result['lines'] == 100
+    assert result['lines_per_s'] > 0
+    assert result['peak_bytes'] > 0
+
+
+def test_bench_parser_compiles_on_every_run(monkeypatch):
+    caches = []
+    original = compiler.get_code_cache
+
+    def get_code_cache(lines):
+        caches.append(original(lines))
+        return caches[-1]
+
+    monkeypatch.setattr(finalparser, 'get_code_cache', get_code_cache)
+    benchmark.bench_parser(benchmark.straight_line(20), repeat=2)
+    assert all(cache.hits == 0 and cache.misses > 0 for cache in caches)
+
+
+def test_nested_if_is_not_folded_away():
+    lines = benchmark.nested_if(200).splitlines()
+    program = compiler.compile_program(lines, optimizer=compiler.Optimizer())
+    assert len(program.instructions) > len(lines) // 2
+
+
+def test_compare_flags_slower_benchmarks():
+    baseline = {'benchmarks': {'a': {'seconds': 1.0}, 'b': {'seconds': 1.0}}}
+    report = {'benchmarks': {'a': {'seconds': 1.1}, 'b': {'seconds': 2.0}, 'c': {'seconds': 5.0}}}
+    assert [name for name, *_ in benchmark.compare(report, baseline, 0.25)] == ['b']
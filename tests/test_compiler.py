@@ -0,0 +1,362 @@
+import io
+import os
+import tracemalloc
+
+import compiler
+import finalparser
+from conftest import ROOT
+from compiler import (compile_program, iter_statements, CodeCache, Optimizer, ProgramCache, ASSIGN, DEF_FUNC, DISPLAY, ERROR, HOIST, JUMP,
+                      RETURN, TEST_WHILE)
+
+
+# runs the CASH source and returns the terminal output as a list of lines
+def run(source, compiled=True):
+    terminal = finalparser.lexer(source, compiled)
+    return terminal.splitlines()
+
+
+def test_sample_matches_line_interpreter():
+    with open(os.path.join(ROOT, "sample.cash")) as f:
+        source = f.read()
+    assert run(source) == run(source, compiled=False)
+
+
+def test_nested_while():
+    source = "i = 0\nwhile i < 3:\n    j = 0\n    while j < 2:\n        display(i * 10 + j)\n        j++\n    i++\n"
+    assert run(source) == ["0", "1", "10", "11", "20", "21"]
+
+
+def test_if_elif_else_runs_one_arm():
+    source = "x = 2\nif x == 1:\n    display(1)\nelif x == 2:\n    display(2)\nelse:\n    display(3)\n"
+    assert run(source) == ["2"]
+
+
+def test_augmented_assignment():
+    source = "x = 10\nx += 2\nx -= 1\nx *= 3\nx %= 5\ndisplay(x)\nx /= 2\ndisplay(x)\n"
+    assert run(source) == ["3", "1.5"]
+
+
+def test_for_over_variable():
+    source = "n = 3\ntotal = 0\nfor k in range(n):\n    total += k\n    display(k)\ndisplay(total)\n"
+    assert run(source) == ["0", "1", "2", "3"]
+
+
+def test_for_iterates_lazily():
+    # the loop sees the items appended by its own body, so the list is not copied first
+    source = "items = [1]\nfor x in items:\n    display(x)\n    if x < 3:\n        items.append(x + 1)\n"
+    assert run(source) == ["1", "2", "3"]
+    source = "n = 2\nfor k in range(n):\n    display(k)\n"
+    assert run(source, compiled=False) == ["0", "1"]
+
+
+def test_for_over_large_range_runs_in_constant_memory():
+    source = "func first(n):\n    for i in range(0, n):\n        return i\ndisplay(first(50000000))\n"
+    tracemalloc.start()
+    try:
+        assert run(source) == ["0"]
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 10 ** 7
+
+
+def test_multiline_function():
+    source = "func add(a, b):\n    c = a + b\n    return c * 2\ndisplay(add(1, 2))\n"
+    assert run(source) == ["6"]
+
+
+def test_recursive_function():
+    source = "func fact(n):\n    if n <= 1:\n        return 1\n    return n * fact(n - 1)\ndisplay(fact(6))\n"
+    assert run(source) == ["720"]
+    assert run(source, compiled=False) == ["720"]
+
+
+def test_function_frames():
+    source = (
+        "total = 100\n"
+        "func scale(items, rate=2):\n"
+        "    total = 0\n"
+        "    for x in items:\n"
+        "        total += x * rate\n"
+        "    return [x * total for x in items]\n"
+        "display(scale([1, 2]))\n"
+        "display(scale(rate=1, items=[3]))\n"
+        "display(total)\n"
+        "display(scale())\n"
+    )
+    assert run(source) == ["[6, 12]", "[9]", "100", "Error in line 10: scale() missing argument 'items'"]
+
+
+def test_function_errors():
+    source = (
+        "return 1\n"
+        "func f(a, a):\n"
+        "    return a\n"
+        "func loop(n):\n"
+        "    return loop(n + 1)\n"
+        "loop(0)\n"
+        "display(\"after\")\n"
+    )
+    assert run(source) == [
+        "Error in line 1: 'return' outside function",
+        "Error in line 2: Invalid parameter 'a'",
+        "Error in line 6: maximum recursion depth exceeded",
+        "after",
+    ]
+
+
+def test_function_body_is_compiled_once():
+    program = compile_program(["func add(a, b):", "    c = a + b", "    return c", "x = add(1, 2)"])
+    op, lineno, function_code, target, name = program.instructions[0]
+    assert op == DEF_FUNC and name == "add"
+    assert function_code.params == ["a", "b"]
+    assert [instruction[0] for instruction in function_code.program.instructions] == [ASSIGN, RETURN]
+
+
+def test_comments_are_skipped():
+    source = "## start\ndisplay(1)\nend ##\n# single\ndisplay(2)\n"
+    assert run(source) == ["2"]
+
+
+def test_parse_time_errors():
+    source = "x+++\nq = \nif 3 > 2\ndisplay(1\n"
+    assert run(source) == [
+        "Error in line 1: Invalid syntax '+++'",
+        "Error in line 2: Invalid syntax",
+        "Error in line 3: Expected ':'",
+        "Error in line 4: Invalid syntax. Check for missing operators or unterminated string literal",
+    ]
+
+
+def test_runtime_errors_continue():
+    source = "display(missing)\nnosuch(1)\nfor k in 5:\n    display(k)\ndisplay(\"after\")\n"
+    assert run(source) == [
+        "Error in line 1: name 'missing' is not defined",
+        "Error in line 2: Function name does not exist",
+        "Error in line 3: for statement should have a valid identifier and range list",
+        "after",
+    ]
+
+
+def test_null_byte_is_reported():
+    assert run("display(1\x00)\n") == [
+        "Error in line 1: Invalid syntax. Check for missing operators or unterminated string literal"
+    ]
+
+
+def test_financial_call_output():
+    parser = finalparser.Parser(finalparser.Tables_Values())
+    parser.parse_code(["compound_interest(10000, 2, 1)"])
+    assert parser.output == [200.0]
+    assert parser.table_values.get_terminal() == "200.0\n"
+
+
+def test_while_lowering():
+    program = compile_program(["while x < 3:", "    x++"])
+    ops = [instruction[0] for instruction in program.instructions]
+    assert ops[0] == TEST_WHILE and ops[-1] == JUMP
+    assert program.instructions[0][3] == len(program.instructions)
+    assert ERROR not in ops
+
+
+def test_code_cache_counts_loop_conditions():
+    lines = ["x = 5", "while x < 8:", "    display(x)", "    x++"]
+    parser = finalparser.Parser(finalparser.Tables_Values(), compiled=False)
+    parser.parse_code(lines)
+    cache = parser.code_cache
+    assert parser.table_values.get_terminal() == "5\n6\n7\n"
+    # the condition and the display are compiled once and reused on later iterations
+    assert cache.misses == 3
+    assert cache.hits == 5
+
+
+def test_code_cache_shared_by_parsers():
+    lines = ["display(1 + 1)"]
+    first = finalparser.Parser(finalparser.Tables_Values())
+    first.parse_code(lines)
+    second = finalparser.Parser(finalparser.Tables_Values())
+    second.parse_code(lines)
+    assert first.code_cache is second.code_cache
+    assert second.code_cache.hits >= 1
+    # the registry keeps a digest of the script, not its text
+    assert all(isinstance(key, bytes) and len(key) == 16 for key in compiler._program_caches)
+
+
+def test_code_cache_evicts_oldest():
+    cache = CodeCache(maxsize=2)
+    cache.compile(1, "1")
+    cache.compile(2, "2")
+    cache.compile(1, "1")
+    cache.compile(3, "3")
+    assert (2, "2", "eval") not in cache.codes
+    assert cache.stats() == {'hits': 1, 'misses': 3, 'size': 2, 'maxsize': 2}
+
+
+def test_stream_matches_parse_code():
+    source = "x = 1\nwhile x < 3:\n    display(x)\n    x++\n## note\nstill ##\nif x == 3:\n    display(\"three\")\nelse:\n    display(\"no\")\ndisplay(missing)\n"
+    assert finalparser.lexer_stream(io.StringIO(source)).splitlines() == run(source)
+
+
+def test_stream_runs_statements_before_reading_the_rest():
+    seen = []
+
+    def lines():
+        for lineno, line in enumerate(["display(1)", "display(2)", "x = 1", "display(x)"], start=1):
+            seen.append(lineno)
+            yield line
+
+    parser = finalparser.Parser(finalparser.Tables_Values())
+    outputs = []
+    original = parser.run_program
+
+    def run_program(program):
+        original(program)
+        outputs.append((len(seen), list(parser.output)))
+
+    parser.run_program = run_program
+    parser.parse_stream(lines())
+    # the first statement ran when only the second line had been read
+    assert outputs[0] == (2, [1])
+    assert parser.table_values.get_terminal() == "1\n2\n1\n"
+
+
+def test_iter_statements_keeps_blocks_together():
+    lines = ["x = 1", "if x:", "    display(x)", "else:", "    display(0)", "", "# c", "display(2)"]
+    chunks = list(iter_statements(lines))
+    assert chunks == [(1, ["x = 1"]), (2, lines[1:7]), (8, ["display(2)"])]
+
+
+def test_directives():
+    program = compile_program(["@memoize(32)", "@pure", "# note", "func f(n):", "    return n", "@pure", "x = 1", "@cache"])
+    assert program.directives == {'memoize': 32}
+    assert program.instructions[0][2].pure
+    assert run("@pure\nx = 1\n@cache\n@memoize(a)\n") == [
+        "Error in line 1: @pure must be followed by a function definition",
+        "Error in line 3: Unknown directive '@cache'",
+        "Error in line 4: @memoize expects a cache size",
+    ]
+    assert [first for first, chunk in iter_statements(["@pure", "func f(n):", "    return n", "x = f(1)"])] == [1, 4]
+
+
+# runs the CASH source with the optimization pass on or off
+def run_optimized(source, optimize=True):
+    table_values = finalparser.Tables_Values()
+    finalparser.Parser(table_values, optimize=optimize).parse_code(source.splitlines())
+    return table_values.get_terminal().splitlines()
+
+
+def test_constant_folding():
+    program = compile_program(["x = 2", "y = x * 3 + 1", "display(y - x)", "z = -x", "display(z ** n)", "x++", "display(x)"],
+                              optimizer=Optimizer())
+    assert [instruction[2].source for instruction in program.instructions] == ['2', '7', '5', '-2', '(-2) ** n', '3', '3']
+    assert run_optimized("x = -2\ndisplay(x ** 2)\ny = 1 / 0\nwhile x < 0:\n    x++\ndisplay(x)\n") == [
+        "4", "Error in line 3: Invalid syntax", "0"]
+
+
+def test_constants():
+    source = "constant RATE = 5\nRATE = 6\nRATE++\nconstant RATE = 1\nfunc f(n):\n    return n * RATE\ndisplay(f(2))\n"
+    expected = [
+        "Error in line 2: Cannot assign to constant 'RATE'",
+        "Error in line 3: Cannot assign to constant 'RATE'",
+        "Error in line 4: Cannot assign to constant 'RATE'",
+        "10",
+    ]
+    assert run_optimized(source) == expected
+    assert run_optimized(source, optimize=False) == expected
+    assert run(source, compiled=False) == expected
+    program = compile_program(source.splitlines(), optimizer=Optimizer())
+    assert "RETURN      Expression('n * 5')" in program.disassemble()
+
+
+def test_dead_branches_are_removed():
+    source = ["debug = False", "if debug:", "    display(1)", "elif 1 > 0:", "    display(2)", "else:", "    display(3)",
+              "while debug:", "    display(4)", "func f():", "    return 5", "    display(6)"]
+    program = compile_program(source, optimizer=Optimizer())
+    assert [instruction[0] for instruction in program.instructions] == [ASSIGN, DISPLAY, DEF_FUNC]
+    assert len(program.instructions[2][2].program.instructions) == 1
+    assert run_optimized("\n".join(source)) == ["2"]
+
+
+def test_loop_invariant_calls_are_hoisted(capsys):
+    source = "p = 1000\nr = 5\nfor i in range(3):\n    display(compound_interest(p, r, 2) + i)\n"
+    program = compile_program(source.splitlines(), optimizer=Optimizer())
+    assert program.instructions[2][0] == HOIST
+    assert run_optimized(source) == run_optimized(source, optimize=False) == ["102.5", "103.5", "104.5"]
+    # the hoisted values are kept out of the variables of the program
+    table_values = finalparser.Tables_Values()
+    finalparser.Parser(table_values).parse_code(
+        source.splitlines() + ["for i in range(1):", "    display(compound_interest(p, r, 2), '__hoisted_1' in vars() or '__hoisted_2' in vars())"])
+    assert table_values.get_terminal().splitlines()[-1] == "(102.5, False)"
+    assert not [name for name in table_values.variables if name.startswith('__hoisted')]
+    assert table_values.get_variable('__hoisted_1') is None
+    # a shadowed function or a call that prints an error still runs on every iteration
+    shadowed = "compound_interest = lambda p, r, t: p\nfor i in range(2):\n    display(compound_interest(1, 2, 3))\n"
+    assert run_optimized(shadowed) == ["1", "1"]
+    capsys.readouterr()
+    assert run_optimized("for i in range(2):\n    display(stock_dividend(1, 0))\n") == ["None", "None"]
+    assert capsys.readouterr().out.count("Error: Total shares cannot be zero.") == 2
+
+
+# runs the lines with a Parser that uses the program cache, returns the terminal output and the Parser
+def run_cached(lines, cache, optimize=True):
+    table_values = finalparser.Tables_Values()
+    parser = finalparser.Parser(table_values, optimize=optimize, program_cache=cache)
+    parser.parse_code(lines)
+    return table_values.get_terminal(), parser
+
+
+def test_program_cache_skips_the_compiler(tmp_path, monkeypatch):
+    source = ("constant rate = 5\nfunc grow(p):\n    return simple_interest(p, rate, 2)\n"
+              "total = 0\nfor k in range(3):\n    total += grow(1000)\ndisplay(total)\nx = 1 +\n")
+    lines = source.split('\n')
+    cache = ProgramCache(str(tmp_path))
+    first, parser = run_cached(lines, cache)
+    assert cache.stats()['files'] == 1 and cache.misses == 1
+    assert [token.lexeme for token in parser.tokens] == [token.lexeme for token in finalparser.Lexer(source).iter_tokens()]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the cached program was compiled again")
+
+    monkeypatch.setattr(finalparser, 'compile_program', fail)
+    second, parser = run_cached(lines, ProgramCache(str(tmp_path)))
+    assert second == first
+    assert parser.program_cache.hits == 1
+    assert parser.tokens[1].lexeme == 'rate'
+
+
+def test_program_cache_key(tmp_path, monkeypatch):
+    cache = ProgramCache(str(tmp_path))
+    lines = ["display(1)"]
+    assert cache.path(lines) != cache.path(["display(2)"])
+    assert cache.path(lines) != cache.path(lines, optimize=False)
+    run_cached(lines, cache)
+    assert cache.load(lines) is not None
+    # another interpreter does not load the programs of this one
+    monkeypatch.setattr(compiler, '_interpreter_version', bytes(16))
+    assert cache.load(lines) is None
+
+
+def test_program_cache_damaged_file_is_compiled_again(tmp_path):
+    cache = ProgramCache(str(tmp_path))
+    lines = ["x = 2", "display(x * 3)"]
+    run_cached(lines, cache)
+    with open(cache.path(lines), 'r+b') as f:
+        f.seek(-8, os.SEEK_END)
+        f.write(b'\0' * 8)
+    output, _ = run_cached(lines, cache)
+    assert output == "6\n"
+    assert cache.load(lines) is not None
+
+
+def test_program_cache_evicts_least_recently_used(tmp_path):
+    cache = ProgramCache(str(tmp_path))
+    scripts = [[f"display({n})"] for n in range(4)]
+    for age, lines in enumerate(scripts):
+        run_cached(lines, cache)
+        os.utime(cache.path(lines), (age, age))
+    size = os.path.getsize(cache.path(scripts[0]))
+    # loading the oldest program makes it the most recently used
+    assert cache.load(scripts[0]) is not None
+    cache.max_bytes = 2 * size
+    cache.evict()
+    assert [os.path.exists(cache.path(lines)) for lines in scripts] == [True, False, False, True]
@@ -0,0 +1,175 @@
+import io
+import queue
+import threading
+import time
+
+import pytest
+
+import finalparser
+from finalparser import Parser, Tables_Values, OutputSink, QueueTarget, BlockTable, BUILTIN_LAYER
+
+
+def test_global_layer_holds_only_program_variables():
+    table_values = Tables_Values()
+    Parser(table_values).parse_code(["x = 1", "y = simple_interest(1000, 5, 2)"])
+    assert set(table_values.variables) == {"__builtins__", "x", "y"}
+    assert table_values.get_variable("y") == 100.0
+
+
+def test_builtin_layer_is_shared_and_read_only():
+    table_values = Tables_Values()
+    assert table_values.get_variable("compound_interest") is BUILTIN_LAYER["compound_interest"]
+    assert table_values.get_variable("range") is range
+    assert table_values.get_variable("Parser") is None
+    with pytest.raises(TypeError):
+        table_values.builtins["x"] = 1
+
+
+def test_program_variable_shadows_builtin():
+    for compiled in (True, False):
+        terminal = finalparser.lexer("range = 3\ndisplay(range)\n", compiled)
+        assert terminal == "3\n"
+        assert Tables_Values().get_variable("range") is range
+
+
+def test_variables_reset_between_programs():
+    table_values = Tables_Values()
+    parser = Parser(table_values)
+    parser.parse_code(["x = 1"])
+    parser.parse_code(["display(x)"])
+    assert table_values.get_variable("x") is None
+    assert table_values.get_terminal().endswith("Error in line 1: name 'x' is not defined\n")
+
+
+def test_output_is_buffered_until_threshold():
+    target = io.StringIO()
+    table_values = Tables_Values(OutputSink([target], flush_threshold=16))
+    table_values.write("12345\n")
+    assert target.getvalue() == ""
+    table_values.write("1234567890\n")
+    assert target.getvalue() == "12345\n1234567890\n"
+    assert table_values.get_terminal() == "12345\n1234567890\n"
+
+
+def test_program_output_reaches_stdout_once(capsys):
+    terminal = finalparser.lexer("x = 2\ndisplay(x)\ndisplay(x * 3)\n")
+    assert terminal == "2\n6\n"
+    assert capsys.readouterr().out == "2\n6\n"
+
+
+def test_in_memory_sink_and_terminal_setter():
+    table_values = Tables_Values(OutputSink(targets=[]))
+    Parser(table_values).parse_code(["display(1 + 1)"])
+    assert table_values.get_terminal() == "2\n"
+    table_values.terminal = "reset\n"
+    assert table_values.terminal == "reset\n"
+
+
+def test_block_table_ends():
+    code = ["while x < 3:", "    x++", "      ", "    if x:", "        y = 1", "display(x)", ""]
+    blocks = BlockTable(code)
+    assert blocks.indent == [0, 4, 6, 4, 8, 0, 0]
+    assert blocks.end(1, 0) == 5
+    assert blocks.end(4, 4) == 5
+    assert blocks.end(7, 0) == 7
+    assert blocks.is_else(5) is False
+
+
+def test_line_interpreter_jumps_over_skipped_blocks():
+    body = "".join(f"        y = {k}\n" for k in range(50))
+    source = "i = 0\nwhile i < 5:\n    i++\n    if i < 0:\n" + body + "display(i)\n"
+    assert finalparser.lexer(source, compiled=False) == "1\n2\n3\n4\n5\n"
+
+
+def test_memoize_directive_caches_pure_builtins():
+    table_values = Tables_Values()
+    parser = Parser(table_values)
+    parser.parse_code(["@memoize(8)", "for i in range(6):", "    x = compound_interest(1000, 5, i % 2)", "display(x)"])
+    assert table_values.get_terminal() == "50.0\n"
+    assert parser.memo.stats() == {'compound_interest': {'hits': 4, 'misses': 2, 'size': 2}}
+    # the shared builtin layer is left alone
+    assert BUILTIN_LAYER["compound_interest"] is finalparser.new_function.compound_interest
+
+
+def test_pure_user_function_is_memoized():
+    source = ["@pure", "func square(n):", "    display(n)", "    return n * n", "display(square(3))", "display(square(3))"]
+    for compiled in (True, False):
+        parser = Parser(Tables_Values(), compiled, memoize=True)
+        parser.parse_code(source)
+        assert parser.table_values.get_terminal() == "3\n9\n9\n"
+        assert parser.memo.stats()['square'] == {'hits': 1, 'misses': 1, 'size': 1}
+
+
+def test_memo_passes_unhashable_calls_through():
+    source = ["@pure", "func f(a, b=0):", "    return len(a) + len(b)", "display(f([1, 2], b=[3]))", "display(f((1,), b=(2,)))"]
+    parser = Parser(Tables_Values(), memoize=True)
+    parser.parse_code(source)
+    assert parser.table_values.get_terminal() == "3\n2\n"
+    assert parser.memo.stats()['f'] == {'hits': 0, 'misses': 1, 'size': 1}
+
+
+def test_memo_is_off_by_default_and_skips_errors(capsys):
+    parser = Parser(Tables_Values())
+    parser.parse_code(["@pure", "func f(n):", "    return n", "display(f(1))"])
+    assert parser.memo is None
+    parser = Parser(Tables_Values(), memoize=True)
+    parser.parse_code(["display(stock_dividend(1, 0))", "display(stock_dividend(1, 0))", "display(yield_ratio([1], 2))"])
+    assert capsys.readouterr().out.count("Total shares cannot be zero") == 2
+    assert parser.memo.stats()['stock_dividend'] == {'hits': 0, 'misses': 2, 'size': 0}
+
+
+def test_library_prints_keep_their_order(capsys):
+    finalparser.lexer("display(1)\nx = stock_dividend(1, 0)\ndisplay(2)\n")
+    assert capsys.readouterr().out == "1\nError: Total shares cannot be zero.\n2\n"
+
+
+def test_running_program_streams_output_and_can_be_cancelled():
+    for compiled in (True, False):
+        output = queue.Queue()
+        table_values = Tables_Values(OutputSink([QueueTarget(output)], flush_threshold=1))
+        parser = Parser(table_values, compiled)
+        worker = threading.Thread(target=parser.parse_code, args=(["x = 0", "display('started')", "while x >= 0:", "    x = x + 1"],))
+        worker.start()
+        # the output arrives while the program is still running
+        assert output.get(timeout=5) == "started\n"
+        time.sleep(0.05)
+        assert worker.is_alive()
+        parser.cancel()
+        worker.join(timeout=5)
+        assert not worker.is_alive()
+        assert table_values.get_terminal() == "started\nProgram stopped\n"
+        assert table_values.get_variable("x") > 0
+        assert not parser.cancelled
+
+
+def test_hooks_see_statements_blocks_errors_and_output():
+    source = ["func sign(n):", "    if n < 0:", "        return -1", "    return 1", "display(sign(-5))", "y = (",
+              "display(nope)"]
+    events = []
+    table_values = Tables_Values(OutputSink([]))
+    parser = Parser(table_values)
+    parser.add_hook('on_statement', lambda lineno: events.append(('line', lineno)))
+    parser.add_hook('on_block_enter', lambda kind, lineno: events.append(('enter', kind, lineno)))
+    parser.add_hook('on_block_exit', lambda kind, lineno: events.append(('exit', kind, lineno)))
+    parser.add_hook('on_error', lambda message, e: events.append(('error', type(e).__name__ if e else None)))
+    parser.add_hook('on_output', lambda text: events.append(('output', text)))
+    with pytest.raises(ValueError):
+        parser.add_hook('on_nothing', print)
+    parser.parse_code(source)
+    assert events[:10] == [('enter', 'script', 1), ('line', 1), ('line', 5), ('enter', 'func', 1), ('line', 2),
+                           ('enter', 'if', 2), ('line', 3), ('exit', 'if', 2), ('exit', 'func', 1), ('line', 6)]
+    assert events[10:13] == [('error', None), ('line', 7), ('error', 'NameError')]
+    assert events[13:] == [('output', table_values.get_terminal()), ('exit', 'script', 1)]
+    plain = Tables_Values(OutputSink([]))
+    Parser(plain).parse_code(source)
+    assert plain.get_terminal() == table_values.get_terminal()
+
+
+def test_programs_without_hooks_are_not_traced():
+    table_values = Tables_Values(OutputSink([]))
+    parser = Parser(table_values)
+    parser.add_hook('on_error', lambda message, e: None)
+    parser.parse_code(["i = 0", "while i < 2:", "    i++"])
+    assert not parser.traced
+    assert [op for op, *_ in parser.program.instructions] == [finalparser.ASSIGN, finalparser.TEST_WHILE,
+                                                              finalparser.INCREMENT, finalparser.JUMP]
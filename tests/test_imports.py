@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+# import time allowed for the interpreter modules, in seconds
+IMPORT_BUDGET = 0.3
+
+IMPORT_SCRIPT = """
+import os, sys, time
+start = time.perf_counter()
+import finalparser, lexer, plot, new_function, compiler
+elapsed = time.perf_counter() - start
+heavy = [name for name in ('numpy', 'matplotlib', 'prettytable') if name in sys.modules]
+print(elapsed)
+print(','.join(heavy))
+print(','.join(sorted(os.listdir('symboltables'))))
+"""
+
+
+def run_import():
+    result = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=ROOT, capture_output=True, text=True, check=True)
+    return result.stdout.splitlines()
+
+
+def test_import_has_no_side_effects():
+    before = sorted(os.listdir(os.path.join(ROOT, "symboltables")))
+    elapsed, heavy, tables = run_import()
+    assert heavy == ""
+    assert tables == ','.join(before)
+
+
+def test_import_time_budget():
+    # best of three runs, so a busy machine does not fail the check
+    elapsed = min(float(run_import()[0]) for _ in range(3))
+    assert elapsed < IMPORT_BUDGET
@@ -0,0 +1,167 @@
+import csv
+import io
+import json
+import mmap
+import os
+import random
+
+from conftest import ROOT
+import lexer
+from lexer import IncrementalLexer, Lexer, Token, TOKEN_IDS
+
+SAMPLE = os.path.join(ROOT, "sample.cash")
+
+
+def tokens(code, scanner):
+    return [repr(token) for token in Lexer(code, scanner).tokenize()]
+
+
+def test_table_scanner_matches_classic_on_sample():
+    with open(SAMPLE) as f:
+        code = f.read()
+    assert tokens(code, 'table') == tokens(code, 'classic')
+
+
+def test_table_scanner_matches_classic_on_edge_cases():
+    cases = [
+        'x+++\n',
+        'a_b __ _a a__b 1.5 1. 1.2.3 .5\n',
+        'display("a") \'b"c\' "open\n',
+        '## start\ntext 12 here\nend ##\n# single\n',
+        'x /= 2 != 3 <= 4 >= 5 == 6 ^ 7 $ \r\n',
+        'é² naïve\n',
+    ]
+    for code in cases:
+        assert tokens(code, 'table') == tokens(code, 'classic'), code
+
+
+def test_table_scanner_matches_classic_on_random_input():
+    alphabet = list('ab_Z09. \t"\'#+-=<>!*/%^(){}[]:;,|&$\r') + ['##', 'if ', 'display', '\n']
+    rng = random.Random(7)
+    for _ in range(2000):
+        code = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        assert tokens(code, 'table') == tokens(code, 'classic'), repr(code)
+
+
+def test_operators_use_longest_match():
+    result = Lexer('x += 1 == 2').tokenize()
+    assert [token.type for token in result] == ['ID', 'ADD_EQUAL', 'INT', 'EQTO_OP', 'INT']
+    assert isinstance(result[0], Token)
+
+
+def test_iter_lines_matches_pass_data():
+    code = 'a = 1\r\nb\n\nif x:\n    y\n'
+    expected = Lexer(code).pass_data()
+    assert list(Lexer(code).iter_lines()) == expected
+    assert list(Lexer(io.StringIO(code)).iter_lines(chunk_size=3)) == expected
+    assert list(Lexer(io.BytesIO(code.encode())).iter_lines(chunk_size=2)) == expected
+
+
+def test_iter_tokens_reads_lazily():
+    source = io.StringIO('x = 1\n' * 50000)
+    tokens = Lexer(source).iter_tokens()
+    first = next(tokens)
+    assert first.type == 'ID'
+    assert source.tell() < len('x = 1\n' * 50000)
+
+
+def test_iter_tokens_from_mmap(tmp_path):
+    path = tmp_path / "script.cash"
+    path.write_bytes('x = "é"\n'.encode())
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        streamed = [repr(token) for token in Lexer(mapped).iter_tokens()]
+    assert streamed == [repr(token) for token in Lexer('x = "é"\n').tokenize()]
+
+
+def test_token_is_slotted_with_interned_type():
+    token = Token('ADD_OP', '+', 1, 0, 0, '')
+    assert not hasattr(token, '__dict__')
+    assert token.type == 'ADD_OP'
+    assert token.type_id == TOKEN_IDS['ADD_OP']
+    assert repr(token) == "Token(type='ADD_OP', lexeme='+', lineno=1, index=0, end=0)"
+
+
+def test_token_buffer_matches_token_list():
+    with open(SAMPLE) as f:
+        code = f.read()
+    code += '\n## start\ntext ##\n\n"open\nx+++ \'a"b\'\n'
+    buffer = Lexer(code).tokenize_buffer()
+    expected = Lexer(code).tokenize()
+    assert len(buffer) == len(expected)
+    assert repr(buffer) == repr(expected)
+    assert repr(buffer[-1]) == repr(expected[-1])
+    assert [buffer.type(i) for i in range(len(buffer))] == [token.type for token in expected]
+    assert [buffer.lexeme(i) for i in range(len(buffer))] == [token.lexeme for token in expected]
+
+
+def test_incremental_lexer_matches_full_lexing_after_edits():
+    with open(SAMPLE) as f:
+        code = f.read()
+    pieces = ['##', '\n', '## c ##', 'x = 1', '"s"', '# c', 'abc\n##\n', '12.5', '\n\n', '']
+    rng = random.Random(3)
+    incremental = IncrementalLexer(code)
+    for _ in range(300):
+        start = rng.randrange(len(code) + 1)
+        stop = min(len(code), start + rng.randrange(10))
+        text = rng.choice(pieces)
+        # positions as (line number, column)
+        first = (code.count('\n', 0, start) + 1, start - code.rfind('\n', 0, start) - 1)
+        last = (code.count('\n', 0, stop) + 1, stop - code.rfind('\n', 0, stop) - 1)
+        code = code[:start] + text + code[stop:]
+        incremental.edit(first, last, text)
+        assert tokens(code, 'table') == [repr(token) for token in incremental.tokens]
+
+
+def test_incremental_lexer_rescans_only_the_changed_lines():
+    code = 'x = 1\n' * 1000 + '## comment\nstill comment\n##\n' + 'y = 2\n' * 1000
+    incremental = IncrementalLexer(code)
+    # the line after an edit is scanned too, it starts from the end of the last token of the edited line
+    assert incremental.edit((10, 4), (10, 5), '42') == (10, 2, 2)
+    # opening a comment changes every line up to the one that closes it
+    assert incremental.update(code.replace('x = 1\n', '## open\n', 1)) == (1, 1004, 1004)
+    assert incremental.update(code) == (1, 1004, 1004)
+    # a new line renumbers the tokens after it without scanning them
+    assert incremental.edit((500, 0), (500, 0), 'z\n') == (500, 1, 2)
+    assert tokens(incremental.code, 'table') == [repr(token) for token in incremental.tokens]
+
+
+def test_symbol_page():
+    incremental = IncrementalLexer('x = 1\n\ny = 2 + 3\n')
+    rows, last_line = incremental.symbol_page(2, 3)
+    assert rows == [lexer.symbol_row(token) for token in incremental.tokens[2:5]]
+    assert last_line == 3
+    assert incremental.symbol_page(6, 3) == ([lexer.symbol_row(token) for token in incremental.tokens[6:]], None)
+    assert incremental.row_count() == 8
+
+
+def test_symbol_table_formats(tmp_path, monkeypatch, capsys):
+    with open(SAMPLE) as f:
+        code = f.read()
+    expected = Lexer(code).tokenize()
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('symboltables')
+
+    path = lexer.run(code, show=False)
+    with open(path) as f:
+        assert f.read().splitlines()[2:] == [lexer.symbol_row(token) for token in expected]
+
+    path = lexer.run(code, format='csv', show=False)
+    with open(path, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == lexer.SYMBOL_COLUMNS
+    assert rows[1:] == [[str(token.lineno), token.lexeme, token.type, str(token.index + 1), token.error] for token in expected]
+
+    path = lexer.run(code, format='jsonl', show=False)
+    with open(path) as f:
+        assert [json.loads(line)['lexeme'] for line in f] == [token.lexeme for token in expected]
+
+    path = lexer.run(code, format='binary', show=False)
+    with open(path, 'rb') as f:
+        assert [repr(token) for token in lexer.read_symbols(f)] == [repr(token) for token in expected]
+    assert capsys.readouterr().out == ''
+
+    # nothing is written without save, the table is only printed
+    os.remove(path)
+    assert lexer.run('x = 1', format='binary', save=False) is None
+    assert len(os.listdir('symboltables')) == 3
+    assert capsys.readouterr().out.splitlines()[2] == lexer.symbol_row(Token('ID', 'x', 1, 0, 0))
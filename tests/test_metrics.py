@@ -0,0 +1,69 @@
+import os
+
+from finalparser import Parser, Tables_Values
+from metrics import MetricsCollector
+
+
+SOURCE = """x = 0
+func square(n):
+    return n * n
+for k in range(3):
+    x += square(k)
+while x > 1:
+    x = x - 2
+if x == 0:
+    display("even")
+else:
+    display("odd")
+display(undefined_name)
+"""
+
+
+# runs the source with a collector attached, returns the collector
+def collect(source, compiled=True, labels=None):
+    table_values = Tables_Values()
+    parser = Parser(table_values, compiled=compiled)
+    collector = MetricsCollector(labels).attach(parser)
+    parser.parse_code(source.split('\n'))
+    return collector
+
+
+def test_counters():
+    collector = collect(SOURCE)
+    assert collector.scripts == 1
+    assert collector.loop_iterations == {('for', 4): 3, ('while', 6): 2}
+    assert collector.blocks == {'for': 3, 'func': 3, 'while': 2, 'else': 1}
+    # 4 lines run once, the for header 4 times, its body 3 times, square's return 3 times, the while header 3 times
+    # and its body twice, the if and else arm once each
+    assert collector.statements == 1 + 1 + 4 + 3 + 3 + 3 + 2 + 1 + 1 + 1
+    assert collector.errors == {'NameError': 1}
+    terminal = collector.parser.table_values.get_terminal()
+    assert terminal.startswith("odd\nError in line 12")
+    assert collector.output_bytes == len(terminal.encode())
+    assert collector.peak_variables == 3
+    assert collector.cache_misses + collector.cache_hits > 0
+
+
+def test_line_by_line_interpreter():
+    collector = collect("i = 0\nwhile i < 3:\n    i = i + 1\nfor k in range(2):\n    display(k)\nx = (\n", compiled=False)
+    assert collector.loop_iterations == {('while', 2): 3, ('for', 4): 2}
+    assert collector.statements == 1 + 1 + 3 + 1 + 2 + 1
+    assert collector.errors == {'CompileError': 1}
+    assert collector.output_bytes == len("0\n1\n") + len("Error in line 6: Invalid syntax\n")
+
+
+def test_prometheus_export(tmp_path):
+    collector = collect(SOURCE, labels={'job': 'night"ly'})
+    path = str(tmp_path / 'cash.prom')
+    collector.write_prometheus(path)
+    with open(path) as f:
+        text = f.read()
+    assert os.listdir(str(tmp_path)) == ['cash.prom']
+    assert '# TYPE cash_statements_total counter\n' in text
+    assert 'cash_loop_iterations_total{job="night\\"ly",kind="for",line="4"} 3\n' in text
+    assert 'cash_errors_total{job="night\\"ly",type="NameError"} 1\n' in text
+    assert 'cash_peak_variables{job="night\\"ly"} 3\n' in text
+    # every sample line is a name, optional labels and a number
+    for row in text.splitlines():
+        if not row.startswith('#'):
+            float(row.rsplit(' ', 1)[1])
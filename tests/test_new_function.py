@@ -0,0 +1,66 @@
+import itertools
+
+import numpy as np
+
+import finalparser
+from new_function import *
+
+
+# each financial function with argument values to combine
+CASES = [
+    (simple_interest, simple_interest_batch, [[1000, 2500.5], [2, 7.5], [1, 3]]),
+    (compound_interest, compound_interest_batch, [[1000, 2500.5], [2, 7.5], [1, 3], [1, 12]]),
+    (simple_annuity, simple_annuity_batch, [[500, 120], [4, 6.5], [2, 10], [1, 12]]),
+    (stock_dividend, stock_dividend_batch, [[1000, 333], [10, 7]]),
+    (div_pershare, div_pershare_batch, [[0.05, 0.1], [100, 25], [10, 300]]),
+    (yield_ratio, yield_ratio_batch, [[2.5, 10], [50, 3]]),
+    (coupon_payment, coupon_payment_batch, [[1000, 5000], [4, 6.25], [2, 4]]),
+    (coupon_amount, coupon_amount_batch, [[1000, 5000], [4, 6.25], [2, 4]]),
+    (loan_principal, loan_principal_batch, [[10000, 2500], [5, 8.5], [2, 5], [1, 12]]),
+    (loanfv_pin, loanfv_pin_batch, [[10000, 2500], [5, 8.5], [1, 12]]),
+    (loanfv_rtm, loanfv_rtm_batch, [[150, 99.99], [2, 5], [1, 12]]),
+]
+
+
+def test_batch_matches_scalar():
+    for scalar, batch, values in CASES:
+        rows = list(itertools.product(*values))
+        columns = [list(column) for column in zip(*rows)]
+        result = batch(*columns)
+        assert result.tolist() == [scalar(*row) for row in rows], scalar.__name__
+
+
+def test_batch_broadcasts_scalars_and_arrays():
+    result = simple_interest_batch(np.array([[1000], [2000]]), [5, 10], 2)
+    assert result.shape == (2, 2)
+    assert result.tolist() == [[100.0, 200.0], [200.0, 400.0]]
+
+
+def test_batch_masks_invalid_rows_without_printing(capsys):
+    result = yield_ratio_batch([10, 20, "x", None], [2, 0, 1, 1])
+    assert result.mask.tolist() == [False, True, True, True]
+    assert result.compressed().tolist() == [5.0]
+    assert capsys.readouterr().out == ""
+
+
+def test_batch_rounds_like_round():
+    assert simple_interest_batch([4868.75], [11.8], [18]).tolist() == [simple_interest(4868.75, 11.8, 18)] == [10341.23]
+    rng = np.random.default_rng(3)
+    principal = np.round(rng.uniform(100, 10000, 2000), 2)
+    rate = np.round(rng.uniform(0.5, 15, 2000), 1)
+    time = rng.integers(1, 30, 2000)
+    expected = [simple_interest(*row) for row in zip(principal.tolist(), rate.tolist(), time.tolist())]
+    assert simple_interest_batch(principal, rate, time).tolist() == expected
+
+
+def test_batch_masks_division_by_zero_in_any_step(capsys):
+    # inf ** 0 is 1, so the rows with a frequency of 0 would otherwise look valid
+    assert compound_interest_batch([1000, 1000], 5, 2, [0, 1]).mask.tolist() == [True, False]
+    assert simple_annuity_batch([100, 100], 5, 2, [0, 12]).mask.tolist() == [True, False]
+    assert loan_principal_batch([1000, 1000], 5, 2, [0, 12]).mask.tolist() == [True, False]
+    assert capsys.readouterr().out == ""
+
+
+def test_batch_call_from_cash():
+    terminal = finalparser.lexer("p = [1000, 2000]\nsimple_interest_batch(p, 5, 2)\ndisplay(loan_principal_batch(p, 5, 2, 12).sum())\n")
+    assert terminal.splitlines() == ["[100.0 200.0]", "2715.08"]
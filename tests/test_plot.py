@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+
+import plot
+
+
+def test_plots_render_to_files(tmp_path, capsys):
+    plot.set_output('file', str(tmp_path), 'svg')
+    try:
+        plot.plot_sint((1000, 5, 10))
+        plot.plot_coup((1000, 4), (5000, 6.25))
+        paths = plot.take_rendered()
+    finally:
+        plot.set_output()
+    assert [os.path.basename(path).rsplit('_', 1)[0] for path in paths] == ['plot_sint', 'plot_coup']
+    for path in paths:
+        with open(path) as f:
+            assert '<svg' in f.read()
+    assert 'Interest A: 1500.000' in capsys.readouterr().out
+
+
+def test_plots_render_to_bytes_and_reuse_the_figure(capsys):
+    plot.set_output('bytes')
+    try:
+        plot.plot_loan((20000, 5, 3, 12))
+        figure = plot._output.figure
+        plot.plot_yr((2.5, 50))
+        rendered = plot.take_rendered()
+    finally:
+        plot.set_output()
+    assert [name for name, _ in rendered] == ['plot_loan', 'plot_yr']
+    assert all(image.startswith(b'\x89PNG') for _, image in rendered)
+    # one figure for every plot, cleared after each render
+    assert plot._output.figure is figure
+    assert figure.axes == []
+
+
+def test_render_batch(tmp_path):
+    jobs = [('plot_sint', ((1000, 5, 10),)), ('plot_cint', ((1000, 5, 10, 4),))]
+    results = plot.render_batch(jobs, str(tmp_path), workers=2)
+    assert [len(paths) for paths, _ in results] == [1, 1]
+    assert all(os.path.exists(paths[0]) for paths, _ in results)
+    assert results[1][1].startswith('Interest A:')
+
+
+def test_unknown_output_is_rejected():
+    try:
+        plot.set_output('window')
+    except ValueError as error:
+        assert 'window' in str(error)
+    else:
+        raise AssertionError('set_output accepted an unknown mode')
+
+
+def test_decimation_keeps_the_envelope():
+    x = np.arange(100000, dtype=float)
+    values = np.column_stack([np.sin(x / 500), np.where(x < 50000, x, np.nan)])
+    drawn_x, drawn = plot._decimate(x, values, 600)
+    assert len(drawn_x) == len(drawn) == 600
+    assert np.nanmax(drawn, axis=0).tolist() == np.nanmax(values, axis=0).tolist()
+    assert np.nanmin(drawn, axis=0).tolist() == np.nanmin(values, axis=0).tolist()
+    # short series are drawn as they are
+    assert len(plot._decimate(x[:10], values[:10], 600)[0]) == 10
+
+
+def test_long_series_are_decimated_to_the_plot_width(monkeypatch, capsys):
+    figure = plot._agg_figure()
+    figure.clear()
+    monkeypatch.setattr(plot, '_render', lambda name, draw: draw(figure.add_subplot()))
+    plot.plot_sint((1000, 5, 100000), (2000, 3, 10))
+    lines = list(figure.axes[0].lines)
+    figure.clear()
+    assert [line.get_label() for line in lines] == ['Interest A', 'Interest B']
+    assert max(len(line.get_xdata()) for line in lines) < 1000
+    assert capsys.readouterr().out == 'Interest A: 5001000.000\nInterest B: 2600.000\n'
@@ -0,0 +1,115 @@
+import json
+
+import plot
+from finalparser import Parser, Tables_Values
+from compiler import compile_program, LINE
+from profiler import Profiler
+
+
+# a clock that moves one second on every reading, so the times only depend on the events
+class TickClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+SOURCE = """total = 0
+func grow(p, n):
+    if n == 0:
+        return p
+    return grow(p + simple_interest(p, 5, 1), n - 1)
+for k in range(3):
+    total += grow(1000, 2)
+i = 0
+while i < 4:
+    if i == 1:
+        i += 2
+    elif i == 3:
+        i++
+    else:
+        i++
+display(total)
+"""
+
+
+# runs the source with a profiler, returns the terminal output and the Profiler
+def profile(source, compiled=True, clock=None):
+    table_values = Tables_Values()
+    profiler = Profiler(clock or TickClock())
+    Parser(table_values, compiled=compiled, profiler=profiler).parse_code(source.split('\n'))
+    return table_values.get_terminal(), profiler
+
+
+def test_line_hits_and_calls():
+    output, profiler = profile(SOURCE)
+    table_values = Tables_Values()
+    Parser(table_values).parse_code(SOURCE.split('\n'))
+    assert output == table_values.get_terminal() == "3307.5\n"
+    hits = {lineno: stats[0] for lineno, stats in profiler.lines.items()}
+    assert hits == {1: 1, 2: 1, 3: 9, 4: 3, 5: 6, 6: 4, 7: 3, 8: 1, 9: 4, 10: 3, 11: 1, 12: 2, 13: 1, 15: 1, 16: 1}
+    assert profiler.kinds['func'][0] == 9 and profiler.kinds['financial'][0] == 6
+    assert profiler.functions[('func', 'grow')][0] == 9
+
+
+def test_times_add_up():
+    _, profiler = profile(SOURCE)
+    report = profiler.to_dict()
+    # every tick is charged to exactly one stack
+    assert sum(profiler.stacks.values()) == report['total']
+    for line in report['lines']:
+        assert 0 <= line['self'] <= line['cumulative'] <= report['total']
+    # the recursive calls of grow are inside the time of the outermost one
+    assert report['kinds']['func']['seconds'] == profiler.lines[7][2] - profiler.lines[7][1]
+    assert report['kinds']['financial']['seconds'] < report['kinds']['func']['seconds']
+
+
+def test_reports():
+    _, profiler = profile(SOURCE)
+    text = profiler.report('text')
+    assert '     7          3' in text and 'grow(1000, 2)' in text
+    assert json.loads(profiler.report('json'))['lines'][0] == {'line': 1, 'hits': 1, 'self': 1, 'cumulative': 1,
+                                                               'code': 'total = 0'}
+    stacks = [row.rsplit(' ', 1)[0] for row in profiler.report('collapsed').splitlines()]
+    assert '<script>:7;grow:5;grow:5;simple_interest' in stacks
+    assert '<script>:7;grow:5;grow:4' not in stacks and '<script>:7;grow:5;grow:5;grow:4' in stacks
+
+
+def test_plot_calls_are_timed(capsys):
+    plot.set_output('bytes')
+    try:
+        _, profiler = profile("plot_sint((1000, 5, 10))\n")
+        plot.take_rendered()
+    finally:
+        plot.set_output()
+    assert profiler.kinds['plot'][0] == 1
+    capsys.readouterr()
+
+
+def test_line_by_line_interpreter_is_profiled():
+    output, profiler = profile("x = 1\n# a comment\ndisplay(simple_interest(1000, 5, x))\n", compiled=False)
+    assert output == "50.0\n"
+    assert sorted(profiler.lines) == [1, 3]
+    assert profiler.kinds['financial'][0] == 1
+
+
+def test_memoized_and_hoisted_calls_still_work():
+    source = "@memoize\np = 1000\nfor i in range(3):\n    display(compound_interest(p, 5, 2) + i)\n"
+    table_values = Tables_Values()
+    parser = Parser(table_values, profiler=Profiler())
+    parser.parse_code(source.split('\n'))
+    assert table_values.get_terminal() == "102.5\n103.5\n104.5\n"
+    # hoisted out of the loop and called once
+    assert parser.profiler.kinds['financial'][0] == 1
+    assert parser.memo.stats()['compound_interest']['misses'] == 1
+
+
+def test_no_line_instructions_without_a_profiler():
+    table_values = Tables_Values()
+    parser = Parser(table_values)
+    parser.parse_code(SOURCE.split('\n'))
+    assert LINE not in [instruction[0] for instruction in parser.program.instructions]
+    traced = compile_program(SOURCE.split('\n'), trace=True)
+    assert LINE in [instruction[0] for instruction in traced.instructions]
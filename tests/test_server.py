@@ -0,0 +1,94 @@
+import http.client
+import json
+import socket
+import threading
+import urllib.request
+
+import pytest
+
+import server
+
+
+@pytest.fixture(scope="module")
+def service():
+    service = server.InterpreterService(workers=1, max_queue=4, timeout=5)
+    yield service
+    service.close()
+
+
+@pytest.fixture
+def url(service):
+    httpd = server.make_server(service, port=0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def post(url, body, content_type='text/plain'):
+    request = urllib.request.Request(url + '/run', data=body.encode(), headers={'Content-Type': content_type})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as error:
+        return error.code, json.load(error)
+
+
+def test_run_returns_output_and_structured_errors(url):
+    status, answer = post(url, 'x = simple_interest(1000, 5, 2)\ndisplay(x)\ndisplay(y)\n')
+    assert status == 200
+    assert answer['status'] == 'error'
+    assert answer['output'] == "100.0\nError in line 3: name 'y' is not defined\n"
+    assert answer['errors'] == [{'line': 3, 'message': "name 'y' is not defined"}]
+    assert answer['seconds'] >= answer['run_seconds'] > 0
+
+
+def test_every_request_starts_fresh(url):
+    post(url, 'secret = 42\n')
+    status, answer = post(url, json.dumps({'source': 'display(secret)\n'}), 'application/json')
+    assert answer['errors'][0]['message'] == "name 'secret' is not defined"
+
+
+def test_time_limit_and_bad_requests(url):
+    status, answer = post(url, json.dumps({'source': 'x = 0\nwhile x >= 0:\n    x = x + 1\n', 'timeout': 0.3}),
+                          'application/json')
+    assert (status, answer['status']) == (200, 'timeout')
+    assert answer['errors'] == [{'line': None, 'message': 'Program stopped'}]
+    assert post(url, json.dumps({'code': 'x = 1'}), 'application/json')[0] == 400
+
+
+def test_full_queue_is_turned_away(service):
+    for _ in range(service.max_queue):
+        service.slots.acquire()
+    try:
+        assert service.run('x = 1\n')[0] == 503
+    finally:
+        for _ in range(service.max_queue):
+            service.slots.release()
+
+
+def test_metrics(url):
+    post(url, 'x = 1\n')
+    with urllib.request.urlopen(url + '/metrics') as response:
+        metrics = json.load(response)
+    assert metrics['requests'] >= 1
+    assert metrics['statuses']['ok'] >= 1
+    assert metrics['latency']['p50'] > 0
+    assert metrics['workers'] == 1
+
+
+def test_unix_socket(service, tmp_path):
+    path = str(tmp_path / 'cash.sock')
+    httpd = server.make_server(service, socket_path=path)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        connection = http.client.HTTPConnection('localhost')
+        connection.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.sock.connect(path)
+        connection.request('POST', '/run', body=b'display(2 * 21)\n')
+        answer = json.load(connection.getresponse())
+        assert answer['output'] == '42\n'
+    finally:
+        httpd.shutdown()
+        httpd.server_close()